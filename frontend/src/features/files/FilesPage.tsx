@@ -601,7 +601,9 @@ export function FilesPage({
                         onClick={() => openScreenshot(ss)}
                       >
                         <img
-                          src={`${API_BASE}/api/screenshots/${ss.id}`}
+                          src={`${API_BASE}${ss.thumbnail_url ?? `/api/screenshots/${ss.id}/thumbnail`}`}
+                          loading="lazy"
+                          decoding="async"
                           alt={ss.caption || ss.filename}
                           className="h-full w-full object-cover"
                         />
@@ -1178,7 +1180,7 @@ export function FilesPage({
             <>
               <div className="overflow-hidden rounded-[var(--radius-md)] border border-[var(--md-sys-color-outline-variant)] bg-[var(--md-sys-color-surface-container)] p-2">
                 <img
-                  src={`${API_BASE}/api/screenshots/${selectedScreenshot.id}`}
+                  src={`${API_BASE}${selectedScreenshot.url ?? `/api/screenshots/${selectedScreenshot.id}`}`}
                   alt={selectedScreenshot.caption || selectedScreenshot.filename}
                   className="max-h-[60vh] w-full object-contain"
                 />
@@ -76,6 +76,9 @@ export type Screenshot = {
   filename: string;
   caption: string;
   created_at: string;
+  version?: string;
+  url?: string;
+  thumbnail_url?: string;
 };
 
 export type FileEntry = {
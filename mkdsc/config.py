@@ -28,6 +28,29 @@ DEFAULT_CONFIG = {
     "connection_optimizer": {
         "auto_switch": False,
     },
+    "cache": {
+        "thumbnails_mb": 256,
+        "files_mb": 2048,
+    },
+    "transfers": {
+        "max_rate_mbps": 0,
+        "session_rate_mbps": 8,
+        "background_rate_mbps": 4,
+    },
+    "gallery": {
+        "storage_format": "original",
+        "lossy_quality": 85,
+        "keep_originals": False,
+        "reencode_workers": 2,
+    },
+    "retention": {
+        "enabled": False,
+        "interval_minutes": 30,
+        "batch_size": 200,
+        "screenshots": {"max_mb": 0, "max_age_days": 0},
+        "recordings": {"max_mb": 0, "max_age_days": 0},
+        "logs": {"max_mb": 0, "max_age_days": 0},
+    },
     "recording": {
         "output_dir": "",
         "format": "mp4",
@@ -37,6 +60,15 @@ DEFAULT_CONFIG = {
         "stay_awake": False,
         "show_touches": False,
         "turn_screen_off": False,
+        "max_sessions": 0,
+        "max_write_mbps": 0,
+        "min_free_mb": 1024,
+        "segment_seconds": 0,
+        "segment_size_mb": 0,
+        "rolling_window_minutes": 0,
+        "ready_timeout_s": 10,
+        "faststart": True,
+        "postprocess_rate_mbps": 200,
     },
     "cli": {
         "show_banner": True,
@@ -45,6 +77,7 @@ DEFAULT_CONFIG = {
         "bitrate": "8M",
         "maxsize": "1080",
         "keyboard": "uhid",
+        "video_codec": "",
         "presets": deepcopy(DEFAULT_PRESETS),
         "stay_awake": False,
         "show_touches": False,
@@ -167,4 +200,4 @@ def update_config(patch):
     config = load_config()
     updated = _deep_merge(config, patch)
     save_config(updated)
-    return updated
+    return updated
@@ -49,3 +49,8 @@ def get_screenshots_dir(config=None) -> Path:
     if base_dir == DATA_DIR:
         return DATA_DIR / "screenshots"
     return base_dir / "screenshots"
+
+
+def get_cache_dir(config=None) -> Path:
+    base_dir = get_downloads_base_dir(config)
+    return base_dir / "cache"
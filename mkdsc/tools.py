@@ -302,6 +302,26 @@ def get_device_info(adb_path):
     }
 
 
+def get_device_properties(adb_path, serial=None):
+    """Все системные свойства устройства (вывод getprop) в виде словаря."""
+    cmd = [str(adb_path)]
+    if serial:
+        cmd.extend(["-s", serial])
+    cmd.extend(["shell", "getprop"])
+    result = run_cmd(cmd, show_output=False)
+    if result.returncode != 0:
+        return {}
+
+    properties = {}
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if not line.startswith("[") or "]: [" not in line:
+            continue
+        key, value = line[1:].split("]: [", 1)
+        properties[key] = value[:-1] if value.endswith("]") else value
+    return properties
+
+
 def get_device_wifi_ip(adb_path, serial=None):
     cmd = [str(adb_path)]
     if serial:
@@ -319,17 +339,25 @@ def get_device_wifi_ip(adb_path, serial=None):
     return None
 
 
-def get_setting(adb_path, namespace, key):
-    result = run_cmd([str(adb_path), "shell", "settings", "get", namespace, key], show_output=False)
+def _settings_cmd(adb_path, serial, *args):
+    cmd = [str(adb_path)]
+    if serial:
+        cmd.extend(["-s", serial])
+    cmd.extend(["shell", "settings", *args])
+    return cmd
+
+
+def get_setting(adb_path, namespace, key, serial=None):
+    result = run_cmd(_settings_cmd(adb_path, serial, "get", namespace, key), show_output=False)
     if result.returncode != 0:
         return None
     value = result.stdout.strip()
     return value if value != "null" else None
 
 
-def put_setting(adb_path, namespace, key, value):
-    run_cmd([str(adb_path), "shell", "settings", "put", namespace, key, str(value)], show_output=False)
+def put_setting(adb_path, namespace, key, value, serial=None):
+    run_cmd(_settings_cmd(adb_path, serial, "put", namespace, key, str(value)), show_output=False)
 
 
-def delete_setting(adb_path, namespace, key):
-    run_cmd([str(adb_path), "shell", "settings", "delete", namespace, key], show_output=False)
+def delete_setting(adb_path, namespace, key, serial=None):
+    run_cmd(_settings_cmd(adb_path, serial, "delete", namespace, key), show_output=False)
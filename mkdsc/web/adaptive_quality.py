@@ -0,0 +1,188 @@
+"""
+Адаптивный пресет: битрейт, размер и fps по измеренной ёмкости канала.
+
+Статический пресет не знает, через что подключено устройство: 32M по Wi-Fi
+на 40 Мбит/с даёт только подвисания. Для пресета "adaptive" измеряется
+латентность adb (как в оптимизаторе подключения), пропускная способность
+пробной передачей, а для Wi-Fi - скорость канала и RSSI из cmd wifi status.
+Битрейт берётся как доля оценённой ёмкости, размер и fps - по ступеням
+битрейта. Результат запоминается в профиле устройства и используется
+повторно, пока не устареет.
+
+Эндпоинты:
+- GET /api/adaptive/{serial} - настройки для устройства (измеряет, если сохранённые устарели)
+- POST /api/adaptive/{serial}/measure - измерить канал заново
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from mkdsc.web.connection_optimizer import (
+    get_wifi_link,
+    is_usb_connection,
+    measure_latency,
+    measure_throughput,
+)
+from mkdsc.web.device_profiles import store
+
+router = APIRouter(prefix="/api/adaptive", tags=["adaptive"])
+
+ADAPTIVE_PRESET = "adaptive"
+# Условия Wi-Fi меняются - через 10 минут канал измеряется заново
+ADAPTIVE_MAX_AGE_SECONDS = 600
+
+# Реальная скорость TCP по Wi-Fi - примерно половина скорости канала
+WIFI_GOODPUT_RATIO = 0.5
+# Видео получает часть ёмкости: запас на ключевые кадры, звук и управление
+VIDEO_SHARE = 0.5
+WEAK_RSSI_DBM = -67
+POOR_RSSI_DBM = -75
+HIGH_LATENCY_MS = 60.0
+MIN_BITRATE_MBPS = 2
+MAX_BITRATE_MBPS = 32
+
+# (битрейт от, Мбит/с; --max-size; --max-fps) - от лучшей ступени к худшей
+ADAPTIVE_TIERS = (
+    (20, "2160", 60),
+    (12, "1440", 60),
+    (6, "1080", 60),
+    (4, "1080", 30),
+    (0, "720", 30),
+)
+
+_MEASURE_LOCKS: dict = {}
+
+
+def estimate_capacity(latency_ms: float, throughput_mbps: Optional[float], wifi: Optional[dict]) -> Optional[float]:
+    """Оценка ёмкости канала в Мбит/с по измерениям; None - оценить не из чего."""
+    candidates = []
+    if throughput_mbps:
+        candidates.append(throughput_mbps)
+    if wifi:
+        # Видео идёт с устройства - важна скорость передачи (Tx) устройства
+        link_speed = wifi.get("tx_link_speed_mbps") or wifi.get("link_speed_mbps")
+        if link_speed:
+            candidates.append(link_speed * WIFI_GOODPUT_RATIO)
+    if not candidates:
+        return None
+
+    capacity = min(candidates)
+    rssi = (wifi or {}).get("rssi_dbm")
+    if rssi is not None:
+        # Слабый сигнал - падение скорости и повторные передачи в любой момент
+        if rssi <= POOR_RSSI_DBM:
+            capacity *= 0.5
+        elif rssi <= WEAK_RSSI_DBM:
+            capacity *= 0.75
+    if latency_ms > HIGH_LATENCY_MS:
+        # Высокая латентность на загруженном канале обычно означает и большой джиттер
+        capacity *= 0.75
+    return capacity
+
+
+def choose_settings(capacity_mbps: float) -> dict:
+    """Битрейт, --max-size и --max-fps для оценённой ёмкости канала."""
+    bitrate = int(min(MAX_BITRATE_MBPS, max(MIN_BITRATE_MBPS, capacity_mbps * VIDEO_SHARE)))
+    maxsize, max_fps = next((size, fps) for floor, size, fps in ADAPTIVE_TIERS if bitrate >= floor)
+    return {"bitrate": f"{bitrate}M", "maxsize": maxsize, "max_fps": max_fps}
+
+
+def measure_link(adb_path, serial: str) -> dict:
+    """Измерение канала устройства (блокирующее, несколько секунд)."""
+    connection_type = "usb" if is_usb_connection(serial) else "wifi"
+    latency_ms = measure_latency(str(adb_path), serial)
+    record = {
+        "measured_at": datetime.now().isoformat(),
+        "measured_ts": time.time(),
+        "connection_type": connection_type,
+        "latency_ms": round(latency_ms, 2) if latency_ms != float("inf") else None,
+        "throughput_mbps": None,
+        "wifi": None,
+        "capacity_mbps": None,
+        "settings": None,
+    }
+    if latency_ms == float("inf"):
+        return record
+
+    throughput = measure_throughput(str(adb_path), serial)
+    wifi = get_wifi_link(str(adb_path), serial) if connection_type == "wifi" else None
+    capacity = estimate_capacity(latency_ms, throughput, wifi)
+    record.update({
+        "throughput_mbps": round(throughput, 1) if throughput else None,
+        "wifi": wifi,
+        "capacity_mbps": round(capacity, 1) if capacity else None,
+        "settings": choose_settings(capacity) if capacity else None,
+    })
+    return record
+
+
+def _fresh(record: Optional[dict]) -> bool:
+    return bool(
+        record
+        and record.get("settings")
+        and time.time() - record.get("measured_ts", 0) < ADAPTIVE_MAX_AGE_SECONDS
+    )
+
+
+async def resolve_adaptive(adb_path, serial: Optional[str], refresh: bool = False) -> dict:
+    """
+    Результат adaptive для устройства: свежий сохранённый или новое измерение.
+    Если устройство не ответило, используются последние сохранённые настройки;
+    settings = None - подобрать не удалось (вызывающий берёт обычные значения).
+    """
+    if not serial:
+        return {"source": "default", "reason": "no_serial", "settings": None}
+
+    remembered = (store.get(serial) or {}).get("adaptive")
+    if not refresh and _fresh(remembered):
+        return {**remembered, "source": "remembered"}
+
+    lock = _MEASURE_LOCKS.setdefault(serial, asyncio.Lock())
+    async with lock:
+        remembered = (store.get(serial) or {}).get("adaptive")
+        if not refresh and _fresh(remembered):
+            return {**remembered, "source": "remembered"}
+        record = await run_in_threadpool(measure_link, adb_path, serial)
+        if record["settings"]:
+            await run_in_threadpool(store.update, serial, "adaptive", record)
+            return {**record, "source": "measured"}
+
+    if remembered and remembered.get("settings"):
+        return {**remembered, "source": "remembered", "reason": "measure_failed"}
+    return {**record, "source": "default", "reason": "measure_failed"}
+
+
+def is_adaptive(data: dict, bitrate=None) -> bool:
+    """Запрошен ли адаптивный пресет: preset=adaptive или bitrate=adaptive."""
+    values = (data.get("preset"), bitrate if bitrate is not None else data.get("bitrate"))
+    return any(str(value or "").strip().lower() == ADAPTIVE_PRESET for value in values)
+
+
+def _resolve_adb_path(request: Request):
+    adb_path = getattr(request.app.state, "adb_path", None)
+    if adb_path:
+        return adb_path
+    from mkdsc.tools import get_tool_path
+    return get_tool_path("adb")
+
+
+@router.get("/{serial}")
+async def get_adaptive_settings(serial: str, request: Request):
+    """Настройки adaptive для устройства; при устаревшем результате канал измеряется заново."""
+    result = await resolve_adaptive(_resolve_adb_path(request), serial)
+    if not result.get("settings"):
+        raise HTTPException(status_code=502, detail="Device did not respond to the link measurement")
+    return result
+
+
+@router.post("/{serial}/measure")
+async def measure_adaptive_settings(serial: str, request: Request):
+    """Измеряет канал заново (например, после смены точки доступа)."""
+    result = await resolve_adaptive(_resolve_adb_path(request), serial, refresh=True)
+    if result.get("source") != "measured":
+        raise HTTPException(status_code=502, detail="Device did not respond to the link measurement")
+    return result
@@ -6,6 +6,7 @@
 - POST /api/connection/auto-detect - определить лучшее подключение
 - GET /api/connection/metrics - получить текущие метрики
 """
+import re
 import time
 import subprocess
 from dataclasses import dataclass, asdict
@@ -16,6 +17,15 @@ router = APIRouter(prefix="/api/connection", tags=["connection"])
 
 MAX_WIFI_LATENCY_MS = 120.0
 WIFI_BETTER_RATIO = 0.9
+# Объём пробной передачи для оценки пропускной способности adb-канала
+THROUGHPUT_PROBE_BYTES = 4 * 1024 * 1024
+THROUGHPUT_PROBE_TIMEOUT = 15
+
+_WIFI_RSSI_RE = re.compile(r"RSSI:\s*(-?\d+)")
+# "Link speed" без префикса Tx/Rx - текущая скорость канала
+_WIFI_LINK_SPEED_RE = re.compile(r"(?:^|,)\s*Link speed:\s*(-?\d+)\s*Mbps", re.IGNORECASE)
+_WIFI_TX_SPEED_RE = re.compile(r"Tx Link speed:\s*(-?\d+)\s*Mbps", re.IGNORECASE)
+_WIFI_FREQUENCY_RE = re.compile(r"Frequency:\s*(\d+)\s*MHz", re.IGNORECASE)
 
 
 @dataclass
@@ -67,6 +77,81 @@ def measure_latency(adb_path: str, serial: str, iterations: int = 3) -> float:
     return sum(latencies) / len(latencies)
 
 
+def measure_throughput(adb_path: str, serial: str, size_bytes: int = THROUGHPUT_PROBE_BYTES) -> Optional[float]:
+    """
+    Измеряет пропускную способность канала устройство -> ПК.
+
+    Передаёт size_bytes нулей через adb exec-out (тем же путём идёт видеопоток
+    scrcpy) и делит объём на время передачи без учёта задержки запуска команды.
+
+    Returns:
+        Мбит/с или None, если устройство не ответило
+    """
+    latency_ms = measure_latency(adb_path, serial, iterations=1)
+    if latency_ms == float('inf'):
+        return None
+
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(
+            [adb_path, "-s", serial, "exec-out", f"head -c {int(size_bytes)} /dev/zero"],
+            capture_output=True,
+            timeout=THROUGHPUT_PROBE_TIMEOUT
+        )
+    except (subprocess.TimeoutExpired, OSError):
+        return None
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0 or len(result.stdout) < size_bytes:
+        return None
+
+    # Задержка запуска команды не относится к передаче данных
+    transfer_seconds = max(elapsed - latency_ms / 1000, elapsed * 0.1)
+    return size_bytes * 8 / transfer_seconds / 1_000_000
+
+
+def parse_wifi_status(output: str) -> Optional[dict]:
+    """Разбирает RSSI, скорость канала и частоту из cmd wifi status / dumpsys wifi."""
+    line = next((item for item in output.splitlines() if "RSSI:" in item), None)
+    if line is None:
+        return None
+
+    def _value(pattern):
+        match = pattern.search(line)
+        if not match:
+            return None
+        value = int(match.group(1))
+        # -127 dBm и -1 Mbps - "неизвестно" в WifiInfo
+        if pattern is _WIFI_RSSI_RE:
+            return value if value > -127 else None
+        return value if value > 0 else None
+
+    return {
+        "rssi_dbm": _value(_WIFI_RSSI_RE),
+        "link_speed_mbps": _value(_WIFI_LINK_SPEED_RE),
+        "tx_link_speed_mbps": _value(_WIFI_TX_SPEED_RE),
+        "frequency_mhz": _value(_WIFI_FREQUENCY_RE),
+    }
+
+
+def get_wifi_link(adb_path: str, serial: str) -> Optional[dict]:
+    """
+    Параметры Wi-Fi соединения устройства.
+
+    `cmd wifi status` есть с Android 11; на старых версиях та же строка
+    WifiInfo берётся из `dumpsys wifi`.
+    """
+    for command in (["cmd", "wifi", "status"], ["dumpsys", "wifi"]):
+        try:
+            result = _run_adb(adb_path, ["-s", serial, "shell", *command], timeout=10)
+        except (subprocess.TimeoutExpired, OSError):
+            continue
+        if result.returncode == 0:
+            link = parse_wifi_status(result.stdout)
+            if link:
+                return link
+    return None
+
+
 def get_connection_metrics(adb_path: str, serial: str) -> ConnectionMetrics:
     """Получает метрики для конкретного подключения."""
     conn_type = "usb" if is_usb_connection(serial) else "wifi"
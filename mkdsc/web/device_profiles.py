@@ -0,0 +1,301 @@
+"""
+Профили устройств: возможности кодирования и свойства, по одному на serial.
+
+Устройство проверяется один раз: scrcpy --list-encoders и --list-displays
+плюс getprop. Результат сохраняется в DATA_DIR/device_profiles.json и
+используется при каждом запуске. В режиме video_codec "auto" выбирается
+аппаратный кодировщик H.265, затем AV1, иначе H.264 (кодек scrcpy по
+умолчанию) - при том же качестве H.265 примерно вдвое экономит канал и диск.
+
+Эндпоинты:
+- GET /api/device-profiles - все сохранённые профили
+- GET /api/device-profiles/{serial} - профиль устройства (проверяет, если профиля нет)
+- POST /api/device-profiles/{serial}/probe - проверить устройство заново
+- DELETE /api/device-profiles/{serial} - забыть профиль
+"""
+import asyncio
+import json
+import os
+import re
+import subprocess
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from mkdsc.paths import DATA_DIR
+from mkdsc.tools import get_device_properties
+
+router = APIRouter(prefix="/api/device-profiles", tags=["device-profiles"])
+
+PROFILES_PATH = DATA_DIR / "device_profiles.json"
+PROBE_TIMEOUT_SECONDS = 30
+
+VIDEO_CODECS = ("h264", "h265", "av1")
+AUTO_CODEC = "auto"
+# Порядок предпочтения для auto; H.264 - запасной вариант без явного --video-codec
+AUTO_CODEC_PREFERENCE = ("h265", "av1")
+# Программные кодировщики Android (для старых scrcpy без пометок hw/sw)
+SOFTWARE_ENCODER_PREFIXES = ("c2.android.", "omx.google.")
+
+# Свойства getprop, которые сохраняются в профиле
+PROFILE_PROPERTIES = {
+    "manufacturer": "ro.product.manufacturer",
+    "model": "ro.product.model",
+    "android_version": "ro.build.version.release",
+    "sdk": "ro.build.version.sdk",
+    "soc": "ro.soc.model",
+    "platform": "ro.board.platform",
+    "abi": "ro.product.cpu.abi",
+}
+
+# "--video-codec=h265 --video-encoder=c2.qti.hevc.encoder   (hw) [vendor]"
+_ENCODER_RE = re.compile(
+    r"--(?P<type>video|audio)-codec=(?P<codec>\S+)\s+--(?:video|audio)-encoder=(?P<encoder>\S+)"
+    r"(?P<flags>.*)$"
+)
+# "--display-id=0    (1080x2400)"
+_DISPLAY_RE = re.compile(r"--display-id=(?P<id>\d+)(?:\s+\((?P<width>\d+)x(?P<height>\d+)\))?")
+
+
+class ProbeError(Exception):
+    """scrcpy не смог получить список кодировщиков (устройство недоступно и т.п.)."""
+
+
+class ProfileStore:
+    """Профили по serial в одном JSON-файле; запись атомарная."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._profiles: Optional[dict] = None
+
+    def _load_locked(self) -> dict:
+        if self._profiles is None:
+            try:
+                self._profiles = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self._profiles = {}
+        return self._profiles
+
+    def _save_locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(self._profiles, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+    def all(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps(self._load_locked()))
+
+    def get(self, serial: str) -> Optional[dict]:
+        with self._lock:
+            profile = self._load_locked().get(serial)
+            return json.loads(json.dumps(profile)) if profile is not None else None
+
+    def put(self, serial: str, profile: dict):
+        """Сохраняет результат проверки, не теряя остальные разделы профиля."""
+        with self._lock:
+            profiles = self._load_locked()
+            profiles[serial] = {**profiles.get(serial, {}), **profile}
+            self._save_locked()
+
+    def update(self, serial: str, key: str, value):
+        """Меняет один раздел профиля (например, подобранные настройки канала)."""
+        with self._lock:
+            self._load_locked().setdefault(serial, {"serial": serial})[key] = value
+            self._save_locked()
+
+    def delete(self, serial: str) -> bool:
+        with self._lock:
+            removed = self._load_locked().pop(serial, None) is not None
+            if removed:
+                self._save_locked()
+            return removed
+
+
+store = ProfileStore(PROFILES_PATH)
+_PROBE_LOCKS: dict = {}
+
+
+def _is_hardware(encoder: str, flags: str) -> bool:
+    if "(hw)" in flags or "(hybrid)" in flags:
+        return True
+    if "(sw)" in flags:
+        return False
+    return not encoder.lower().startswith(SOFTWARE_ENCODER_PREFIXES)
+
+
+def parse_encoders(output: str) -> List[dict]:
+    encoders = []
+    for line in output.splitlines():
+        match = _ENCODER_RE.search(line)
+        if not match:
+            continue
+        flags = match.group("flags")
+        encoders.append({
+            "type": match.group("type"),
+            "codec": match.group("codec"),
+            "encoder": match.group("encoder"),
+            "hardware": _is_hardware(match.group("encoder"), flags),
+            "alias": "(alias for" in flags,
+        })
+    return encoders
+
+
+def parse_displays(output: str) -> List[dict]:
+    displays = []
+    for line in output.splitlines():
+        match = _DISPLAY_RE.search(line)
+        if not match:
+            continue
+        display = {"id": int(match.group("id"))}
+        if match.group("width"):
+            display["width"], display["height"] = int(match.group("width")), int(match.group("height"))
+        displays.append(display)
+    return displays
+
+
+def _run_scrcpy(scrcpy_path, serial: str, flag: str) -> str:
+    try:
+        result = subprocess.run(
+            [str(scrcpy_path), "--serial", serial, flag],
+            capture_output=True,
+            text=True,
+            errors="replace",
+            timeout=PROBE_TIMEOUT_SECONDS,
+        )
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise ProbeError(f"scrcpy {flag} failed: {exc}") from exc
+    output = "\n".join(part for part in (result.stdout, result.stderr) if part)
+    if result.returncode != 0:
+        lines = [line for line in output.splitlines() if "ERROR" in line] or output.splitlines()[-3:]
+        raise ProbeError(f"scrcpy {flag} exited with code {result.returncode}: {' '.join(lines)}")
+    return output
+
+
+def probe_device(adb_path, scrcpy_path, serial: str) -> dict:
+    """Полная проверка устройства (блокирующая: scrcpy поднимает сервер на устройстве)."""
+    encoders = parse_encoders(_run_scrcpy(scrcpy_path, serial, "--list-encoders"))
+    if not encoders:
+        raise ProbeError("scrcpy --list-encoders returned no encoders")
+    displays = parse_displays(_run_scrcpy(scrcpy_path, serial, "--list-displays"))
+    properties = get_device_properties(adb_path, serial)
+    return {
+        "serial": serial,
+        "probed_at": datetime.now().isoformat(),
+        "properties": {name: properties.get(key) for name, key in PROFILE_PROPERTIES.items()},
+        "encoders": encoders,
+        "displays": displays,
+    }
+
+
+def choose_video_codec(profile: dict) -> dict:
+    """Кодек для auto: первый аппаратный кодировщик H.265/AV1 из списка устройства, иначе H.264."""
+    video = [item for item in profile.get("encoders", []) if item["type"] == "video"]
+    for codec in AUTO_CODEC_PREFERENCE:
+        hardware = [item for item in video if item["codec"] == codec and item["hardware"]]
+        if hardware:
+            # Список scrcpy идёт в порядке предпочтения MediaCodecList; алиасы дублируют основное имя
+            choice = next((item for item in hardware if not item["alias"]), hardware[0])
+            return {"codec": codec, "encoder": choice["encoder"], "reason": "hardware_encoder"}
+    return {"codec": "h264", "encoder": None, "reason": "fallback"}
+
+
+async def get_profile(adb_path, scrcpy_path, serial: str, refresh: bool = False) -> dict:
+    """Профиль из кеша или после проверки; параллельные запросы на один serial ждут одну проверку."""
+    if not refresh:
+        profile = store.get(serial)
+        if profile and profile.get("encoders"):
+            return profile
+    lock = _PROBE_LOCKS.setdefault(serial, asyncio.Lock())
+    async with lock:
+        if not refresh:
+            profile = store.get(serial)
+            if profile and profile.get("encoders"):
+                return profile
+        probed = await run_in_threadpool(probe_device, adb_path, scrcpy_path, serial)
+        await run_in_threadpool(store.put, serial, probed)
+        return store.get(serial)
+
+
+def normalize_video_codec(value) -> str:
+    """'' - кодек scrcpy по умолчанию; иначе один из VIDEO_CODECS или auto."""
+    codec = str(value or "").strip().lower()
+    if codec and codec != AUTO_CODEC and codec not in VIDEO_CODECS:
+        raise ValueError(f"Unsupported video codec: {value}")
+    return codec
+
+
+async def resolve_video_codec(adb_path, scrcpy_path, requested, serial: Optional[str]) -> tuple[list, Optional[dict]]:
+    """
+    Аргументы scrcpy для запрошенного кодека и сведения о выборе.
+    Для auto без serial или при неудачной проверке остаётся H.264 по умолчанию.
+    """
+    codec = normalize_video_codec(requested)
+    if not codec:
+        return [], None
+    if codec != AUTO_CODEC:
+        return [f"--video-codec={codec}"], {"requested": codec, "codec": codec, "encoder": None}
+    if not serial:
+        return [], {"requested": codec, "codec": "h264", "encoder": None, "reason": "no_serial"}
+    try:
+        profile = await get_profile(adb_path, scrcpy_path, serial)
+    except ProbeError as exc:
+        return [], {"requested": codec, "codec": "h264", "encoder": None, "reason": "probe_failed", "error": str(exc)}
+    choice = choose_video_codec(profile)
+    args = []
+    if choice["encoder"]:
+        args = [f"--video-codec={choice['codec']}", f"--video-encoder={choice['encoder']}"]
+    return args, {"requested": codec, **choice}
+
+
+def _tool_paths(request: Request) -> tuple:
+    adb_path = getattr(request.app.state, "adb_path", None)
+    scrcpy_path = getattr(request.app.state, "scrcpy_path", None)
+    if not adb_path or not scrcpy_path:
+        from mkdsc.tools import get_tool_path
+        adb_path = adb_path or get_tool_path("adb")
+        scrcpy_path = scrcpy_path or get_tool_path("scrcpy")
+    return adb_path, scrcpy_path
+
+
+def _with_choice(profile: dict) -> dict:
+    return {**profile, "auto_codec": choose_video_codec(profile) if profile.get("encoders") else None}
+
+
+@router.get("")
+async def list_profiles():
+    profiles = await run_in_threadpool(store.all)
+    return {"profiles": [_with_choice(profile) for profile in profiles.values()]}
+
+
+@router.get("/{serial}")
+async def get_device_profile(serial: str, request: Request):
+    """Профиль устройства; если устройство ещё не проверялось - проверяет его."""
+    adb_path, scrcpy_path = _tool_paths(request)
+    try:
+        profile = await get_profile(adb_path, scrcpy_path, serial)
+    except ProbeError as exc:
+        raise HTTPException(status_code=502, detail=str(exc))
+    return _with_choice(profile)
+
+
+@router.post("/{serial}/probe")
+async def probe_device_profile(serial: str, request: Request):
+    """Проверяет устройство заново (например, после обновления прошивки или scrcpy)."""
+    adb_path, scrcpy_path = _tool_paths(request)
+    try:
+        profile = await get_profile(adb_path, scrcpy_path, serial, refresh=True)
+    except ProbeError as exc:
+        raise HTTPException(status_code=502, detail=str(exc))
+    return _with_choice(profile)
+
+
+@router.delete("/{serial}")
+async def delete_device_profile(serial: str):
+    if not await run_in_threadpool(store.delete, serial):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {"success": True}
@@ -0,0 +1,105 @@
+"""
+Отслеживание содержимого директории без сторонних зависимостей.
+
+Поток периодически проверяет mtime самой директории и пересканирует её
+(os.scandir) только когда он изменился - то есть когда файлы добавили,
+удалили или переименовали. Подписчик получает множества добавленных
+и удалённых имён.
+"""
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+ChangeCallback = Callable[[set, set], None]
+
+
+class DirectoryWatcher:
+    """Следит за файлами в одной директории (без рекурсии)."""
+
+    def __init__(
+        self,
+        root: Path,
+        on_change: ChangeCallback,
+        interval: float = 3.0,
+        suffixes: Optional[Iterable[str]] = None,
+        logger=None,
+    ):
+        self.root = Path(root)
+        self.on_change = on_change
+        self.interval = interval
+        self.suffixes = tuple(s.lower() for s in suffixes) if suffixes else None
+        self.logger = logger
+        self._names: Optional[set] = None
+        self._dir_mtime_ns: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _matches(self, name: str) -> bool:
+        # Временные файлы атомарной записи (.name.tmp) и служебные файлы не отслеживаем
+        if name.startswith(".") or name.endswith(".tmp"):
+            return False
+        return self.suffixes is None or name.lower().endswith(self.suffixes)
+
+    def _scan(self) -> set:
+        names = set()
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if self._matches(entry.name) and entry.is_file(follow_symlinks=False):
+                    names.add(entry.name)
+        return names
+
+    def snapshot(self) -> set:
+        """Текущий набор файлов (сканирует директорию, если ещё не сканировали)."""
+        with self._lock:
+            if self._names is None:
+                self._poll_locked(force=True)
+            return set(self._names or ())
+
+    def poll(self, force: bool = False) -> tuple[set, set]:
+        """Одна проверка; возвращает (added, removed) и вызывает on_change при изменениях."""
+        with self._lock:
+            added, removed = self._poll_locked(force)
+        if added or removed:
+            self.on_change(added, removed)
+        return added, removed
+
+    def _poll_locked(self, force: bool) -> tuple[set, set]:
+        try:
+            dir_mtime_ns = self.root.stat().st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime_ns = None
+        if not force and self._names is not None and dir_mtime_ns == self._dir_mtime_ns:
+            return set(), set()
+
+        names = self._scan() if dir_mtime_ns is not None else set()
+        previous = self._names
+        self._names = names
+        self._dir_mtime_ns = dir_mtime_ns
+        if previous is None:
+            return set(), set()
+        return names - previous, previous - names
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as exc:
+                if self.logger:
+                    self.logger.warning("dir_watcher.poll root=%s error=%s", self.root, exc)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"dir-watcher:{self.root.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
@@ -0,0 +1,184 @@
+"""
+Дисковый кэш с вытеснением по LRU и ограничением суммарного размера.
+Каждая запись - отдельный файл; время последнего доступа хранится в mtime файла,
+поэтому порядок LRU переживает перезапуск сервера. Закреплённые записи (pin)
+не вытесняются, пока файл отдаётся клиенту.
+"""
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class DiskLRUCache:
+    """Файловый кэш: ключ (hex-строка) -> файл в root/<ключ[:2]>/<ключ>."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._entries: Optional[OrderedDict] = None
+        self._total_bytes = 0
+        self._pins: dict = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        found = []
+        for entry_path in self.root.glob("*/*"):
+            if not entry_path.is_file() or entry_path.name.endswith(".tmp"):
+                continue
+            stat = entry_path.stat()
+            found.append((stat.st_mtime, entry_path.name, stat.st_size))
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._total_bytes = sum(self._entries.values())
+
+    def _evict(self, keep: Optional[str] = None):
+        """Вытесняет старые записи, кроме keep и закреплённых, пока кэш больше лимита."""
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if key == keep or self._pins.get(key):
+                continue
+            size = self._entries.pop(key)
+            try:
+                self._path(key).unlink(missing_ok=True)
+            except OSError:
+                # Файл может быть открыт (например, отдаётся клиенту) - удалим при следующей загрузке
+                pass
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def _remember(self, key: str, path: Path):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._total_bytes -= previous
+        size = path.stat().st_size
+        self._entries[key] = size
+        self._total_bytes += size
+        # Только что добавленная запись не вытесняется, даже если одна больше лимита
+        self._evict(keep=key)
+
+    def _pin(self, key: str):
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def release(self, key: str):
+        """Снимает закрепление записи (см. pin в get/put_file)."""
+        with self._lock:
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+                return
+            self._pins.pop(key, None)
+            if self._entries is not None:
+                self._evict()
+
+    def get(self, key: str, pin: bool = False) -> Optional[Path]:
+        """
+        Возвращает путь к файлу записи (и отмечает доступ) или None.
+        С pin запись не вытесняется до вызова release(key).
+        """
+        with self._lock:
+            self._load()
+            path = self._path(key)
+            if key not in self._entries or not path.exists():
+                if key in self._entries:
+                    self._total_bytes -= self._entries.pop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            self.hits += 1
+            if pin:
+                self._pin(key)
+            return path
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self.get(key)
+        if path is None:
+            return None
+        try:
+            return path.read_bytes()
+        except OSError:
+            return None
+
+    def _temp_path(self, key: str) -> Path:
+        target_dir = self._path(key).parent
+        target_dir.mkdir(parents=True, exist_ok=True)
+        return target_dir / f"{key}.{uuid.uuid4().hex}.tmp"
+
+    def put_bytes(self, key: str, data: bytes) -> Path:
+        """Атомарно записывает данные в кэш."""
+        with self._lock:
+            self._load()
+            tmp_path = self._temp_path(key)
+            tmp_path.write_bytes(data)
+            path = self._path(key)
+            os.replace(tmp_path, path)
+            self._remember(key, path)
+            return path
+
+    def put_file(self, key: str, source: Path, move: bool = False, pin: bool = False) -> Path:
+        """Копирует (или перемещает) готовый файл в кэш; pin - как в get."""
+        with self._lock:
+            self._load()
+            tmp_path = self._temp_path(key)
+            if move:
+                shutil.move(str(source), str(tmp_path))
+            else:
+                shutil.copyfile(source, tmp_path)
+            path = self._path(key)
+            os.replace(tmp_path, path)
+            if pin:
+                self._pin(key)
+            self._remember(key, path)
+            return path
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            return key in self._entries
+
+    def discard(self, key: str):
+        with self._lock:
+            self._load()
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_bytes -= size
+            self._path(key).unlink(missing_ok=True)
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self._entries = None
+            self._total_bytes = 0
+            self._load()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {
+                "path": str(self.root),
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -8,18 +8,43 @@
 - GET /api/files/download - скачивание файла (adb pull)
 - DELETE /api/files/delete - удаление файла
 - POST /api/files/mkdir - создание директории
+- GET /api/files/search - поиск файлов (find) с потоковой выдачей
+- DELETE /api/files/search/{search_id} - отмена поиска
+- GET /api/files/thumbnail - миниатюра изображения с устройства
+- POST /api/files/batch - пакет операций delete/move/mkdir одним вызовом adb
+- POST /api/files/batch/delete - пакетное удаление
+- POST /api/files/batch/mkdir - пакетное создание директорий
+- POST /api/files/pull-parallel - скачивание большого файла параллельными диапазонами
+- GET /api/files/cache/stats - статистика кэша скачанных файлов
+- DELETE /api/files/cache - очистка кэша скачанных файлов
+- GET /api/files/qos - лимиты и фактическая скорость передач по устройствам
+- POST /api/files/qos - изменение лимитов передач
 """
+import asyncio
+import hashlib
+import json
 import math
+import os
+import shlex
 import subprocess
 import tempfile
 import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
 from pathlib import Path
 from typing import Optional, List
 from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Request
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 from starlette.concurrency import run_in_threadpool
-from mkdsc.paths import DATA_DIR, get_downloads_base_dir
+from mkdsc.paths import DATA_DIR, get_cache_dir, get_downloads_base_dir
+from mkdsc.web import imaging
+from mkdsc.web.disk_cache import DiskLRUCache
+from mkdsc.web.transfer_qos import DEFAULT_TRANSFER_CONFIG, governor
+from mkdsc.web.workers import run_in_process
 
 router = APIRouter(prefix="/api/files", tags=["files"])
 
@@ -32,6 +57,7 @@ class FileInfo(BaseModel):
     size: int = 0
     permissions: str = ""
     date: str = ""
+    mtime: int = 0
 
 
 class DeleteRequest(BaseModel):
@@ -57,10 +83,91 @@ class WriteRequest(BaseModel):
 class PullRequest(BaseModel):
     path: str
     destination_dir: Optional[str] = None
+    use_cache: bool = True
+    verify_hash: bool = False
+    background: bool = False
+
+
+class ParallelPullRequest(BaseModel):
+    """Запрос на скачивание файла несколькими потоками exec-out dd."""
+    path: str
+    destination_dir: Optional[str] = None
+    streams: int = 4
+    chunk_mb: int = 16
+    verify: bool = True
+    background: bool = False
+
+
+class QosUpdate(BaseModel):
+    """Лимиты передач в Мбит/с (0 - без ограничения); serial=None меняет значения по умолчанию."""
+    serial: Optional[str] = None
+    max_rate_mbps: Optional[float] = None
+    session_rate_mbps: Optional[float] = None
+    background_rate_mbps: Optional[float] = None
+
+
+class BatchOperation(BaseModel):
+    """Одна операция пакета: delete/mkdir используют path, move - source и destination."""
+    op: str
+    path: Optional[str] = None
+    source: Optional[str] = None
+    destination: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    """Пакет операций; serials - выполнить один и тот же пакет на нескольких устройствах."""
+    operations: List[BatchOperation]
+    serials: Optional[List[str]] = None
+    stop_on_error: bool = False
+
+
+class BatchPathsRequest(BaseModel):
+    paths: List[str]
+    serials: Optional[List[str]] = None
+    stop_on_error: bool = False
 
 
 _DANGEROUS_ROOTS = {"/", "/system", "/data", "/vendor", "/sdcard"}
 
+SEARCH_TYPES = {"f", "d", "l"}
+SEARCH_MAX_RESULTS = 10000
+SEARCH_READ_SIZE = 65536
+
+# Активные поиски: search_id -> {"process": Popen, "cancelled": bool}
+_ACTIVE_SEARCHES = {}
+
+THUMBNAIL_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+# Превью HEIC/HEIF - только с pillow-heif (сам Pillow их не декодирует)
+THUMBNAIL_HEIF_EXTENSIONS = {".heic", ".heif"}
+THUMBNAIL_JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+THUMBNAIL_EXIF_PROBE_BYTES = 128 * 1024
+THUMBNAIL_MAX_SOURCE_BYTES = 32 * 1024 * 1024
+THUMBNAIL_IMMUTABLE = "public, max-age=31536000, immutable"
+THUMBNAIL_REVALIDATE = "private, no-cache"
+
+_THUMBNAIL_CACHE: Optional[DiskLRUCache] = None
+
+BATCH_OPERATIONS = {"delete", "move", "mkdir"}
+BATCH_MAX_OPERATIONS = 5000
+BATCH_MARKER = "__MKDSC_BATCH__"
+# Старые adbd ограничивают длину команды ~4 КБ - длинные скрипты отдаём через stdin
+BATCH_INLINE_LIMIT = 3500
+
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+PARALLEL_MAX_STREAMS = 16
+PARALLEL_MAX_CHUNK_MB = 256
+PARALLEL_CHUNK_RETRIES = 3
+PARALLEL_READ_SIZE = 256 * 1024
+TRANSFER_READ_SIZE = 64 * 1024
+# Передача, в которой байты не двигались столько секунд, считается зависшей
+TRANSFER_STALL_SECONDS = 60
+
+# Кэш скачанных файлов: блобы по sha256 содержимого + индекс (serial, path, size, mtime) -> sha256
+_FILE_CACHE: Optional[DiskLRUCache] = None
+_FILE_CACHE_INDEX: Optional[dict] = None
+_FILE_CACHE_LOCK = threading.Lock()
+_FILE_CACHE_COUNTERS = {"device_hits": 0, "content_hits": 0, "device_pulls": 0, "bytes_saved": 0}
+
 
 def _resolve_adb_path(request: Request):
     adb_path = getattr(request.app.state, "adb_path", None)
@@ -100,6 +207,13 @@ def _is_dangerous_root(path: str) -> bool:
     return _normalize_path(path) in _DANGEROUS_ROOTS
 
 
+def _adb_base_cmd(adb_path: Path | str, serial: Optional[str]) -> List[str]:
+    cmd = [str(adb_path)]
+    if serial:
+        cmd.extend(["-s", serial])
+    return cmd
+
+
 async def _run_adb_shell(
     adb_path: Path | str,
     serial: Optional[str],
@@ -116,6 +230,188 @@ async def _run_adb_shell(
     return await run_in_threadpool(subprocess.run, cmd, capture_output=True, timeout=timeout)
 
 
+async def _run_adb_exec_out(
+    adb_path: Path | str,
+    serial: Optional[str],
+    command: str,
+    timeout: int = 60
+) -> subprocess.CompletedProcess:
+    """exec-out отдаёт бинарный stdout без преобразования переводов строк."""
+    cmd = _adb_base_cmd(adb_path, serial) + ["exec-out", command]
+    return await run_in_threadpool(subprocess.run, cmd, capture_output=True, timeout=timeout)
+
+
+async def _stat_remote(adb_path: Path | str, serial: Optional[str], path: str) -> dict:
+    """Возвращает размер, mtime и тип файла на устройстве."""
+    result = await _run_adb_shell(
+        adb_path,
+        serial,
+        ["stat", "-c", shlex.quote("%s %Y %F"), shlex.quote(path)],
+        timeout=15
+    )
+    output = _decode_output(result.stdout).strip()
+    parts = output.split(" ", 2)
+    if result.returncode != 0 or len(parts) != 3 or not parts[0].isdigit():
+        detail = _decode_output(result.stderr).strip() or output or "File not found"
+        status_code = 403 if "Permission denied" in detail else 404
+        raise HTTPException(status_code=status_code, detail=detail)
+    return {
+        "size": int(parts[0]),
+        "mtime": int(parts[1]) if parts[1].isdigit() else 0,
+        "is_dir": parts[2] == "directory",
+    }
+
+
+class _StallWatchdog:
+    """
+    Останавливает процессы передачи, если progress() не вызывался stall_seconds:
+    чтение и запись в пайп adb не имеют таймаута, и зависшее устройство держало бы
+    поток и слот передачи бесконечно. При срабатывании выход из with поднимает
+    subprocess.TimeoutExpired.
+    """
+
+    def __init__(self, cmd, procs, stall_seconds: float):
+        self.cmd = cmd
+        self.procs = [proc for proc in procs if proc is not None]
+        self.stall_seconds = stall_seconds
+        self.fired = False
+        self._last_progress = time.monotonic()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def progress(self):
+        self._last_progress = time.monotonic()
+
+    def _watch(self):
+        while not self._done.wait(min(1.0, self.stall_seconds / 4)):
+            if time.monotonic() - self._last_progress > self.stall_seconds:
+                self.fired = True
+                for proc in self.procs:
+                    _stop_process(proc)
+                return
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._done.set()
+        self._thread.join()
+        if self.fired:
+            raise subprocess.TimeoutExpired(self.cmd, self.stall_seconds)
+        return False
+
+
+def _stream_pull(
+    adb_path, serial: Optional[str], path: str, dest: Path, size: int, background: bool, timeout: int = 120
+):
+    """
+    Pull через exec-out cat, прогоняя каждый блок через token bucket устройства.
+    Длительность зависит от лимита скорости, поэтому timeout ограничивает простой
+    (не больше TRANSFER_STALL_SECONDS), а не всю передачу.
+    """
+    args = _adb_base_cmd(adb_path, serial) + ["exec-out", f"cat {shlex.quote(path)} 2>/dev/null"]
+    received = 0
+    with governor.transfer(serial, "pull", path, background) as transfer:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            with _StallWatchdog(args, [proc], min(timeout, TRANSFER_STALL_SECONDS)) as watchdog:
+                with open(dest, "wb") as handle:
+                    while True:
+                        data = proc.stdout.read(TRANSFER_READ_SIZE)
+                        if not data:
+                            break
+                        watchdog.progress()
+                        transfer.consume(len(data))
+                        handle.write(data)
+                        received += len(data)
+                        watchdog.progress()
+                proc.wait(timeout=30)
+        finally:
+            _stop_process(proc)
+    # exec-out не передаёт код возврата - сверяем размер
+    if received != size:
+        return subprocess.CompletedProcess(args, 1, b"", f"expected {size} bytes, got {received}".encode())
+    return subprocess.CompletedProcess(args, 0, b"", b"")
+
+
+def _stream_push(
+    adb_path, serial: Optional[str], source: Path, remote_path: str, background: bool, timeout: int = 120
+):
+    """Push через exec-in cat с ограничением скорости; timeout - как в _stream_pull."""
+    args = _adb_base_cmd(adb_path, serial) + ["exec-in", f"cat > {shlex.quote(remote_path)}"]
+    with governor.transfer(serial, "push", remote_path, background) as transfer:
+        proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            with _StallWatchdog(args, [proc], min(timeout, TRANSFER_STALL_SECONDS)) as watchdog:
+                with open(source, "rb") as handle:
+                    while True:
+                        data = handle.read(TRANSFER_READ_SIZE)
+                        if not data:
+                            break
+                        transfer.consume(len(data))
+                        watchdog.progress()
+                        proc.stdin.write(data)
+                        watchdog.progress()
+                proc.stdin.close()
+                stderr = proc.stderr.read()
+                proc.wait(timeout=60)
+        finally:
+            _stop_process(proc)
+    return subprocess.CompletedProcess(args, proc.returncode, b"", stderr)
+
+
+async def _adb_pull(
+    adb_path,
+    serial: Optional[str],
+    path: str,
+    dest: Path,
+    background: bool = False,
+    size: Optional[int] = None,
+    timeout: int = 120
+) -> subprocess.CompletedProcess:
+    """
+    adb pull с учётом лимитов устройства.
+
+    Если для serial действует лимит и размер файла известен, файл идёт через
+    управляемый поток exec-out; иначе - нативный adb pull (байты всё равно учитываются).
+    """
+    if size is not None and governor.is_limited(serial, background):
+        return await run_in_threadpool(_stream_pull, adb_path, serial, path, dest, size, background, timeout)
+    with governor.transfer(serial, "pull", path, background) as transfer:
+        result = await run_in_threadpool(
+            subprocess.run,
+            _adb_base_cmd(adb_path, serial) + ["pull", path, str(dest)],
+            capture_output=True,
+            timeout=timeout
+        )
+        if dest.is_file():
+            transfer.record(dest.stat().st_size)
+    return result
+
+
+async def _adb_push(
+    adb_path,
+    serial: Optional[str],
+    source: Path,
+    remote_path: str,
+    background: bool = False,
+    timeout: int = 120
+) -> subprocess.CompletedProcess:
+    """adb push с учётом лимитов устройства (см. _adb_pull)."""
+    if governor.is_limited(serial, background):
+        return await run_in_threadpool(_stream_push, adb_path, serial, source, remote_path, background, timeout)
+    with governor.transfer(serial, "push", remote_path, background) as transfer:
+        result = await run_in_threadpool(
+            subprocess.run,
+            _adb_base_cmd(adb_path, serial) + ["push", str(source), remote_path],
+            capture_output=True,
+            timeout=timeout
+        )
+        transfer.record(source.stat().st_size)
+    return result
+
+
 def parse_ls_output(output: str, base_path: str) -> List[FileInfo]:
     """
     Парсит вывод команды ls -la.
@@ -289,12 +585,987 @@ async def list_directory(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def build_find_command(
+    path: str,
+    name: Optional[str] = None,
+    file_type: Optional[str] = None,
+    min_size: Optional[int] = None,
+    max_size: Optional[int] = None,
+    newer_than_minutes: Optional[int] = None,
+    older_than_minutes: Optional[int] = None,
+    max_depth: Optional[int] = None,
+    case_sensitive: bool = False
+) -> str:
+    """
+    Собирает одну команду find для выполнения на устройстве.
+
+    Каждое совпадение печатается через stat в формате
+    "тип<TAB>размер<TAB>mtime<TAB>путь", чтобы не делать ls на каждую папку.
+    """
+    parts = ["find", shlex.quote(path or "/"), "-mindepth", "1"]
+    if max_depth is not None:
+        parts.extend(["-maxdepth", str(max_depth)])
+    if file_type:
+        parts.extend(["-type", file_type])
+    if name:
+        parts.extend(["-name" if case_sensitive else "-iname", shlex.quote(name)])
+    if min_size is not None and min_size > 0:
+        parts.extend(["-size", f"+{min_size - 1}c"])
+    if max_size is not None:
+        parts.extend(["-size", f"-{max_size + 1}c"])
+    if newer_than_minutes is not None:
+        parts.extend(["-mmin", f"-{newer_than_minutes}"])
+    if older_than_minutes is not None:
+        parts.extend(["-mmin", f"+{older_than_minutes}"])
+    parts.extend(["-exec", "stat", "-c", shlex.quote("%F\t%s\t%Y\t%n"), "{}", "+"])
+    return " ".join(parts) + " 2>/dev/null"
+
+
+def parse_stat_line(line: str) -> Optional[FileInfo]:
+    """Парсит строку вывода stat -c '%F\t%s\t%Y\t%n'."""
+    parts = line.rstrip("\r\n").split("\t", 3)
+    if len(parts) != 4:
+        return None
+    kind, size_raw, mtime_raw, full_path = parts
+    if not full_path:
+        return None
+    try:
+        size = int(size_raw)
+        mtime = int(mtime_raw)
+    except ValueError:
+        return None
+    is_dir = kind == "directory"
+    date = datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M") if mtime > 0 else ""
+    return FileInfo(
+        name=full_path.rstrip("/").rsplit("/", 1)[-1] or full_path,
+        path=full_path,
+        is_dir=is_dir,
+        size=0 if is_dir else size,
+        permissions="d" if is_dir else ("l" if kind == "symbolic link" else "-"),
+        date=date,
+        mtime=mtime
+    )
+
+
+def _ndjson(payload: dict) -> bytes:
+    return (json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _stop_process(proc: subprocess.Popen):
+    if proc.poll() is not None:
+        return
+    try:
+        proc.kill()
+        proc.wait(timeout=3)
+    except Exception:
+        pass
+
+
+async def _stream_search(proc: subprocess.Popen, search_id: str, limit: int, logger=None):
+    started = time.perf_counter()
+    count = 0
+    truncated = False
+    buffer = b""
+    try:
+        yield _ndjson({"type": "start", "search_id": search_id})
+        while count < limit:
+            chunk = await run_in_threadpool(proc.stdout.read1, SEARCH_READ_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for raw_line in lines:
+                entry = parse_stat_line(_decode_output(raw_line))
+                if entry is None:
+                    continue
+                count += 1
+                yield _ndjson({"type": "match", "file": entry.dict()})
+                if count >= limit:
+                    truncated = True
+                    break
+        if not truncated and buffer:
+            entry = parse_stat_line(_decode_output(buffer))
+            if entry is not None and count < limit:
+                count += 1
+                yield _ndjson({"type": "match", "file": entry.dict()})
+
+        state = _ACTIVE_SEARCHES.get(search_id) or {}
+        if truncated:
+            _stop_process(proc)
+        else:
+            await run_in_threadpool(proc.wait)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        if logger:
+            logger.info(
+                "files.search id=%s count=%s truncated=%s elapsed_ms=%s",
+                search_id, count, truncated, elapsed_ms
+            )
+        yield _ndjson({
+            "type": "done",
+            "search_id": search_id,
+            "count": count,
+            "truncated": truncated,
+            "cancelled": bool(state.get("cancelled")),
+            "exit_code": proc.returncode,
+            "elapsed_ms": elapsed_ms
+        })
+    finally:
+        # Клиент отключился или поиск завершён - процесс find больше не нужен
+        _ACTIVE_SEARCHES.pop(search_id, None)
+        _stop_process(proc)
+
+
+@router.get("/search")
+async def search_files(
+    request: Request,
+    path: str = Query("/sdcard", description="Root directory for the search"),
+    name: Optional[str] = Query(None, description="Name glob, e.g. *.mp4"),
+    type: Optional[str] = Query(None, description="f - files, d - directories, l - symlinks"),
+    min_size: Optional[int] = Query(None, ge=0, description="Minimum size in bytes"),
+    max_size: Optional[int] = Query(None, ge=0, description="Maximum size in bytes"),
+    newer_than_minutes: Optional[int] = Query(None, ge=0, description="Modified within N minutes"),
+    older_than_minutes: Optional[int] = Query(None, ge=0, description="Modified more than N minutes ago"),
+    max_depth: Optional[int] = Query(None, ge=0),
+    case_sensitive: bool = Query(False),
+    limit: int = Query(1000, ge=1, le=SEARCH_MAX_RESULTS, description="Result cap"),
+    search_id: Optional[str] = Query(None, description="Client-side id used for cancellation"),
+    serial: Optional[str] = Query(None, description="Device serial")
+):
+    """
+    Ищет файлы на устройстве одним вызовом find.
+
+    Результаты отдаются построчно (NDJSON) по мере их появления:
+    {"type": "start"}, затем {"type": "match", "file": {...}} и в конце {"type": "done"}.
+    Поиск останавливается по лимиту, при отключении клиента
+    или через DELETE /api/files/search/{search_id}.
+    """
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    if type and type not in SEARCH_TYPES:
+        raise HTTPException(status_code=400, detail="type must be one of f, d, l")
+
+    search_id = search_id or uuid.uuid4().hex
+    if search_id in _ACTIVE_SEARCHES:
+        raise HTTPException(status_code=409, detail="Search with this id is already running")
+
+    command = build_find_command(
+        path,
+        name=name,
+        file_type=type,
+        min_size=min_size,
+        max_size=max_size,
+        newer_than_minutes=newer_than_minutes,
+        older_than_minutes=older_than_minutes,
+        max_depth=max_depth,
+        case_sensitive=case_sensitive
+    )
+    logger = getattr(request.app.state, "logger", None)
+    if logger:
+        logger.info("files.search id=%s serial=%s command=%s", search_id, serial or "-", command)
+
+    try:
+        proc = subprocess.Popen(
+            _adb_base_cmd(adb_path, serial) + ["shell", command],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    _ACTIVE_SEARCHES[search_id] = {"process": proc, "cancelled": False}
+    return StreamingResponse(
+        _stream_search(proc, search_id, limit, logger),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-store", "X-Search-Id": search_id}
+    )
+
+
+@router.delete("/search/{search_id}")
+async def cancel_search(search_id: str):
+    """Отменяет выполняющийся поиск."""
+    state = _ACTIVE_SEARCHES.get(search_id)
+    if not state:
+        raise HTTPException(status_code=404, detail="Search not found")
+    state["cancelled"] = True
+    await run_in_threadpool(_stop_process, state["process"])
+    return {"success": True, "search_id": search_id}
+
+
+def _get_thumbnail_cache(request: Request) -> DiskLRUCache:
+    global _THUMBNAIL_CACHE
+    if _THUMBNAIL_CACHE is None:
+        config = getattr(request.app.state, "config", None)
+        cache_cfg = (config or {}).get("cache", {}) if isinstance(config, dict) else {}
+        max_mb = int(cache_cfg.get("thumbnails_mb") or 256)
+        _THUMBNAIL_CACHE = DiskLRUCache(get_cache_dir(config) / "thumbnails", max_mb * 1024 * 1024)
+    return _THUMBNAIL_CACHE
+
+
+def _thumbnail_key(serial: Optional[str], path: str, file_size: int, mtime: int, size: int, fmt: str) -> str:
+    raw = f"{serial or '-'}|{path}|{file_size}|{mtime}|{size}|{fmt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _read_thumbnail_source(
+    adb_path, serial: Optional[str], path: str, file_size: int, size: int
+) -> tuple[bytes, int]:
+    """
+    Читает с устройства минимум данных, достаточный для миниатюры размера size.
+
+    Возвращает (данные, EXIF Orientation, который нужно применить при декодировании).
+    Встроенная EXIF-миниатюра берётся, только если её большая сторона не меньше size.
+    """
+    quoted = shlex.quote(path)
+    if Path(path).suffix.lower() in THUMBNAIL_JPEG_EXTENSIONS:
+        # EXIF-миниатюра лежит в APP1 в самом начале файла
+        head = await _run_adb_exec_out(adb_path, serial, f"head -c {THUMBNAIL_EXIF_PROBE_BYTES} {quoted}", timeout=30)
+        if head.returncode == 0 and head.stdout:
+            if len(head.stdout) >= file_size:
+                return head.stdout, 1
+            embedded = imaging.extract_exif_thumbnail(head.stdout)
+            if embedded:
+                thumbnail, orientation = embedded
+                dimensions = imaging.jpeg_dimensions(thumbnail)
+                if dimensions and max(dimensions) >= size:
+                    return thumbnail, orientation
+
+    if file_size > THUMBNAIL_MAX_SOURCE_BYTES:
+        raise HTTPException(status_code=413, detail="File is too large for preview")
+
+    result = await _run_adb_exec_out(adb_path, serial, f"cat {quoted}", timeout=60)
+    if result.returncode != 0 or not result.stdout:
+        raise HTTPException(status_code=400, detail=_decode_output(result.stderr) or "Read failed")
+    return result.stdout, 1
+
+
+@router.get("/thumbnail")
+async def get_thumbnail(
+    request: Request,
+    path: str = Query(..., description="Image path on device"),
+    size: int = Query(256, ge=32, le=1024, description="Max thumbnail edge in pixels"),
+    format: str = Query("webp", description="webp, jpeg or png"),
+    mtime: Optional[int] = Query(None, description="File mtime from list/search, skips the device stat"),
+    file_size: Optional[int] = Query(None, ge=0, description="File size from list/search"),
+    serial: Optional[str] = Query(None, description="Device serial")
+):
+    """
+    Возвращает уменьшенную копию изображения с устройства.
+
+    Для JPEG сначала используется встроенная EXIF-миниатюра (если она не меньше size),
+    иначе файл читается целиком (не больше THUMBNAIL_MAX_SOURCE_BYTES). Декодирование идёт в пуле процессов,
+    результат кладётся в дисковый кэш по serial/path/size/mtime.
+    Если клиент передал mtime и file_size, ответ помечается immutable.
+    """
+    if format not in imaging.THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported thumbnail format")
+    suffix = Path(path).suffix.lower()
+    heif = suffix in THUMBNAIL_HEIF_EXTENSIONS and imaging.heif_available()
+    if suffix not in THUMBNAIL_EXTENSIONS and not heif:
+        raise HTTPException(status_code=415, detail="Preview is not supported for this file type")
+    if not imaging.pillow_available():
+        raise HTTPException(status_code=501, detail="Pillow is required for thumbnails")
+
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    logger = getattr(request.app.state, "logger", None)
+    versioned = mtime is not None and file_size is not None
+    try:
+        if not versioned:
+            info = await _stat_remote(adb_path, serial, path)
+            if info["is_dir"]:
+                raise HTTPException(status_code=400, detail="Path is a directory")
+            mtime, file_size = info["mtime"], info["size"]
+
+        key = _thumbnail_key(serial, path, file_size, mtime, size, format)
+        etag = f'"{key[:32]}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": THUMBNAIL_IMMUTABLE if versioned else THUMBNAIL_REVALIDATE,
+        }
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers=headers)
+
+        cache = _get_thumbnail_cache(request)
+        data = await run_in_threadpool(cache.get_bytes, key)
+        if data is None:
+            source, orientation = await _read_thumbnail_source(adb_path, serial, path, file_size, size)
+            try:
+                data = await run_in_process(
+                    imaging.make_thumbnail, source, size, format, 80, orientation
+                )
+            except Exception as exc:
+                raise HTTPException(status_code=415, detail=f"Cannot decode image: {exc}")
+            await run_in_threadpool(cache.put_bytes, key, data)
+            if logger:
+                logger.info(
+                    "files.thumbnail path=%s serial=%s source=%s thumb=%s",
+                    path, serial or "-", len(source), len(data)
+                )
+
+        return Response(content=data, media_type=imaging.media_type_for(format), headers=headers)
+
+    except subprocess.TimeoutExpired:
+        raise HTTPException(status_code=500, detail="Thumbnail operation timed out")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/thumbnail/cache")
+async def thumbnail_cache_stats(request: Request):
+    """Статистика кэша миниатюр."""
+    return await run_in_threadpool(_get_thumbnail_cache(request).stats)
+
+
+def _validate_batch_operation(operation: BatchOperation) -> Optional[str]:
+    """Возвращает текст ошибки или None, если операцию можно выполнять."""
+    if operation.op not in BATCH_OPERATIONS:
+        return f"Unknown operation: {operation.op}"
+    if operation.op == "move":
+        if not operation.source or not operation.destination:
+            return "source and destination required"
+        if _is_dangerous_root(operation.source) or _is_dangerous_root(operation.destination):
+            return "Cannot move system directories"
+        return None
+    if not operation.path:
+        return "path required"
+    if operation.op == "delete" and _is_dangerous_root(operation.path):
+        return "Cannot delete system directories"
+    return None
+
+
+def _batch_shell_command(operation: BatchOperation) -> str:
+    if operation.op == "delete":
+        return f"rm -rf -- {shlex.quote(operation.path)}"
+    if operation.op == "mkdir":
+        return f"mkdir -p -- {shlex.quote(operation.path)}"
+    return f"mv -- {shlex.quote(operation.source)} {shlex.quote(operation.destination)}"
+
+
+def build_batch_script(operations: List[tuple[int, BatchOperation]], stop_on_error: bool = False) -> str:
+    """
+    Собирает один shell-скрипт для всего пакета.
+
+    Вывод каждой операции обрамляется маркерами begin/end с кодом возврата,
+    чтобы разобрать результат по элементам.
+    """
+    lines = []
+    for index, operation in operations:
+        lines.append(f"echo '{BATCH_MARKER} begin {index}'")
+        lines.append(f"{_batch_shell_command(operation)} 2>&1")
+        lines.append(f"rc=$?; echo \"{BATCH_MARKER} end {index} $rc\"")
+        if stop_on_error:
+            lines.append('[ "$rc" -eq 0 ] || exit 0')
+    return "\n".join(lines) + "\n"
+
+
+def parse_batch_output(output: str) -> dict:
+    """Разбирает вывод скрипта: index -> (код возврата, вывод операции)."""
+    results = {}
+    current = None
+    buffer = []
+    for line in output.splitlines():
+        if line.startswith(f"{BATCH_MARKER} begin "):
+            current = line.split()[-1]
+            buffer = []
+            continue
+        if line.startswith(f"{BATCH_MARKER} end "):
+            parts = line.split()
+            if len(parts) >= 4 and parts[2].isdigit():
+                code = int(parts[3]) if parts[3].lstrip("-").isdigit() else 1
+                results[int(parts[2])] = (code, "\n".join(buffer).strip())
+            current = None
+            continue
+        if current is not None:
+            buffer.append(line)
+    return results
+
+
+async def _run_batch_on_device(
+    adb_path,
+    serial: Optional[str],
+    operations: List[BatchOperation],
+    stop_on_error: bool,
+    logger=None
+) -> dict:
+    started = time.perf_counter()
+    results = []
+    runnable = []
+    for index, operation in enumerate(operations):
+        error = _validate_batch_operation(operation)
+        item = {
+            "index": index,
+            "op": operation.op,
+            "path": operation.destination if operation.op == "move" else operation.path,
+            "success": False,
+            "error": error,
+        }
+        if operation.op == "move":
+            item["source"] = operation.source
+        results.append(item)
+        if error is None:
+            runnable.append((index, operation))
+
+    exit_code = None
+    if runnable:
+        script = build_batch_script(runnable, stop_on_error)
+        cmd = _adb_base_cmd(adb_path, serial)
+        if len(script) <= BATCH_INLINE_LIMIT:
+            completed = await run_in_threadpool(
+                subprocess.run, cmd + ["shell", script], capture_output=True, timeout=120
+            )
+        else:
+            completed = await run_in_threadpool(
+                subprocess.run, cmd + ["shell", "sh"], input=script.encode("utf-8"),
+                capture_output=True, timeout=300
+            )
+        exit_code = completed.returncode
+        parsed = parse_batch_output(_decode_output(completed.stdout))
+        stderr = _decode_output(completed.stderr).strip()
+        for index, _ in runnable:
+            item = results[index]
+            if index not in parsed:
+                item["error"] = "Skipped" if stop_on_error and parsed else (stderr or "No result from device")
+                continue
+            code, output = parsed[index]
+            item["success"] = code == 0
+            if code != 0:
+                item["error"] = output or f"exit code {code}"
+
+    succeeded = sum(1 for item in results if item["success"])
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    if logger:
+        logger.info(
+            "files.batch serial=%s ops=%s ok=%s code=%s elapsed_ms=%s",
+            serial or "-", len(operations), succeeded, exit_code, elapsed_ms
+        )
+    return {
+        "serial": serial,
+        "success": succeeded == len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results,
+        "elapsed_ms": elapsed_ms,
+    }
+
+
+async def _run_batch(
+    request: Request,
+    operations: List[BatchOperation],
+    serials: Optional[List[str]],
+    serial: Optional[str],
+    stop_on_error: bool
+) -> dict:
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    if not operations:
+        raise HTTPException(status_code=400, detail="No operations provided")
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"Too many operations (max {BATCH_MAX_OPERATIONS})")
+
+    logger = getattr(request.app.state, "logger", None)
+    targets = list(dict.fromkeys(serials)) if serials else [serial]
+    try:
+        devices = await asyncio.gather(*[
+            _run_batch_on_device(adb_path, target, operations, stop_on_error, logger)
+            for target in targets
+        ])
+    except subprocess.TimeoutExpired:
+        raise HTTPException(status_code=500, detail="Batch operation timed out")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    payload = {
+        "success": all(device["success"] for device in devices),
+        "devices": devices,
+    }
+    if len(devices) == 1:
+        payload["results"] = devices[0]["results"]
+    return payload
+
+
+@router.post("/batch")
+async def batch_operations(payload: BatchRequest, request: Request, serial: Optional[str] = None):
+    """
+    Выполняет пакет операций delete/move/mkdir одним вызовом adb shell на устройство.
+
+    Каждая операция проверяется отдельно; результат возвращается по элементам.
+    """
+    return await _run_batch(request, payload.operations, payload.serials, serial, payload.stop_on_error)
+
+
+@router.post("/batch/delete")
+async def batch_delete(payload: BatchPathsRequest, request: Request, serial: Optional[str] = None):
+    """Пакетное удаление файлов/директорий."""
+    operations = [BatchOperation(op="delete", path=path) for path in payload.paths]
+    return await _run_batch(request, operations, payload.serials, serial, payload.stop_on_error)
+
+
+@router.post("/batch/mkdir")
+async def batch_mkdir(payload: BatchPathsRequest, request: Request, serial: Optional[str] = None):
+    """Пакетное создание директорий."""
+    operations = [BatchOperation(op="mkdir", path=path) for path in payload.paths]
+    return await _run_batch(request, operations, payload.serials, serial, payload.stop_on_error)
+
+
+def _chunk_dd_command(path: str, chunk_index: int, blocks_per_chunk: int) -> str:
+    skip = chunk_index * blocks_per_chunk
+    return (
+        f"dd if={shlex.quote(path)} bs={PARALLEL_BLOCK_SIZE} "
+        f"skip={skip} count={blocks_per_chunk} 2>/dev/null"
+    )
+
+
+def _load_pull_state(state_path: Path, identity: dict) -> dict:
+    """Возвращает завершённые диапазоны {index: sha256}, если состояние от того же файла."""
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    if state.get("identity") != identity:
+        return {}
+    return {int(index): digest for index, digest in (state.get("chunks") or {}).items()}
+
+
+def _save_pull_state(state_path: Path, identity: dict, chunks: dict):
+    tmp_path = state_path.with_name(state_path.name + ".tmp")
+    tmp_path.write_text(
+        json.dumps({"identity": identity, "chunks": {str(k): v for k, v in chunks.items()}}),
+        encoding="utf-8"
+    )
+    os.replace(tmp_path, state_path)
+
+
+def _verify_local_chunk(part_path: Path, offset: int, length: int, digest: str) -> bool:
+    hasher = hashlib.sha256()
+    with open(part_path, "rb") as handle:
+        handle.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = handle.read(min(PARALLEL_READ_SIZE, remaining))
+            if not data:
+                return False
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher.hexdigest() == digest
+
+
+def _pull_chunk(
+    adb_path,
+    serial: Optional[str],
+    path: str,
+    part_path: Path,
+    chunk_index: int,
+    chunk_size: int,
+    length: int,
+    verify: bool,
+    transfer=None
+) -> tuple[str, Optional[bool]]:
+    """
+    Читает один диапазон через exec-out dd и пишет его в part-файл по смещению.
+
+    Параллельно на устройстве считается sha256 того же диапазона;
+    возвращает (локальный sha256, совпал ли хэш или None, если на устройстве нет sha256sum).
+    """
+    base_cmd = _adb_base_cmd(adb_path, serial)
+    dd_command = _chunk_dd_command(path, chunk_index, chunk_size // PARALLEL_BLOCK_SIZE)
+    hash_proc = None
+    if verify:
+        hash_proc = subprocess.Popen(
+            base_cmd + ["shell", f"{dd_command} | sha256sum"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+
+    hasher = hashlib.sha256()
+    received = 0
+    args = base_cmd + ["exec-out", dd_command]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        # Зависший диапазон останавливается и уходит на повтор, а не держит всю загрузку
+        with _StallWatchdog(args, [proc, hash_proc], TRANSFER_STALL_SECONDS) as watchdog:
+            with open(part_path, "r+b") as handle:
+                handle.seek(chunk_index * chunk_size)
+                while True:
+                    data = proc.stdout.read(PARALLEL_READ_SIZE)
+                    if not data:
+                        break
+                    watchdog.progress()
+                    received += len(data)
+                    if received > length:
+                        raise RuntimeError(f"chunk {chunk_index}: device returned more data than expected")
+                    if transfer is not None:
+                        transfer.consume(len(data))
+                    hasher.update(data)
+                    handle.write(data)
+                    watchdog.progress()
+            proc.wait(timeout=30)
+    except subprocess.TimeoutExpired as exc:
+        if hash_proc:
+            _stop_process(hash_proc)
+        raise RuntimeError(f"chunk {chunk_index}: no data for {TRANSFER_STALL_SECONDS} s") from exc
+    finally:
+        _stop_process(proc)
+
+    if received != length:
+        if hash_proc:
+            _stop_process(hash_proc)
+        raise RuntimeError(f"chunk {chunk_index}: expected {length} bytes, got {received}")
+
+    digest = hasher.hexdigest()
+    if not hash_proc:
+        return digest, None
+    try:
+        remote_output, _ = hash_proc.communicate(timeout=120)
+    finally:
+        _stop_process(hash_proc)
+    remote_digest = _decode_output(remote_output).strip().split(" ")[0].lower()
+    if len(remote_digest) != 64:
+        return digest, None
+    if remote_digest != digest:
+        raise RuntimeError(f"chunk {chunk_index}: sha256 mismatch")
+    return digest, True
+
+
+@router.post("/pull-parallel")
+async def pull_file_parallel(payload: ParallelPullRequest, request: Request, serial: Optional[str] = None):
+    """
+    Скачивает большой файл несколькими параллельными потоками exec-out dd.
+
+    Файл делится на диапазоны по chunk_mb, каждый диапазон проверяется по sha256
+    (если на устройстве есть sha256sum) и пишется в заранее выделенный .part-файл.
+    Готовые диапазоны запоминаются в .part.json - повторный запрос докачивает только
+    недостающие.
+    """
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    streams = max(1, min(payload.streams, PARALLEL_MAX_STREAMS))
+    chunk_mb = max(1, min(payload.chunk_mb, PARALLEL_MAX_CHUNK_MB))
+    chunk_size = chunk_mb * PARALLEL_BLOCK_SIZE
+    logger = getattr(request.app.state, "logger", None)
+
+    try:
+        info = await _stat_remote(adb_path, serial, payload.path)
+        if info["is_dir"]:
+            raise HTTPException(status_code=400, detail="Parallel pull supports single files only")
+
+        target_dir = _resolve_download_dir(request, payload.destination_dir)
+        final_path = target_dir / Path(payload.path.rstrip("/")).name
+        part_path = final_path.with_name(final_path.name + ".part")
+        state_path = final_path.with_name(final_path.name + ".part.json")
+
+        size = info["size"]
+        identity = {
+            "serial": serial,
+            "path": payload.path,
+            "size": size,
+            "mtime": info["mtime"],
+            "chunk_size": chunk_size,
+        }
+        completed = _load_pull_state(state_path, identity) if part_path.exists() else {}
+        if not completed:
+            # Заранее выделяем место под весь файл, диапазоны пишутся по смещениям
+            with open(part_path, "wb") as handle:
+                handle.truncate(size)
+
+        total_chunks = math.ceil(size / chunk_size) if size else 0
+        lengths = {
+            index: min(chunk_size, size - index * chunk_size)
+            for index in range(total_chunks)
+        }
+        for index, digest in list(completed.items()):
+            valid = index in lengths and await run_in_threadpool(
+                _verify_local_chunk, part_path, index * chunk_size, lengths[index], digest
+            )
+            if not valid:
+                completed.pop(index, None)
+        resumed_chunks = len(completed)
+        pending = [index for index in range(total_chunks) if index not in completed]
+
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(streams)
+        state_lock = threading.Lock()
+        errors = {}
+        verified_flags = []
+
+        async def _run_chunk(index: int):
+            async with semaphore:
+                last_error = None
+                for _ in range(PARALLEL_CHUNK_RETRIES):
+                    try:
+                        digest, verified = await run_in_threadpool(
+                            _pull_chunk, adb_path, serial, payload.path, part_path,
+                            index, chunk_size, lengths[index], payload.verify, transfer
+                        )
+                    except Exception as exc:
+                        last_error = str(exc)
+                        continue
+                    verified_flags.append(verified)
+                    with state_lock:
+                        completed[index] = digest
+                        _save_pull_state(state_path, identity, completed)
+                    return
+                errors[index] = last_error
+
+        with governor.transfer(serial, "pull-parallel", payload.path, payload.background) as transfer:
+            await asyncio.gather(*[_run_chunk(index) for index in pending])
+        elapsed = time.perf_counter() - started
+        transferred = sum(lengths[index] for index in pending if index not in errors)
+
+        if logger:
+            logger.info(
+                "files.pull_parallel path=%s serial=%s size=%s chunks=%s streams=%s failed=%s elapsed=%.2fs",
+                payload.path, serial or "-", size, total_chunks, streams, len(errors), elapsed
+            )
+        if errors:
+            with state_lock:
+                _save_pull_state(state_path, identity, completed)
+            first_index = min(errors)
+            raise HTTPException(
+                status_code=502,
+                detail=(
+                    f"{len(errors)} of {total_chunks} chunks failed (first: {errors[first_index]}). "
+                    "Repeat the request to resume."
+                )
+            )
+
+        os.replace(part_path, final_path)
+        state_path.unlink(missing_ok=True)
+
+        return {
+            "success": True,
+            "path": str(final_path),
+            "size": size,
+            "chunks": total_chunks,
+            "resumed_chunks": resumed_chunks,
+            "streams": streams,
+            "chunk_size": chunk_size,
+            "verified": bool(verified_flags) and all(verified_flags),
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "throughput_mbps": round(transferred * 8 / elapsed / 1_000_000, 2) if elapsed > 0 else None,
+        }
+    except subprocess.TimeoutExpired:
+        raise HTTPException(status_code=500, detail="Parallel pull timed out")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _get_file_cache(request: Request) -> DiskLRUCache:
+    global _FILE_CACHE
+    if _FILE_CACHE is None:
+        config = getattr(request.app.state, "config", None)
+        cache_cfg = (config or {}).get("cache", {}) if isinstance(config, dict) else {}
+        max_mb = int(cache_cfg.get("files_mb") or 2048)
+        _FILE_CACHE = DiskLRUCache(get_cache_dir(config) / "files", max_mb * 1024 * 1024)
+    return _FILE_CACHE
+
+
+def _file_cache_index(cache: DiskLRUCache) -> dict:
+    global _FILE_CACHE_INDEX
+    if _FILE_CACHE_INDEX is None:
+        index_path = cache.root / "index.json"
+        try:
+            _FILE_CACHE_INDEX = json.loads(index_path.read_text(encoding="utf-8"))
+        except Exception:
+            _FILE_CACHE_INDEX = {}
+    return _FILE_CACHE_INDEX
+
+
+def _save_file_cache_index(cache: DiskLRUCache, index: dict):
+    cache.root.mkdir(parents=True, exist_ok=True)
+    # Записи, чьи блобы уже вытеснены, не храним
+    alive = {key: digest for key, digest in index.items() if digest in cache}
+    index.clear()
+    index.update(alive)
+    tmp_path = cache.root / "index.json.tmp"
+    tmp_path.write_text(json.dumps(index), encoding="utf-8")
+    os.replace(tmp_path, cache.root / "index.json")
+
+
+def _file_cache_key(serial: Optional[str], path: str, size: int, mtime: int) -> str:
+    raw = f"{serial or '-'}|{path}|{size}|{mtime}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _sha256_file(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for data in iter(lambda: handle.read(PARALLEL_READ_SIZE), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+async def _remote_sha256(adb_path, serial: Optional[str], path: str) -> Optional[str]:
+    result = await _run_adb_shell(adb_path, serial, ["sha256sum", shlex.quote(path)], timeout=120)
+    digest = _decode_output(result.stdout).strip().split(" ")[0].lower()
+    if result.returncode != 0 or len(digest) != 64:
+        return None
+    return digest
+
+
+def _record_file_cache_entry(cache: DiskLRUCache, key: str, digest: str, counter: str, saved_bytes: int):
+    with _FILE_CACHE_LOCK:
+        _FILE_CACHE_COUNTERS[counter] += 1
+        _FILE_CACHE_COUNTERS["bytes_saved"] += saved_bytes
+        index = _file_cache_index(cache)
+        if index.get(key) != digest:
+            index[key] = digest
+            _save_file_cache_index(cache, index)
+
+
+async def _record_pinned_entry(cache: DiskLRUCache, key: str, digest: str, counter: str, saved_bytes: int):
+    """_record_file_cache_entry для уже закреплённого файла: при ошибке закрепление снимается."""
+    try:
+        await run_in_threadpool(_record_file_cache_entry, cache, key, digest, counter, saved_bytes)
+    except BaseException:
+        # Иначе запись осталась бы закреплённой навсегда и кэш вырос бы сверх files_mb
+        cache.release(digest)
+        raise
+
+
+def _cached_blob(cache: DiskLRUCache, digest: str, size: int) -> Optional[Path]:
+    """Закреплённый файл кэша нужного размера или None."""
+    blob = cache.get(digest, pin=True)
+    if blob is None:
+        return None
+    if blob.stat().st_size == size:
+        return blob
+    cache.release(digest)
+    return None
+
+
+async def _pull_through_cache(
+    request: Request,
+    adb_path,
+    serial: Optional[str],
+    path: str,
+    verify_hash: bool = False,
+    background: bool = False
+) -> tuple[Optional[Path], bool]:
+    """
+    Возвращает (путь к файлу в кэше, было ли попадание).
+
+    Попадание по (serial, path, size, mtime) не трогает устройство, кроме stat.
+    С verify_hash на устройстве считается sha256, и тот же контент находится
+    даже под другим путём или на другом устройстве.
+    Для директорий и файлов крупнее всего кэша возвращает (None, False) -
+    их кэш не обслуживает. Возвращённый файл закреплён в кэше: вызывающий
+    снимает закрепление через _release_cached(request, path), когда файл отдан.
+    """
+    info = await _stat_remote(adb_path, serial, path)
+    if info["is_dir"]:
+        return None, False
+
+    cache = _get_file_cache(request)
+    if info["size"] > cache.max_bytes:
+        return None, False
+    key = _file_cache_key(serial, path, info["size"], info["mtime"])
+    remote_digest = await _remote_sha256(adb_path, serial, path) if verify_hash else None
+    with _FILE_CACHE_LOCK:
+        indexed_digest = _file_cache_index(cache).get(key)
+
+    digest = remote_digest or indexed_digest
+    if digest:
+        blob = await run_in_threadpool(_cached_blob, cache, digest, info["size"])
+        if blob is not None:
+            counter = "device_hits" if digest == indexed_digest else "content_hits"
+            await _record_pinned_entry(cache, key, digest, counter, info["size"])
+            return blob, True
+
+    incoming_dir = cache.root / "incoming"
+    incoming_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = incoming_dir / f"{uuid.uuid4().hex}.tmp"
+    try:
+        result = await _adb_pull(
+            adb_path, serial, path, tmp_path, background, size=info["size"], timeout=600
+        )
+        if result.returncode != 0 or not tmp_path.exists():
+            stderr = _decode_output(result.stderr).strip()
+            raise HTTPException(status_code=400, detail=stderr or "Pull failed")
+
+        digest = await run_in_threadpool(_sha256_file, tmp_path)
+        if remote_digest and digest != remote_digest:
+            raise HTTPException(status_code=502, detail="sha256 mismatch after pull")
+        blob = await run_in_threadpool(cache.put_file, digest, tmp_path, True, True)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+    await _record_pinned_entry(cache, key, digest, "device_pulls", 0)
+    return blob, False
+
+
+def _release_cached(request: Request, cached_path: Path):
+    """Снимает закрепление файла, полученного из _pull_through_cache."""
+    _get_file_cache(request).release(cached_path.name)
+
+
+@router.get("/cache/stats")
+async def file_cache_stats(request: Request):
+    """Статистика кэша скачанных файлов."""
+    cache = _get_file_cache(request)
+    stats = await run_in_threadpool(cache.stats)
+    with _FILE_CACHE_LOCK:
+        stats["indexed_paths"] = len(_file_cache_index(cache))
+        stats.update(_FILE_CACHE_COUNTERS)
+    return stats
+
+
+@router.delete("/cache")
+async def clear_file_cache(request: Request):
+    """Очищает кэш скачанных файлов."""
+    cache = _get_file_cache(request)
+
+    def _clear():
+        with _FILE_CACHE_LOCK:
+            cache.clear()
+            _file_cache_index(cache).clear()
+
+    await run_in_threadpool(_clear)
+    return {"success": True}
+
+
+@router.get("/qos")
+async def get_transfer_qos(request: Request):
+    """Лимиты, активные сессии scrcpy и фактическая скорость передач по устройствам."""
+    return governor.snapshot()
+
+
+@router.post("/qos")
+async def update_transfer_qos(payload: QosUpdate):
+    """Меняет лимиты передач для устройства или значения по умолчанию (до перезапуска)."""
+    limits = {
+        name: getattr(payload, name)
+        for name in DEFAULT_TRANSFER_CONFIG
+        if getattr(payload, name) is not None
+    }
+    if any(value < 0 for value in limits.values()):
+        raise HTTPException(status_code=400, detail="Rates must be non-negative")
+    governor.set_limits(payload.serial, limits)
+    return {"success": True, **governor.snapshot()}
+
+
 @router.post("/upload")
 async def upload_file(
     request: Request,
     file: UploadFile = File(...),
     destination: str = Query("/sdcard", description="Destination path on device"),
-    serial: Optional[str] = Query(None, description="Device serial")
+    serial: Optional[str] = Query(None, description="Device serial"),
+    background: bool = Query(False, description="Low-priority transfer")
 ):
     """
     Загружает файл на устройство (adb push).
@@ -303,6 +1574,7 @@ async def upload_file(
         file: Файл для загрузки
         destination: Путь на устройстве
         serial: Серийный номер устройства
+        background: Фоновая передача с пониженным приоритетом
     """
     try:
         adb_path = _resolve_adb_path(request)
@@ -319,12 +1591,7 @@ async def upload_file(
         
         dest_path = f"{destination.rstrip('/')}/{file.filename}"
         
-        cmd = [str(adb_path)]
-        if serial:
-            cmd.extend(["-s", serial])
-        cmd.extend(["push", str(tmp_path), dest_path])
-        
-        result = await run_in_threadpool(subprocess.run, cmd, capture_output=True, timeout=120)
+        result = await _adb_push(adb_path, serial, tmp_path, dest_path, background, timeout=120)
         
         if result.returncode != 0:
             raise HTTPException(status_code=400, detail=_decode_output(result.stderr))
@@ -351,7 +1618,10 @@ async def upload_file(
 async def download_file(
     request: Request,
     path: str = Query(..., description="File path on device"),
-    serial: Optional[str] = Query(None, description="Device serial")
+    serial: Optional[str] = Query(None, description="Device serial"),
+    use_cache: bool = Query(True, description="Serve repeated downloads from the host cache"),
+    verify_hash: bool = Query(False, description="Match the cache by device-side sha256"),
+    background: bool = Query(False, description="Low-priority transfer")
 ):
     """
     Скачивает файл с устройства (adb pull).
@@ -359,6 +1629,9 @@ async def download_file(
     Args:
         path: Путь к файлу на устройстве
         serial: Серийный номер устройства
+        use_cache: Отдавать повторные скачивания из кэша на хосте
+        verify_hash: Сверять кэш по sha256, посчитанному на устройстве
+        background: Фоновая передача с пониженным приоритетом
     """
     try:
         adb_path = _resolve_adb_path(request)
@@ -366,16 +1639,37 @@ async def download_file(
         raise HTTPException(status_code=500, detail=str(exc))
     
     filename = Path(path).name
+
+    if use_cache:
+        try:
+            cached_path, hit = await _pull_through_cache(
+                request, adb_path, serial, path, verify_hash, background
+            )
+        except subprocess.TimeoutExpired:
+            raise HTTPException(status_code=500, detail="Download timed out")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if cached_path is not None:
+            return FileResponse(
+                cached_path,
+                filename=filename,
+                media_type="application/octet-stream",
+                headers={"X-Cache": "HIT" if hit else "MISS"},
+                # Пока файл отдаётся, он не вытесняется из кэша
+                background=BackgroundTask(_release_cached, request, cached_path)
+            )
+
     tmp_dir = Path(tempfile.mkdtemp())
     tmp_path = tmp_dir / filename
     
     try:
-        cmd = [str(adb_path)]
-        if serial:
-            cmd.extend(["-s", serial])
-        cmd.extend(["pull", path, str(tmp_path)])
-        
-        result = await run_in_threadpool(subprocess.run, cmd, capture_output=True, timeout=120)
+        size = None
+        if governor.is_limited(serial, background):
+            info = await _stat_remote(adb_path, serial, path)
+            size = None if info["is_dir"] else info["size"]
+        result = await _adb_pull(adb_path, serial, path, tmp_path, background, size=size, timeout=120)
         
         if result.returncode != 0 or not tmp_path.exists():
             stderr = _decode_output(result.stderr)
@@ -384,7 +1678,8 @@ async def download_file(
         return FileResponse(
             tmp_path,
             filename=filename,
-            media_type="application/octet-stream"
+            media_type="application/octet-stream",
+            background=BackgroundTask(shutil.rmtree, tmp_dir, ignore_errors=True)
         )
         
     except subprocess.TimeoutExpired:
@@ -606,12 +1901,34 @@ async def pull_file(payload: PullRequest, request: Request, serial: Optional[str
     source_path = payload.path
 
     try:
-        cmd = [str(adb_path)]
-        if serial:
-            cmd.extend(["-s", serial])
-        cmd.extend(["pull", source_path, str(target_dir)])
-
-        result = await run_in_threadpool(subprocess.run, cmd, capture_output=True, timeout=120)
+        if payload.use_cache:
+            cached_path, hit = await _pull_through_cache(
+                request, adb_path, serial, source_path, payload.verify_hash, payload.background
+            )
+            if cached_path is not None:
+                final_path = target_dir / Path(source_path.rstrip("/")).name
+                try:
+                    await run_in_threadpool(shutil.copyfile, cached_path, final_path)
+                finally:
+                    _release_cached(request, cached_path)
+                if logger:
+                    logger.info("files.pull path=%s serial=%s cache=%s", source_path, serial or "-", hit)
+                return {
+                    "success": True,
+                    "path": str(final_path),
+                    "cached": hit
+                }
+
+        size = None
+        destination = target_dir
+        if governor.is_limited(serial, payload.background):
+            info = await _stat_remote(adb_path, serial, source_path)
+            if not info["is_dir"]:
+                size = info["size"]
+                destination = target_dir / Path(source_path.rstrip("/")).name
+        result = await _adb_pull(
+            adb_path, serial, source_path, destination, payload.background, size=size, timeout=120
+        )
         stderr = _decode_output(result.stderr).strip()
         stdout = _decode_output(result.stdout).strip()
         if logger:
@@ -1,27 +1,123 @@
 """
 Модуль галереи скриншотов.
 Позволяет делать скриншоты, хранить их с метаданными и управлять коллекцией.
+Метаданные хранятся в SQLite-индексе (gallery_index), наличие файлов
+отслеживает DirectoryWatcher.
 
 Эндпоинты:
 - GET /api/screenshots - список скриншотов
-- POST /api/screenshots/take - сделать скриншот
+- POST /api/screenshots/take - сделать скриншот (exec-out screencap прямо в память)
+- POST /api/screenshots/burst - серия кадров с заданной частотой
+- GET /api/screenshots/bursts/{burst_id} - кадры серии по порядку
+- POST /api/screenshots/group - одновременный снимок нескольких устройств
+- GET /api/screenshots/groups/{group_id} - снимки групповой съёмки
+- GET|POST /api/screenshots/export - zip-архив (ID, диапазон дат или всё) с manifest.json
+- GET /api/screenshots/{id}/similar - похожие скриншоты по перцептивному хэшу
+- GET /api/screenshots/duplicates - группы почти одинаковых скриншотов
+- POST /api/screenshots/duplicates/collapse - оставить по одному скриншоту из группы
+- GET /api/screenshots/similarity/status - сколько скриншотов проиндексировано
+- POST /api/screenshots/similarity/rebuild - досчитать хэши для старых скриншотов
+- GET /api/screenshots/storage - формат хранения, экономия места, состояние перекодирования
+- POST /api/screenshots/storage/reencode - перекодировать галерею в фоне
+- DELETE /api/screenshots/storage/reencode - остановить перекодирование
+- DELETE /api/screenshots/storage/originals - удалить сохранённые оригиналы
+- GET /api/screenshots/{id}/original - исходный файл (если сохранён)
 - GET /api/screenshots/{id} - получить файл скриншота
+- GET /api/screenshots/{id}/thumbnail - уменьшенная копия (WebP/JPEG/PNG)
 - PUT /api/screenshots/{id}/caption - обновить подпись
+- PUT /api/screenshots/{id}/pin - закрепить скриншот (политика хранения его не удалит)
 - DELETE /api/screenshots/{id} - удалить скриншот
 """
+import asyncio
+import hashlib
 import json
 import math
+import mimetypes
+import os
+import shutil
 import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from typing import Optional, List
-from fastapi import APIRouter, HTTPException, Request, Query
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Query
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from starlette.concurrency import run_in_threadpool
-from mkdsc.paths import get_screenshots_dir
+from mkdsc.config import load_config
+from mkdsc.paths import get_cache_dir, get_screenshots_dir
+from mkdsc.web import imaging
+from mkdsc.web.dir_watcher import DirectoryWatcher
+from mkdsc.web.disk_cache import DiskLRUCache
+from mkdsc.web.gallery_index import MAX_DUPLICATE_DISTANCE, MAX_HASH_DISTANCE, GalleryIndex
+from mkdsc.web.workers import get_process_pool, pool_size, run_in_process
+from mkdsc.web.zip_stream import iter_file, iter_zip
 
 router = APIRouter(prefix="/api/screenshots", tags=["screenshots"])
 
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_IEND = b"IEND\xaeB`\x82"
+
+# Устройства, на которых exec-out screencap отдаёт битые данные, -> monotonic-время,
+# до которого для них сразу идём в fallback (потом exec-out пробуется снова)
+_EXEC_OUT_BROKEN = {}
+EXEC_OUT_BROKEN_TTL = 3600
+
+BURST_MAX_FPS = 30.0
+BURST_MAX_DURATION = 120.0
+BURST_MAX_FRAMES = 1800
+
+GROUP_MAX_DEVICES = 32
+GROUP_BARRIER_TIMEOUT = 5.0
+
+GALLERY_THUMBNAIL_SIZE = 320
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "private, no-cache"
+
+_GALLERY_THUMBNAILS: Optional[DiskLRUCache] = None
+
+SCREENSHOT_SUFFIXES = (".png", ".webp", ".jpg", ".jpeg")
+WATCH_INTERVAL_SECONDS = 3.0
+
+_INDEX: Optional[GalleryIndex] = None
+_WATCHER: Optional[DirectoryWatcher] = None
+_INDEX_LOCK = threading.Lock()
+
+HASH_BATCH_SIZE = 64
+DUPLICATE_DISTANCE = 4
+SIMILAR_DISTANCE = 10
+
+_HASH_BACKFILL = {"running": False, "processed": 0, "failed": 0, "started_at": None, "finished_at": None}
+_HASH_BACKFILL_TASK: Optional[asyncio.Task] = None
+
+ORIGINALS_DIR_NAME = "originals"
+DEFAULT_GALLERY_SETTINGS = {
+    "storage_format": "original",
+    "lossy_quality": 85,
+    "keep_originals": False,
+    "reencode_workers": 2,
+}
+
+_REENCODE_JOB = {
+    "running": False,
+    "cancel": False,
+    "storage_format": None,
+    "processed": 0,
+    "skipped": 0,
+    "failed": 0,
+    "bytes_before": 0,
+    "bytes_after": 0,
+    "bytes_retained": 0,
+    "started_at": None,
+    "finished_at": None,
+    "elapsed_s": 0.0,
+}
+_REENCODE_TASK: Optional[asyncio.Task] = None
+
 # Директория для скриншотов
 def _resolve_paths():
     screenshots_dir = get_screenshots_dir()
@@ -44,6 +140,54 @@ class CaptionUpdate(BaseModel):
     caption: str
 
 
+class PinUpdate(BaseModel):
+    """Запрос на закрепление скриншота."""
+    pinned: bool = True
+
+
+class BurstRequest(BaseModel):
+    """Запрос на серийную съёмку: fps кадров в секунду в течение duration секунд."""
+    serial: Optional[str] = None
+    fps: float = 5.0
+    duration: float = 5.0
+    format: str = "png"
+    lossless: bool = True
+    caption: str = ""
+    max_inflight: int = 3
+
+
+class GroupCaptureRequest(BaseModel):
+    """Групповой снимок: выбранные устройства или все подключённые."""
+    serials: Optional[List[str]] = None
+    caption: str = ""
+
+
+class ExportRequest(BaseModel):
+    """Выбор скриншотов для экспорта: по ID, диапазону дат, серии или все."""
+    ids: Optional[List[str]] = None
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    burst_id: Optional[str] = None
+    thumbnails: bool = False
+    thumbnail_size: int = GALLERY_THUMBNAIL_SIZE
+    thumbnail_format: str = "webp"
+
+
+class ReencodeRequest(BaseModel):
+    """Параметры фонового перекодирования; пустые поля берутся из настроек gallery."""
+    storage_format: Optional[str] = None
+    lossy_quality: Optional[int] = None
+    keep_originals: Optional[bool] = None
+    workers: Optional[int] = None
+
+
+class CollapseRequest(BaseModel):
+    """Схлопывание дубликатов: в каждой группе остаётся один скриншот."""
+    max_distance: int = DUPLICATE_DISTANCE
+    keep: str = "newest"
+    dry_run: bool = True
+
+
 def _resolve_adb_path(request: Request):
     adb_path = getattr(request.app.state, "adb_path", None)
     if adb_path:
@@ -58,72 +202,614 @@ def _decode_output(raw: Optional[bytes]) -> str:
     return raw.decode("utf-8", errors="replace")
 
 
+def _is_valid_png(data: Optional[bytes]) -> bool:
+    return bool(data) and data.startswith(PNG_SIGNATURE) and PNG_IEND in data[-64:]
+
+
+def _write_atomic(path, data: bytes):
+    """Пишет файл через временное имя, чтобы в галерее не появлялись недописанные PNG."""
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+async def _capture_via_device_file(cmd_base: List[str], timestamp: str) -> bytes:
+    """Старый путь: screencap во временный файл на устройстве, pull, rm."""
+    device_path = f"/sdcard/screenshot_{timestamp}_{uuid.uuid4().hex[:6]}.png"
+    screenshots_dir, _ = _resolve_paths()
+    tmp_path = screenshots_dir / f".pull_{uuid.uuid4().hex}.tmp"
+    try:
+        result = await run_in_threadpool(
+            subprocess.run,
+            cmd_base + ["shell", "screencap", "-p", device_path],
+            capture_output=True,
+            timeout=30
+        )
+        if result.returncode != 0:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to capture screenshot: {_decode_output(result.stderr)}"
+            )
+
+        result = await run_in_threadpool(
+            subprocess.run,
+            cmd_base + ["pull", device_path, str(tmp_path)],
+            capture_output=True,
+            timeout=30
+        )
+        if result.returncode != 0 or not tmp_path.exists():
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to pull screenshot: {_decode_output(result.stderr)}"
+            )
+        return tmp_path.read_bytes()
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        # Удаляем с устройства даже после неудачного pull, чтобы не оставлять мусор
+        await run_in_threadpool(
+            subprocess.run,
+            cmd_base + ["shell", "rm", "-f", device_path],
+            capture_output=True,
+            timeout=10
+        )
+
+
+def _exec_out_broken(device_key: str) -> bool:
+    expires = _EXEC_OUT_BROKEN.get(device_key)
+    if expires is None:
+        return False
+    if time.monotonic() >= expires:
+        _EXEC_OUT_BROKEN.pop(device_key, None)
+        return False
+    return True
+
+
+async def capture_png(adb_path, serial: Optional[str]) -> tuple[bytes, str]:
+    """
+    Снимает экран в память через exec-out screencap -p.
+
+    Возвращает (PNG, способ съёмки). Если exec-out не сработал, этот снимок
+    делается через временный файл на /sdcard. Устройство запоминается
+    (на EXEC_OUT_BROKEN_TTL) только если exec-out отдал данные, но не PNG, -
+    разовый таймаут или сбой adb так не помечаются.
+    """
+    cmd_base = [str(adb_path)]
+    if serial:
+        cmd_base.extend(["-s", serial])
+
+    device_key = serial or "-"
+    if not _exec_out_broken(device_key):
+        try:
+            result = await run_in_threadpool(
+                subprocess.run,
+                cmd_base + ["exec-out", "screencap", "-p"],
+                capture_output=True,
+                timeout=30
+            )
+        except subprocess.TimeoutExpired:
+            result = None
+        if result is not None:
+            if result.returncode == 0 and _is_valid_png(result.stdout):
+                return result.stdout, "exec-out"
+            stderr = _decode_output(result.stderr)
+            # Нет устройства - fallback не поможет
+            if "not found" in stderr or "no devices" in stderr or "offline" in stderr:
+                raise HTTPException(status_code=500, detail=f"Failed to capture screenshot: {stderr.strip()}")
+            if result.returncode == 0 and result.stdout:
+                # Данные есть, но это не PNG (например, переводы строк испорчены) - это свойство устройства
+                _EXEC_OUT_BROKEN[device_key] = time.monotonic() + EXEC_OUT_BROKEN_TTL
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return await _capture_via_device_file(cmd_base, timestamp), "device-file"
+
+
+def screenshot_version(entry: dict) -> str:
+    """
+    Версия содержимого скриншота для URL (?v=) и ETag.
+
+    Считается по метаданным, без stat: файл скриншота не меняется,
+    а при перекодировании меняются имя и размер.
+    """
+    raw = f"{entry.get('filename', '')}|{entry.get('size_bytes', 0)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _with_urls(entry: dict) -> dict:
+    version = screenshot_version(entry)
+    return {
+        **entry,
+        "version": version,
+        "url": f"/api/screenshots/{entry['id']}?v={version}",
+        "thumbnail_url": f"/api/screenshots/{entry['id']}/thumbnail?v={version}",
+    }
+
+
+def _cache_headers(etag: str, last_modified: float, versioned: bool) -> dict:
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": CACHE_IMMUTABLE if versioned else CACHE_REVALIDATE,
+    }
+
+
+def _is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """Условный GET: If-None-Match приоритетнее If-Modified-Since (RFC 9110)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [item.strip() for item in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _get_thumbnail_cache(request: Request) -> DiskLRUCache:
+    global _GALLERY_THUMBNAILS
+    if _GALLERY_THUMBNAILS is None:
+        config = getattr(request.app.state, "config", None)
+        cache_cfg = (config or {}).get("cache", {}) if isinstance(config, dict) else {}
+        max_mb = int(cache_cfg.get("thumbnails_mb") or 256)
+        _GALLERY_THUMBNAILS = DiskLRUCache(get_cache_dir(config) / "gallery_thumbnails", max_mb * 1024 * 1024)
+    return _GALLERY_THUMBNAILS
+
+
+def _thumbnail_key(entry: dict, size: int, fmt: str) -> str:
+    raw = f"{entry['id']}|{screenshot_version(entry)}|{size}|{fmt}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def _ensure_thumbnail(cache: DiskLRUCache, entry: dict, size: int, fmt: str) -> bytes:
+    """Берёт миниатюру из кэша или строит её в пуле процессов."""
+    key = _thumbnail_key(entry, size, fmt)
+    data = await run_in_threadpool(cache.get_bytes, key)
+    if data is None:
+        screenshots_dir, _ = _resolve_paths()
+        data = await run_in_process(
+            imaging.make_thumbnail_file, str(screenshots_dir / entry["filename"]), size, fmt
+        )
+        await run_in_threadpool(cache.put_bytes, key, data)
+    return data
+
+
+async def _prewarm_thumbnail(cache: DiskLRUCache, entry: dict, logger):
+    """Миниатюра для сетки галереи сразу после съёмки, пока клиент её не запросил."""
+    try:
+        await _ensure_thumbnail(cache, entry, GALLERY_THUMBNAIL_SIZE, "webp")
+    except Exception as exc:
+        if logger:
+            logger.warning("gallery.thumbnail_prewarm id=%s error=%s", entry.get("id"), exc)
+
+
+def hashing_available() -> bool:
+    return imaging.numpy_available() and imaging.pillow_available()
+
+
+async def _hash_entries(entries: List[dict]) -> tuple[int, List[str]]:
+    """Считает pHash/aHash в пуле процессов и сохраняет в индекс: (успешно, ID с ошибкой)."""
+    if not entries:
+        return 0, []
+    screenshots_dir, _ = _resolve_paths()
+    results = await asyncio.gather(
+        *(
+            run_in_process(imaging.perceptual_hashes, str(screenshots_dir / entry["filename"]))
+            for entry in entries
+        ),
+        return_exceptions=True
+    )
+    items = [
+        (entry["id"], result[0], result[1])
+        for entry, result in zip(entries, results)
+        if not isinstance(result, BaseException)
+    ]
+    index = await run_in_threadpool(get_index)
+    await run_in_threadpool(index.set_hashes, items)
+    failed = [entry["id"] for entry, result in zip(entries, results) if isinstance(result, BaseException)]
+    return len(items), failed
+
+
+async def _hash_in_background(entries: List[dict], logger):
+    try:
+        await _hash_entries(entries)
+    except Exception as exc:
+        if logger:
+            logger.warning("gallery.phash count=%s error=%s", len(entries), exc)
+
+
+async def _run_hash_backfill(logger):
+    """Досчитывает хэши для скриншотов без них, пачками по HASH_BATCH_SIZE."""
+    _HASH_BACKFILL.update(running=True, processed=0, failed=0, started_at=datetime.now().isoformat(), finished_at=None)
+    failed_ids = set()
+    try:
+        index = await run_in_threadpool(get_index)
+        while True:
+            batch = await run_in_threadpool(index.unhashed, HASH_BATCH_SIZE + len(failed_ids))
+            batch = [entry for entry in batch if entry["id"] not in failed_ids][:HASH_BATCH_SIZE]
+            if not batch:
+                break
+            done, failed = await _hash_entries(batch)
+            _HASH_BACKFILL["processed"] += done
+            _HASH_BACKFILL["failed"] += len(failed)
+            # Битые файлы остаются без хэша - запоминаем, чтобы не выбирать их снова
+            failed_ids.update(failed)
+    except Exception as exc:
+        if logger:
+            logger.warning("gallery.phash_backfill error=%s", exc)
+    finally:
+        _HASH_BACKFILL.update(running=False, finished_at=datetime.now().isoformat())
+        if logger:
+            logger.info(
+                "gallery.phash_backfill processed=%s failed=%s",
+                _HASH_BACKFILL["processed"], _HASH_BACKFILL["failed"]
+            )
+
+
+def gallery_settings() -> dict:
+    """Секция gallery из конфига (читается с диска, как и путь к скриншотам)."""
+    gallery_cfg = load_config().get("gallery")
+    settings = dict(DEFAULT_GALLERY_SETTINGS)
+    if isinstance(gallery_cfg, dict):
+        settings.update({key: gallery_cfg[key] for key in DEFAULT_GALLERY_SETTINGS if key in gallery_cfg})
+    return settings
+
+
+def _remove_entry_files(entry: dict):
+    """Удаляет файл скриншота и сохранённый оригинал."""
+    screenshots_dir, _ = _resolve_paths()
+    (screenshots_dir / entry["filename"]).unlink(missing_ok=True)
+    if entry.get("original_filename"):
+        (screenshots_dir / ORIGINALS_DIR_NAME / entry["original_filename"]).unlink(missing_ok=True)
+
+
+def delete_entries(entries: List[dict]) -> int:
+    """Удаляет скриншоты вместе с файлами (используется и политикой хранения)."""
+    for entry in entries:
+        _remove_entry_files(entry)
+    get_index().delete([entry["id"] for entry in entries])
+    return len(entries)
+
+
+def _commit_reencoded(entry: dict, data: bytes, storage_format: str, keep_originals: bool) -> dict:
+    """
+    Подменяет файл скриншота перекодированным.
+
+    С keep_originals оригинал сохраняется жёсткой ссылкой в originals/ до замены
+    (место он при этом не освобождает - см. retained в результате). Без него новый
+    файл пишется атомарно рядом, так что скриншот ни в какой момент не остаётся без файла.
+    """
+    # Запись могли изменить (подпись) или уже перекодировать, пока файл кодировался
+    entry = get_index().get(entry["id"])
+    if entry is None:
+        raise FileNotFoundError("Screenshot was deleted")
+    screenshots_dir, _ = _resolve_paths()
+    current_path = screenshots_dir / entry["filename"]
+    current_size = current_path.stat().st_size
+    if entry.get("storage_format") == storage_format:
+        return {"id": entry["id"], "before": current_size, "after": current_size, "retained": 0, "skipped": True}
+    extension = imaging.STORAGE_FORMATS[storage_format][1]
+    updated = dict(entry, storage_format=storage_format)
+
+    if len(data) >= current_size:
+        # Сжать сильнее не вышло - оставляем файл как есть и больше его не трогаем
+        updated["storage_skipped"] = "larger"
+        get_index().update(updated)
+        return {"id": entry["id"], "before": current_size, "after": current_size, "retained": 0, "skipped": True}
+
+    updated.pop("storage_skipped", None)
+    updated.setdefault("original_size_bytes", current_size)
+    retained = 0
+    if keep_originals and not entry.get("original_filename"):
+        originals_dir = screenshots_dir / ORIGINALS_DIR_NAME
+        originals_dir.mkdir(exist_ok=True)
+        original_path = originals_dir / entry["filename"]
+        try:
+            os.link(current_path, original_path)
+        except OSError:
+            shutil.copy2(current_path, original_path)
+        updated["original_filename"] = entry["filename"]
+        retained = current_size
+
+    new_name = f"{os.path.splitext(entry['filename'])[0]}.{extension}"
+    _write_atomic(screenshots_dir / new_name, data)
+    updated["filename"] = new_name
+    updated["size_bytes"] = len(data)
+    get_index().update(updated)
+    if new_name != entry["filename"]:
+        current_path.unlink(missing_ok=True)
+    return {"id": entry["id"], "before": current_size, "after": len(data), "retained": retained, "skipped": False}
+
+
+async def _reencode_entry(entry: dict, storage_format: str, quality: int, keep_originals: bool) -> dict:
+    screenshots_dir, _ = _resolve_paths()
+    source = screenshots_dir / entry["filename"]
+    if entry.get("original_filename"):
+        # Перекодируем из оригинала, чтобы не копить потери при смене формата
+        original = screenshots_dir / ORIGINALS_DIR_NAME / entry["original_filename"]
+        if original.exists():
+            source = original
+    data = await run_in_process(imaging.encode_for_storage, str(source), storage_format, quality)
+    return await run_in_threadpool(_commit_reencoded, entry, data, storage_format, keep_originals)
+
+
+async def _reencode_in_background(entries: List[dict], settings: dict, logger):
+    for entry in entries:
+        try:
+            await _reencode_entry(
+                entry, settings["storage_format"], int(settings["lossy_quality"]), bool(settings["keep_originals"])
+            )
+        except Exception as exc:
+            if logger:
+                logger.warning("gallery.reencode id=%s error=%s", entry.get("id"), exc)
+
+
+async def _run_reencode_job(storage_format: str, quality: int, keep_originals: bool, workers: int, logger):
+    """Перекодирует галерею пачками; одновременно в пуле не больше workers задач."""
+    started = time.perf_counter()
+    _REENCODE_JOB.update(
+        running=True, cancel=False, storage_format=storage_format, processed=0, skipped=0, failed=0,
+        bytes_before=0, bytes_after=0, bytes_retained=0,
+        started_at=datetime.now().isoformat(), finished_at=None, elapsed_s=0.0
+    )
+    slots = asyncio.Semaphore(workers)
+    failed_ids = set()
+
+    async def _one(entry):
+        async with slots:
+            try:
+                result = await _reencode_entry(entry, storage_format, quality, keep_originals)
+            except Exception as exc:
+                failed_ids.add(entry["id"])
+                _REENCODE_JOB["failed"] += 1
+                if logger:
+                    logger.warning("gallery.reencode id=%s error=%s", entry.get("id"), exc)
+                return
+            _REENCODE_JOB["processed"] += 1
+            _REENCODE_JOB["skipped"] += int(result["skipped"])
+            _REENCODE_JOB["bytes_before"] += result["before"]
+            _REENCODE_JOB["bytes_after"] += result["after"]
+            _REENCODE_JOB["bytes_retained"] += result["retained"]
+            _REENCODE_JOB["elapsed_s"] = round(time.perf_counter() - started, 2)
+
+    try:
+        index = await run_in_threadpool(get_index)
+        while not _REENCODE_JOB["cancel"]:
+            batch = await run_in_threadpool(
+                index.storage_candidates, storage_format, workers * 4, failed_ids
+            )
+            if not batch:
+                break
+            await asyncio.gather(*(_one(entry) for entry in batch))
+    finally:
+        _REENCODE_JOB.update(
+            running=False, finished_at=datetime.now().isoformat(),
+            elapsed_s=round(time.perf_counter() - started, 2)
+        )
+        if logger:
+            logger.info(
+                "gallery.reencode_job format=%s processed=%s failed=%s before=%s after=%s elapsed=%.1fs",
+                storage_format, _REENCODE_JOB["processed"], _REENCODE_JOB["failed"],
+                _REENCODE_JOB["bytes_before"], _REENCODE_JOB["bytes_after"], _REENCODE_JOB["elapsed_s"]
+            )
+
+
+def _reencode_job_status() -> dict:
+    status = {key: value for key, value in _REENCODE_JOB.items() if key != "cancel"}
+    elapsed = status["elapsed_s"] or 0
+    # Сохранённые в originals/ оригиналы место не освобождают
+    status["saved_bytes"] = status["bytes_before"] - status["bytes_after"] - status["bytes_retained"]
+    status["files_per_s"] = round(status["processed"] / elapsed, 2) if elapsed else None
+    status["input_mb_per_s"] = round(status["bytes_before"] / elapsed / 1_000_000, 2) if elapsed else None
+    return status
+
+
+async def _prewarm_thumbnails(cache: DiskLRUCache, entries: List[dict], logger):
+    for entry in entries:
+        await _prewarm_thumbnail(cache, entry, logger)
+
+
+def _schedule_post_capture(background_tasks: BackgroundTasks, request: Request, entries: List[dict]):
+    """Фоновая обработка новых снимков: миниатюра для сетки, хэши, перекодирование в формат хранения."""
+    logger = getattr(request.app.state, "logger", None)
+    if imaging.pillow_available():
+        background_tasks.add_task(_prewarm_thumbnails, _get_thumbnail_cache(request), list(entries), logger)
+    if hashing_available():
+        background_tasks.add_task(_hash_in_background, list(entries), logger)
+    settings = gallery_settings()
+    if settings["storage_format"] in imaging.STORAGE_FORMATS and imaging.pillow_available():
+        background_tasks.add_task(_reencode_in_background, list(entries), settings, logger)
+
+
 def ensure_dir():
     """Создаёт директорию для скриншотов если её нет."""
-    screenshots_dir, metadata_file = _resolve_paths()
+    screenshots_dir, _ = _resolve_paths()
     screenshots_dir.mkdir(parents=True, exist_ok=True)
-    if not metadata_file.exists():
-        metadata_file.write_text("[]", encoding="utf-8")
 
 
-def load_metadata() -> List[dict]:
-    """Загружает метаданные скриншотов."""
-    ensure_dir()
+def _on_files_changed(index: GalleryIndex, added: set, removed: set):
+    index.set_present(removed, False)
+    index.set_present(added, True)
+
+
+def get_index() -> GalleryIndex:
+    """
+    Индекс галереи для текущей директории скриншотов.
+
+    При первом открытии переносит metadata.json и сверяет записи с файлами на диске;
+    дальше изменения директории подхватывает фоновый DirectoryWatcher.
+    Если директорию сменили в настройках, индекс переоткрывается.
+    """
+    global _INDEX, _WATCHER
+    screenshots_dir, metadata_file = _resolve_paths()
+    with _INDEX_LOCK:
+        if _INDEX is not None and _INDEX.db_path.parent == screenshots_dir:
+            return _INDEX
+        _close_index_locked()
+        screenshots_dir.mkdir(parents=True, exist_ok=True)
+        index = GalleryIndex(screenshots_dir / "gallery.db")
+        index.import_metadata_json(metadata_file)
+        watcher = DirectoryWatcher(
+            screenshots_dir,
+            lambda added, removed: _on_files_changed(index, added, removed),
+            interval=WATCH_INTERVAL_SECONDS,
+            suffixes=SCREENSHOT_SUFFIXES,
+        )
+        index.reconcile(watcher.snapshot())
+        watcher.start()
+        _INDEX, _WATCHER = index, watcher
+        return index
+
+
+def _close_index_locked():
+    global _INDEX, _WATCHER
+    if _WATCHER is not None:
+        _WATCHER.stop()
+    if _INDEX is not None:
+        _INDEX.close()
+    _INDEX, _WATCHER = None, None
+
+
+def close_gallery_index():
+    """Останавливает наблюдение за директорией и закрывает базу (при остановке сервера)."""
+    with _INDEX_LOCK:
+        _close_index_locked()
+
+
+def _manifest_item(entry: dict, archive_name: str) -> dict:
+    item = {
+        "id": entry["id"],
+        "file": archive_name,
+        "caption": entry.get("caption") or "",
+        "created_at": entry.get("created_at"),
+        "device_serial": entry.get("device_serial"),
+        "size_bytes": entry.get("size_bytes"),
+    }
+    if entry.get("burst_id"):
+        item["burst_id"] = entry["burst_id"]
+        item["frame_index"] = entry.get("frame_index")
+    return item
+
+
+def _iter_original_members(entries: List[dict], manifest: List[dict], missing: List[str]):
+    """Файлы скриншотов как есть (уже сжатые PNG/WebP кладутся без пережатия)."""
+    screenshots_dir, _ = _resolve_paths()
+    for entry in entries:
+        file_path = screenshots_dir / entry["filename"]
+        try:
+            stat = file_path.stat()
+        except OSError:
+            missing.append(entry["id"])
+            continue
+        manifest.append(_manifest_item(entry, entry["filename"]))
+        yield entry["filename"], stat.st_mtime, stat.st_size, iter_file(file_path)
+
+
+def _iter_thumbnail_members(
+    entries: List[dict],
+    cache: DiskLRUCache,
+    size: int,
+    fmt: str,
+    manifest: List[dict],
+    missing: List[str],
+):
+    """
+    Миниатюры вместо оригиналов: строятся в пуле процессов с опережением
+    на несколько файлов, а в архив пишутся в исходном порядке.
+    """
+    screenshots_dir, _ = _resolve_paths()
+    extension = "jpg" if fmt == "jpeg" else fmt
+    pool = get_process_pool()
+    window = deque()
+    pending = iter(entries)
+
+    def _schedule():
+        for entry in pending:
+            key = _thumbnail_key(entry, size, fmt)
+            cached = cache.get_bytes(key)
+            if cached is not None:
+                window.append((entry, key, cached))
+            else:
+                file_path = str(screenshots_dir / entry["filename"])
+                window.append((entry, key, pool.submit(imaging.make_thumbnail_file, file_path, size, fmt)))
+            return True
+        return False
+
     try:
-        _, metadata_file = _resolve_paths()
-        return json.loads(metadata_file.read_text(encoding="utf-8"))
-    except (json.JSONDecodeError, Exception):
-        return []
+        while len(window) < pool_size() * 2 and _schedule():
+            pass
+        while window:
+            entry, key, result = window.popleft()
+            _schedule()
+            if not isinstance(result, bytes):
+                try:
+                    result = result.result()
+                except Exception:
+                    missing.append(entry["id"])
+                    continue
+                cache.put_bytes(key, result)
+            archive_name = f"thumbnails/{os.path.splitext(entry['filename'])[0]}.{extension}"
+            manifest.append(_manifest_item(entry, archive_name))
+            yield archive_name, time.time(), len(result), (result,)
+    finally:
+        # Клиент оборвал загрузку - не тратим CPU на оставшиеся миниатюры
+        for _, _, result in window:
+            if not isinstance(result, bytes):
+                result.cancel()
 
 
-def save_metadata(data: List[dict]):
-    """Сохраняет метаданные скриншотов."""
-    ensure_dir()
-    _, metadata_file = _resolve_paths()
-    metadata_file.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+def _new_screenshot_id() -> str:
+    # Секундной метки мало: параллельные снимки получали одинаковый ID и имя файла
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:4]}"
 
 
 @router.get("")
 async def list_screenshots(
     page: int = Query(1, ge=1),
-    page_size: int = Query(24, ge=1, le=200)
+    page_size: int = Query(24, ge=1, le=200),
+    burst_id: Optional[str] = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
-    """Возвращает список всех скриншотов с метаданными."""
-    metadata = load_metadata()
-    screenshots_dir, _ = _resolve_paths()
-    
-    # Проверяем существование файлов и обновляем список
-    valid_screenshots = []
-    for entry in metadata:
-        file_path = screenshots_dir / entry.get("filename", "")
-        if file_path.exists():
-            valid_screenshots.append(entry)
-    
-    # Сохраняем очищенный список если были удаления
-    if len(valid_screenshots) != len(metadata):
-        save_metadata(valid_screenshots)
-    
-    valid_screenshots.sort(key=lambda item: item.get("created_at") or item.get("id") or "", reverse=True)
-    total_count = len(valid_screenshots)
+    """
+    Возвращает скриншоты от новых к старым (опционально - только кадры одной серии).
+
+    С cursor выборка идёт по индексу (keyset) и не зависит от глубины страницы;
+    page оставлен для совместимости и считается через OFFSET.
+    """
+    index = await run_in_threadpool(get_index)
+    total_count = await run_in_threadpool(index.count, burst_id)
     total_pages = max(1, math.ceil(total_count / page_size))
     page = min(page, total_pages)
-    start = (page - 1) * page_size
-    end = start + page_size
-    page_items = valid_screenshots[start:end]
+    try:
+        page_items, next_cursor = await run_in_threadpool(
+            index.list_page, page_size, cursor, (page - 1) * page_size, burst_id
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
     return {
-        "screenshots": page_items,
+        "screenshots": [_with_urls(item) for item in page_items],
         "count": total_count,
         "page_count": len(page_items),
         "total_count": total_count,
         "page": page,
         "page_size": page_size,
-        "total_pages": total_pages
+        "total_pages": total_pages,
+        "next_cursor": next_cursor
     }
 
 
 @router.post("/take")
-async def take_screenshot(request: Request, serial: Optional[str] = None, caption: str = ""):
+async def take_screenshot(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    serial: Optional[str] = None,
+    caption: str = ""
+):
     """
     Делает скриншот устройства.
     
@@ -138,57 +824,16 @@ async def take_screenshot(request: Request, serial: Optional[str] = None, captio
     ensure_dir()
     
     # Генерируем уникальный ID и имя файла
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    screenshot_id = timestamp
-    filename = f"screenshot_{timestamp}.png"
+    screenshot_id = _new_screenshot_id()
+    filename = f"screenshot_{screenshot_id}.png"
     screenshots_dir, _ = _resolve_paths()
     local_path = screenshots_dir / filename
-    device_path = f"/sdcard/screenshot_{timestamp}.png"
-    
-    # Формируем базовую команду
-    cmd_base = [str(adb_path)]
-    if serial:
-        cmd_base.extend(["-s", serial])
     
     try:
-        # Делаем скриншот на устройстве
-        result = await run_in_threadpool(
-            subprocess.run,
-            cmd_base + ["shell", "screencap", "-p", device_path],
-            capture_output=True,
-            timeout=30
-        )
-        
-        if result.returncode != 0:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to capture screenshot: {_decode_output(result.stderr)}"
-            )
-        
-        # Копируем на ПК
-        result = await run_in_threadpool(
-            subprocess.run,
-            cmd_base + ["pull", device_path, str(local_path)],
-            capture_output=True,
-            timeout=30
-        )
-        
-        if result.returncode != 0 or not local_path.exists():
-            raise HTTPException(
-                status_code=500, 
-                detail=f"Failed to pull screenshot: {_decode_output(result.stderr)}"
-            )
-        
-        # Удаляем с устройства
-        await run_in_threadpool(
-            subprocess.run,
-            cmd_base + ["shell", "rm", device_path],
-            capture_output=True,
-            timeout=10
-        )
+        data, method = await capture_png(adb_path, serial)
+        await run_in_threadpool(_write_atomic, local_path, data)
         
         # Сохраняем метаданные
-        metadata = load_metadata()
         entry = {
             "id": screenshot_id,
             "filename": filename,
@@ -197,12 +842,14 @@ async def take_screenshot(request: Request, serial: Optional[str] = None, captio
             "size_bytes": local_path.stat().st_size,
             "device_serial": serial
         }
-        metadata.append(entry)
-        save_metadata(metadata)
+        index = await run_in_threadpool(get_index)
+        await run_in_threadpool(index.add, [entry])
+        _schedule_post_capture(background_tasks, request, [entry])
         
         return {
             "success": True, 
-            "screenshot": entry
+            "screenshot": _with_urls(entry),
+            "method": method
         }
         
     except subprocess.TimeoutExpired:
@@ -213,11 +860,573 @@ async def take_screenshot(request: Request, serial: Optional[str] = None, captio
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _capture_raw(cmd_base: List[str]) -> tuple[bytes, float, float]:
+    """Raw-кадр без PNG-сжатия на устройстве: (данные, время начала, время окончания)."""
+    started = time.perf_counter()
+    result = await run_in_threadpool(
+        subprocess.run,
+        cmd_base + ["exec-out", "screencap"],
+        capture_output=True,
+        timeout=30
+    )
+    finished = time.perf_counter()
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(_decode_output(result.stderr).strip() or "screencap failed")
+    return result.stdout, started, finished
+
+
+@router.post("/burst")
+async def take_burst(payload: BurstRequest, request: Request, background_tasks: BackgroundTasks):
+    """
+    Серийная съёмка: кадры по расписанию fps в течение duration.
+
+    Устройство отдаёт raw-кадры (без медленного PNG-сжатия на телефоне),
+    заголовок и пиксели разбираются NumPy, а PNG/WebP кодируется в пуле процессов.
+    Если предыдущие кадры ещё снимаются/кодируются и лимит занят, слот пропускается
+    и попадает в dropped. Кадры сохраняются как скриншоты галереи с общим burst_id,
+    порядковым номером и смещением от начала серии.
+    """
+    if not imaging.numpy_available() or not imaging.pillow_available():
+        raise HTTPException(status_code=501, detail="NumPy and Pillow are required for burst capture")
+    if payload.format not in imaging.FRAME_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported frame format")
+    if not (0 < payload.fps <= BURST_MAX_FPS):
+        raise HTTPException(status_code=400, detail=f"fps must be in (0, {BURST_MAX_FPS}]")
+    if not (0 < payload.duration <= BURST_MAX_DURATION):
+        raise HTTPException(status_code=400, detail=f"duration must be in (0, {BURST_MAX_DURATION}]")
+    total_slots = max(1, math.ceil(payload.fps * payload.duration))
+    if total_slots > BURST_MAX_FRAMES:
+        raise HTTPException(status_code=400, detail=f"Too many frames (max {BURST_MAX_FRAMES})")
+
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    ensure_dir()
+
+    serial = payload.serial
+    cmd_base = [str(adb_path)]
+    if serial:
+        cmd_base.extend(["-s", serial])
+
+    burst_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    extension = imaging.FRAME_FORMATS[payload.format][1]
+    screenshots_dir, _ = _resolve_paths()
+    logger = getattr(request.app.state, "logger", None)
+
+    # Кадры в работе (съёмка + ожидание кодирования) держат в памяти по ~10-20 МБ - ограничиваем
+    inflight = asyncio.Semaphore(max(1, min(payload.max_inflight, 8)))
+    encode_slots = asyncio.Semaphore(pool_size())
+    entries = []
+    errors = []
+    dropped = 0
+    burst_started = time.perf_counter()
+    burst_started_wall = time.time()
+
+    async def _frame(index: int):
+        try:
+            raw, started, finished = await _capture_raw(cmd_base)
+            async with encode_slots:
+                data = await run_in_process(
+                    imaging.encode_raw_frame, raw, payload.format, payload.lossless
+                )
+            del raw
+            filename = f"burst_{burst_id}_{index:04d}.{extension}"
+            await run_in_threadpool(_write_atomic, screenshots_dir / filename, data)
+            offset = (started + finished) / 2 - burst_started
+            entries.append({
+                "id": f"{burst_id}_{index:04d}",
+                "filename": filename,
+                "caption": payload.caption,
+                "created_at": datetime.fromtimestamp(burst_started_wall + offset).isoformat(),
+                "size_bytes": len(data),
+                "device_serial": serial,
+                "burst_id": burst_id,
+                "frame_index": index,
+                "offset_ms": round(offset * 1000, 1),
+                "capture_ms": round((finished - started) * 1000, 1),
+            })
+        except Exception as exc:
+            errors.append(str(exc))
+        finally:
+            inflight.release()
+
+    tasks = []
+    for index in range(total_slots):
+        delay = burst_started + index / payload.fps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if inflight.locked():
+            dropped += 1
+            continue
+        await inflight.acquire()
+        tasks.append(asyncio.create_task(_frame(index)))
+    await asyncio.gather(*tasks)
+
+    entries.sort(key=lambda item: item["frame_index"])
+    if entries:
+        index = await run_in_threadpool(get_index)
+        await run_in_threadpool(index.add, entries)
+        _schedule_post_capture(background_tasks, request, entries)
+
+    elapsed = time.perf_counter() - burst_started
+    if logger:
+        logger.info(
+            "gallery.burst id=%s serial=%s slots=%s captured=%s dropped=%s errors=%s elapsed=%.2fs",
+            burst_id, serial or "-", total_slots, len(entries), dropped, len(errors), elapsed
+        )
+    if not entries and errors:
+        raise HTTPException(status_code=500, detail=f"Burst capture failed: {errors[0]}")
+
+    span = entries[-1]["offset_ms"] - entries[0]["offset_ms"] if len(entries) > 1 else 0
+    return {
+        "success": True,
+        "burst_id": burst_id,
+        "requested_frames": total_slots,
+        "captured": len(entries),
+        "dropped": dropped,
+        "failed": len(errors),
+        "effective_fps": round((len(entries) - 1) * 1000 / span, 2) if span else None,
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "frames": [_with_urls(entry) for entry in entries],
+    }
+
+
+async def _export(payload: ExportRequest, request: Request) -> StreamingResponse:
+    if payload.thumbnails:
+        if payload.thumbnail_format not in imaging.THUMBNAIL_FORMATS:
+            raise HTTPException(status_code=400, detail="Unsupported thumbnail format")
+        if not (32 <= payload.thumbnail_size <= 1024):
+            raise HTTPException(status_code=400, detail="thumbnail_size must be in [32, 1024]")
+        if not imaging.pillow_available():
+            raise HTTPException(status_code=501, detail="Pillow is required for thumbnails")
+
+    index = await run_in_threadpool(get_index)
+    entries = await run_in_threadpool(
+        index.select, payload.ids, payload.date_from, payload.date_to, payload.burst_id
+    )
+    if not entries:
+        raise HTTPException(status_code=404, detail="No screenshots match the selection")
+
+    manifest: List[dict] = []
+    missing: List[str] = []
+    if payload.thumbnails:
+        members = _iter_thumbnail_members(
+            entries, _get_thumbnail_cache(request), payload.thumbnail_size,
+            payload.thumbnail_format, manifest, missing
+        )
+    else:
+        members = _iter_original_members(entries, manifest, missing)
+
+    def _manifest():
+        document = {
+            "exported_at": datetime.now().isoformat(),
+            "variant": "thumbnails" if payload.thumbnails else "originals",
+            "count": len(manifest),
+            "missing": missing,
+            "screenshots": manifest,
+        }
+        return "manifest.json", json.dumps(document, indent=2, ensure_ascii=False).encode("utf-8")
+
+    logger = getattr(request.app.state, "logger", None)
+    if logger:
+        logger.info(
+            "gallery.export count=%s thumbnails=%s", len(entries), payload.thumbnails
+        )
+    archive_name = f"screenshots_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        iter_zip(members, _manifest),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{archive_name}"'}
+    )
+
+
+@router.post("/export")
+async def export_screenshots(payload: ExportRequest, request: Request):
+    """
+    Отдаёт zip выбранных скриншотов, собирая его на лету без временного файла.
+
+    В конец архива пишется manifest.json с подписями, серийниками и датами.
+    С thumbnails=true вместо оригиналов кладутся миниатюры, которые параллельно
+    строятся в пуле процессов.
+    """
+    return await _export(payload, request)
+
+
+@router.get("/export")
+async def export_screenshots_get(
+    request: Request,
+    ids: Optional[List[str]] = Query(None),
+    date_from: Optional[str] = Query(None),
+    date_to: Optional[str] = Query(None),
+    burst_id: Optional[str] = Query(None),
+    thumbnails: bool = Query(False),
+    thumbnail_size: int = Query(GALLERY_THUMBNAIL_SIZE, ge=32, le=1024),
+    thumbnail_format: str = Query("webp")
+):
+    """То же, что POST /export, но по ссылке - удобно для скачивания из браузера."""
+    payload = ExportRequest(
+        ids=ids,
+        date_from=date_from,
+        date_to=date_to,
+        burst_id=burst_id,
+        thumbnails=thumbnails,
+        thumbnail_size=thumbnail_size,
+        thumbnail_format=thumbnail_format
+    )
+    return await _export(payload, request)
+
+
+def _similarity_item(entry: dict, distance: int, ahash: int, reference_ahash: Optional[int]) -> dict:
+    item = _with_urls(entry)
+    item["distance"] = distance
+    item["similarity"] = round(1 - distance / 64, 3)
+    if reference_ahash is not None:
+        item["ahash_distance"] = (ahash ^ reference_ahash).bit_count()
+    return item
+
+
+@router.get("/similarity/status")
+async def similarity_status():
+    """Сколько скриншотов имеют перцептивный хэш и состояние фонового досчёта."""
+    index = await run_in_threadpool(get_index)
+    stats = await run_in_threadpool(index.hash_stats)
+    return {"available": hashing_available(), **stats, "backfill": dict(_HASH_BACKFILL)}
+
+
+@router.post("/similarity/rebuild")
+async def similarity_rebuild(request: Request):
+    """Запускает фоновый досчёт хэшей для скриншотов, снятых до появления индекса."""
+    if not hashing_available():
+        raise HTTPException(status_code=501, detail="NumPy and Pillow are required for similarity search")
+    if not _HASH_BACKFILL["running"]:
+        global _HASH_BACKFILL_TASK
+        _HASH_BACKFILL["running"] = True
+        # Ссылку держим, иначе event loop может собрать задачу сборщиком мусора
+        _HASH_BACKFILL_TASK = asyncio.create_task(_run_hash_backfill(getattr(request.app.state, "logger", None)))
+    index = await run_in_threadpool(get_index)
+    stats = await run_in_threadpool(index.hash_stats)
+    return {"success": True, **stats, "backfill": dict(_HASH_BACKFILL)}
+
+
+@router.get("/duplicates")
+async def list_duplicates(max_distance: int = Query(DUPLICATE_DISTANCE, ge=0, le=MAX_DUPLICATE_DISTANCE)):
+    """Группы почти одинаковых скриншотов (по уже посчитанным хэшам)."""
+    if not imaging.numpy_available():
+        raise HTTPException(status_code=501, detail="NumPy is required for duplicate detection")
+    started = time.perf_counter()
+    index = await run_in_threadpool(get_index)
+    groups = await run_in_threadpool(index.duplicate_groups, max_distance)
+    return {
+        "max_distance": max_distance,
+        "group_count": len(groups),
+        "duplicate_count": sum(len(group) - 1 for group in groups),
+        "query_ms": round((time.perf_counter() - started) * 1000, 1),
+        "groups": [[_with_urls(entry) for entry in group] for group in groups],
+    }
+
+
+@router.post("/duplicates/collapse")
+async def collapse_duplicates(payload: CollapseRequest, request: Request):
+    """
+    Оставляет по одному скриншоту из каждой группы дубликатов (самый новый или самый старый).
+
+    По умолчанию dry_run - только показывает, что будет удалено.
+    """
+    if payload.keep not in ("newest", "oldest"):
+        raise HTTPException(status_code=400, detail="keep must be 'newest' or 'oldest'")
+    if not (0 <= payload.max_distance <= MAX_DUPLICATE_DISTANCE):
+        raise HTTPException(status_code=400, detail=f"max_distance must be in [0, {MAX_DUPLICATE_DISTANCE}]")
+    if not imaging.numpy_available():
+        raise HTTPException(status_code=501, detail="NumPy is required for duplicate detection")
+
+    index = await run_in_threadpool(get_index)
+    groups = await run_in_threadpool(index.duplicate_groups, payload.max_distance)
+    summary = []
+    to_delete = []
+    for group in groups:
+        keeper = group[-1] if payload.keep == "newest" else group[0]
+        # Закреплённые скриншоты не удаляем, даже если они дубликаты
+        removed = [entry for entry in group if entry["id"] != keeper["id"] and not entry.get("pinned")]
+        to_delete.extend(removed)
+        summary.append({"kept": keeper["id"], "removed": [entry["id"] for entry in removed]})
+
+    freed = sum(int(entry.get("size_bytes") or 0) for entry in to_delete)
+    if not payload.dry_run and to_delete:
+        await run_in_threadpool(delete_entries, to_delete)
+        logger = getattr(request.app.state, "logger", None)
+        if logger:
+            logger.info(
+                "gallery.collapse groups=%s deleted=%s freed=%s", len(groups), len(to_delete), freed
+            )
+
+    return {
+        "success": True,
+        "dry_run": payload.dry_run,
+        "group_count": len(groups),
+        "deleted_count": len(to_delete),
+        "freed_bytes": freed,
+        "groups": summary,
+    }
+
+
+@router.get("/storage")
+async def storage_status():
+    """Текущий формат хранения, объём по форматам, экономия и прогресс перекодирования."""
+    index = await run_in_threadpool(get_index)
+    totals = await run_in_threadpool(index.storage_totals)
+    return {
+        "settings": gallery_settings(),
+        "formats": ["original", *imaging.STORAGE_FORMATS],
+        **totals,
+        "job": _reencode_job_status(),
+    }
+
+
+@router.post("/storage/reencode")
+async def start_reencode(payload: ReencodeRequest, request: Request):
+    """
+    Перекодирует существующие скриншоты в формат хранения в фоне.
+
+    Кодирование идёт в общем пуле процессов, но одновременно занимает не больше
+    workers слотов, чтобы съёмка и миниатюры не ждали.
+    """
+    global _REENCODE_TASK
+    settings = gallery_settings()
+    storage_format = payload.storage_format or settings["storage_format"]
+    if storage_format not in imaging.STORAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported storage format: {storage_format}")
+    if not imaging.pillow_available():
+        raise HTTPException(status_code=501, detail="Pillow is required for re-encoding")
+    if _REENCODE_JOB["running"]:
+        raise HTTPException(status_code=409, detail="Re-encoding is already running")
+
+    quality = int(payload.lossy_quality if payload.lossy_quality is not None else settings["lossy_quality"])
+    if not (1 <= quality <= 100):
+        raise HTTPException(status_code=400, detail="lossy_quality must be in [1, 100]")
+    keep_originals = settings["keep_originals"] if payload.keep_originals is None else payload.keep_originals
+    workers = payload.workers or int(settings["reencode_workers"] or 1)
+    workers = max(1, min(workers, pool_size()))
+
+    _REENCODE_JOB["running"] = True
+    _REENCODE_TASK = asyncio.create_task(_run_reencode_job(
+        storage_format, quality, bool(keep_originals), workers, getattr(request.app.state, "logger", None)
+    ))
+    return {"success": True, "storage_format": storage_format, "workers": workers, "job": _reencode_job_status()}
+
+
+@router.delete("/storage/reencode")
+async def cancel_reencode():
+    """Останавливает перекодирование после текущей пачки."""
+    if not _REENCODE_JOB["running"]:
+        return {"success": True, "running": False}
+    _REENCODE_JOB["cancel"] = True
+    return {"success": True, "running": True}
+
+
+@router.delete("/storage/originals")
+async def purge_originals(request: Request):
+    """Удаляет сохранённые оригиналы перекодированных скриншотов."""
+    index = await run_in_threadpool(get_index)
+    screenshots_dir, _ = _resolve_paths()
+
+    def _purge() -> tuple[int, int]:
+        removed = freed = 0
+        for entry in index.select():
+            name = entry.get("original_filename")
+            if not name:
+                continue
+            original = screenshots_dir / ORIGINALS_DIR_NAME / name
+            try:
+                freed += original.stat().st_size
+                original.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+            entry.pop("original_filename")
+            index.update(entry)
+        return removed, freed
+
+    removed, freed = await run_in_threadpool(_purge)
+    logger = getattr(request.app.state, "logger", None)
+    if logger:
+        logger.info("gallery.purge_originals removed=%s freed=%s", removed, freed)
+    return {"success": True, "removed": removed, "freed_bytes": freed}
+
+
+def _aligned_capture(cmd_base: List[str], barrier: threading.Barrier) -> dict:
+    """
+    Ждёт остальные потоки на барьере и сразу запускает exec-out screencap.
+
+    Каждый поток стартует свой процесс adb сам, поэтому разброс запуска
+    определяется только планировщиком ОС, а не очередью последовательных вызовов.
+    """
+    try:
+        barrier.wait(timeout=GROUP_BARRIER_TIMEOUT)
+    except threading.BrokenBarrierError:
+        # Какой-то поток не успел - снимаем без выравнивания, разброс попадёт в отчёт
+        pass
+    started_wall = time.time()
+    started = time.perf_counter()
+    result = subprocess.run(cmd_base + ["exec-out", "screencap", "-p"], capture_output=True, timeout=30)
+    finished = time.perf_counter()
+    return {
+        "returncode": result.returncode,
+        "stdout": result.stdout,
+        "stderr": _decode_output(result.stderr),
+        "started": started,
+        "started_wall": started_wall,
+        "finished": finished,
+    }
+
+
+@router.post("/group")
+async def take_group_screenshot(payload: GroupCaptureRequest, request: Request, background_tasks: BackgroundTasks):
+    """
+    Снимает несколько устройств одновременно и сохраняет снимки связанной группой.
+
+    Захваты запускаются параллельно с выравниванием старта по барьеру; для каждого
+    устройства записывается смещение старта и длительность, а в ответе - разброс
+    (skew) запуска и завершения. Устройства, где exec-out не работает, снимаются
+    после группы старым способом и помечаются aligned=false.
+    """
+    try:
+        adb_path = _resolve_adb_path(request)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+
+    serials = payload.serials
+    if not serials:
+        from mkdsc.tools import get_connected_devices
+        devices = await run_in_threadpool(get_connected_devices, adb_path)
+        serials = [device["serial"] for device in devices if device.get("status") == "device"]
+    serials = list(dict.fromkeys(serial for serial in serials if serial))
+    if not serials:
+        raise HTTPException(status_code=400, detail="No devices to capture")
+    if len(serials) > GROUP_MAX_DEVICES:
+        raise HTTPException(status_code=400, detail=f"Too many devices (max {GROUP_MAX_DEVICES})")
+    ensure_dir()
+
+    aligned_serials = [serial for serial in serials if not _exec_out_broken(serial)]
+    captures = {}
+    if aligned_serials:
+        barrier = threading.Barrier(len(aligned_serials))
+        loop = asyncio.get_running_loop()
+        # Отдельные потоки под каждое устройство: общий пул может не дать всем стартовать сразу
+        with ThreadPoolExecutor(max_workers=len(aligned_serials)) as executor:
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(executor, _aligned_capture, [str(adb_path), "-s", serial], barrier)
+                    for serial in aligned_serials
+                ),
+                return_exceptions=True
+            )
+        captures = dict(zip(aligned_serials, results))
+
+    group_id = _new_screenshot_id()
+    screenshots_dir, _ = _resolve_paths()
+    starts = [item["started"] for item in captures.values() if isinstance(item, dict)]
+    base = min(starts) if starts else time.perf_counter()
+    entries = []
+    failed = []
+    for group_index, serial in enumerate(serials):
+        capture = captures.get(serial)
+        aligned = isinstance(capture, dict) and capture["returncode"] == 0 and _is_valid_png(capture["stdout"])
+        try:
+            if aligned:
+                data = capture["stdout"]
+                created_at = datetime.fromtimestamp(capture["started_wall"]).isoformat()
+                offset_ms = round((capture["started"] - base) * 1000, 2)
+                duration_ms = round((capture["finished"] - capture["started"]) * 1000, 1)
+            else:
+                if isinstance(capture, BaseException):
+                    raise capture
+                data, _ = await capture_png(adb_path, serial)
+                created_at = datetime.now().isoformat()
+                offset_ms = duration_ms = None
+        except HTTPException as exc:
+            failed.append({"serial": serial, "error": exc.detail})
+            continue
+        except Exception as exc:
+            failed.append({"serial": serial, "error": str(exc)})
+            continue
+
+        entry_id = f"{group_id}_{group_index:02d}"
+        filename = f"group_{entry_id}.png"
+        await run_in_threadpool(_write_atomic, screenshots_dir / filename, data)
+        entries.append({
+            "id": entry_id,
+            "filename": filename,
+            "caption": payload.caption,
+            "created_at": created_at,
+            "size_bytes": len(data),
+            "device_serial": serial,
+            "group_id": group_id,
+            "group_index": group_index,
+            "aligned": aligned,
+            "capture_offset_ms": offset_ms,
+            "capture_duration_ms": duration_ms,
+        })
+
+    if not entries:
+        raise HTTPException(status_code=500, detail=f"Group capture failed: {failed}")
+    index = await run_in_threadpool(get_index)
+    await run_in_threadpool(index.add, entries)
+    _schedule_post_capture(background_tasks, request, entries)
+
+    aligned_captures = [captures[e["device_serial"]] for e in entries if e["aligned"]]
+    launch_skew = completion_skew = None
+    if aligned_captures:
+        launch_skew = round((max(c["started"] for c in aligned_captures) - min(c["started"] for c in aligned_captures)) * 1000, 2)
+        completion_skew = round((max(c["finished"] for c in aligned_captures) - min(c["finished"] for c in aligned_captures)) * 1000, 1)
+    logger = getattr(request.app.state, "logger", None)
+    if logger:
+        logger.info(
+            "gallery.group id=%s devices=%s captured=%s failed=%s launch_skew=%sms completion_skew=%sms",
+            group_id, len(serials), len(entries), len(failed), launch_skew, completion_skew
+        )
+    return {
+        "success": True,
+        "group_id": group_id,
+        "devices": len(serials),
+        "captured": len(entries),
+        "failed": failed,
+        "launch_skew_ms": launch_skew,
+        "completion_skew_ms": completion_skew,
+        "screenshots": [_with_urls(entry) for entry in entries],
+    }
+
+
+@router.get("/groups/{group_id}")
+async def get_group(group_id: str):
+    """Снимки групповой съёмки в порядке устройств."""
+    index = await run_in_threadpool(get_index)
+    members = await run_in_threadpool(index.group_members, group_id)
+    if not members:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return {"group_id": group_id, "count": len(members), "screenshots": [_with_urls(entry) for entry in members]}
+
+
+@router.get("/bursts/{burst_id}")
+async def get_burst(burst_id: str):
+    """Кадры серии в порядке съёмки."""
+    index = await run_in_threadpool(get_index)
+    frames = await run_in_threadpool(index.burst_frames, burst_id)
+    if not frames:
+        raise HTTPException(status_code=404, detail="Burst not found")
+    return {"burst_id": burst_id, "count": len(frames), "frames": [_with_urls(entry) for entry in frames]}
+
+
 @router.get("/{screenshot_id}")
-async def get_screenshot(screenshot_id: str):
-    """Возвращает файл скриншота по ID."""
-    metadata = load_metadata()
-    entry = next((s for s in metadata if s["id"] == screenshot_id), None)
+async def get_screenshot(screenshot_id: str, request: Request, v: Optional[str] = Query(None)):
+    """
+    Возвращает файл скриншота по ID.
+
+    Отдаёт ETag/Last-Modified и отвечает 304 на условные запросы.
+    Если в URL передана актуальная версия (?v=), ответ помечается immutable.
+    """
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.get, screenshot_id)
     
     if not entry:
         raise HTTPException(status_code=404, detail="Screenshot not found")
@@ -225,49 +1434,168 @@ async def get_screenshot(screenshot_id: str):
     screenshots_dir, _ = _resolve_paths()
     file_path = screenshots_dir / entry["filename"]
     if not file_path.exists():
-        # Удаляем запись о несуществующем файле
-        metadata = [s for s in metadata if s["id"] != screenshot_id]
-        save_metadata(metadata)
+        # Файл удалили в обход API, а наблюдатель ещё не заметил
+        await run_in_threadpool(index.set_present, [entry["filename"]], False)
         raise HTTPException(status_code=404, detail="Screenshot file not found")
+
+    version = screenshot_version(entry)
+    etag = f'"{version}"'
+    last_modified = file_path.stat().st_mtime
+    headers = _cache_headers(etag, last_modified, v == version)
+    if _is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
     
     return FileResponse(
         file_path, 
-        media_type="image/png",
-        filename=entry["filename"]
+        media_type=mimetypes.guess_type(entry["filename"])[0] or "image/png",
+        filename=entry["filename"],
+        headers=headers
+    )
+
+
+@router.get("/{screenshot_id}/original")
+async def get_screenshot_original(screenshot_id: str, request: Request, v: Optional[str] = Query(None)):
+    """Исходный файл скриншота до перекодирования (или сам файл, если он не перекодирован)."""
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.get, screenshot_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+
+    screenshots_dir, _ = _resolve_paths()
+    if entry.get("original_filename"):
+        file_path = screenshots_dir / ORIGINALS_DIR_NAME / entry["original_filename"]
+    elif entry.get("storage_format", "original") == "original" or entry.get("storage_skipped"):
+        file_path = screenshots_dir / entry["filename"]
+    else:
+        raise HTTPException(status_code=410, detail="Original was not retained")
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Original file not found")
+
+    stat = file_path.stat()
+    etag = f'"{screenshot_version(entry)}-o"'
+    headers = _cache_headers(etag, stat.st_mtime, v == screenshot_version(entry))
+    if _is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(
+        file_path,
+        media_type=mimetypes.guess_type(file_path.name)[0] or "image/png",
+        filename=file_path.name,
+        headers=headers
     )
 
 
+@router.get("/{screenshot_id}/thumbnail")
+async def get_screenshot_thumbnail(
+    screenshot_id: str,
+    request: Request,
+    size: int = Query(GALLERY_THUMBNAIL_SIZE, ge=32, le=1024, description="Max thumbnail edge in pixels"),
+    format: str = Query("webp", description="webp, jpeg or png"),
+    v: Optional[str] = Query(None, description="Screenshot version from the listing")
+):
+    """
+    Возвращает уменьшенную копию скриншота.
+
+    Миниатюра строится в пуле процессов при съёмке или при первом запросе
+    и хранится в дисковом LRU-кэше; ETag зависит от версии скриншота и размера.
+    """
+    if format not in imaging.THUMBNAIL_FORMATS:
+        raise HTTPException(status_code=400, detail="Unsupported thumbnail format")
+    if not imaging.pillow_available():
+        raise HTTPException(status_code=501, detail="Pillow is required for thumbnails")
+
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.get, screenshot_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    screenshots_dir, _ = _resolve_paths()
+    file_path = screenshots_dir / entry["filename"]
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Screenshot file not found")
+
+    version = screenshot_version(entry)
+    etag = f'"{_thumbnail_key(entry, size, format)[:32]}"'
+    last_modified = file_path.stat().st_mtime
+    headers = _cache_headers(etag, last_modified, v == version)
+    if _is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        data = await _ensure_thumbnail(_get_thumbnail_cache(request), entry, size, format)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Cannot build thumbnail: {exc}")
+    return Response(content=data, media_type=imaging.media_type_for(format), headers=headers)
+
+
+@router.get("/{screenshot_id}/similar")
+async def find_similar(
+    screenshot_id: str,
+    max_distance: int = Query(SIMILAR_DISTANCE, ge=0, le=MAX_HASH_DISTANCE),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Похожие скриншоты: pHash на расстоянии Хэмминга <= max_distance (из 64 бит)."""
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.get, screenshot_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+
+    hashes = await run_in_threadpool(index.get_hash, screenshot_id)
+    if hashes is None:
+        if not hashing_available():
+            raise HTTPException(status_code=501, detail="NumPy and Pillow are required for similarity search")
+        await _hash_entries([entry])
+        hashes = await run_in_threadpool(index.get_hash, screenshot_id)
+        if hashes is None:
+            raise HTTPException(status_code=415, detail="Cannot decode screenshot")
+
+    phash, ahash = hashes
+    started = time.perf_counter()
+    matches = await run_in_threadpool(index.similar, phash, max_distance, limit, screenshot_id)
+    return {
+        "id": screenshot_id,
+        "phash": f"{phash:016x}",
+        "max_distance": max_distance,
+        "query_ms": round((time.perf_counter() - started) * 1000, 2),
+        "count": len(matches),
+        "screenshots": [_similarity_item(item, distance, other, ahash) for item, distance, other in matches],
+    }
+
+
 @router.put("/{screenshot_id}/caption")
 async def update_caption(screenshot_id: str, update: CaptionUpdate):
     """Обновляет подпись скриншота."""
-    metadata = load_metadata()
-    
-    for entry in metadata:
-        if entry["id"] == screenshot_id:
-            entry["caption"] = update.caption
-            save_metadata(metadata)
-            return {"success": True, "screenshot": entry}
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.set_caption, screenshot_id, update.caption)
+    if entry:
+        return {"success": True, "screenshot": _with_urls(entry)}
     
     raise HTTPException(status_code=404, detail="Screenshot not found")
 
 
+@router.put("/{screenshot_id}/pin")
+async def update_pin(screenshot_id: str, update: PinUpdate):
+    """Закрепляет скриншот (или снимает закрепление) для политики хранения."""
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.set_pinned, screenshot_id, update.pinned)
+    if entry:
+        return {"success": True, "screenshot": _with_urls(entry)}
+
+    raise HTTPException(status_code=404, detail="Screenshot not found")
+
+
 @router.delete("/{screenshot_id}")
 async def delete_screenshot(screenshot_id: str):
     """Удаляет скриншот."""
-    metadata = load_metadata()
-    entry = next((s for s in metadata if s["id"] == screenshot_id), None)
+    index = await run_in_threadpool(get_index)
+    entry = await run_in_threadpool(index.get, screenshot_id, True)
     
     if not entry:
         raise HTTPException(status_code=404, detail="Screenshot not found")
     
-    # Удаляем файл
-    screenshots_dir, _ = _resolve_paths()
-    file_path = screenshots_dir / entry["filename"]
-    file_path.unlink(missing_ok=True)
+    # Удаляем файл (и оригинал, если он сохранён)
+    await run_in_threadpool(_remove_entry_files, entry)
     
     # Удаляем из метаданных
-    metadata = [s for s in metadata if s["id"] != screenshot_id]
-    save_metadata(metadata)
+    await run_in_threadpool(index.delete, [screenshot_id])
     
     return {"success": True}
 
@@ -275,19 +1603,8 @@ async def delete_screenshot(screenshot_id: str):
 @router.delete("")
 async def delete_multiple_screenshots(ids: List[str]):
     """Удаляет несколько скриншотов."""
-    metadata = load_metadata()
-    screenshots_dir, _ = _resolve_paths()
-    deleted = 0
-    
-    for screenshot_id in ids:
-        entry = next((s for s in metadata if s["id"] == screenshot_id), None)
-        if entry:
-            file_path = screenshots_dir / entry["filename"]
-            file_path.unlink(missing_ok=True)
-            deleted += 1
-    
-    # Обновляем метаданные
-    metadata = [s for s in metadata if s["id"] not in ids]
-    save_metadata(metadata)
+    index = await run_in_threadpool(get_index)
+    entries = await run_in_threadpool(index.get_many, ids)
+    deleted = await run_in_threadpool(delete_entries, entries)
     
     return {"success": True, "deleted_count": deleted}
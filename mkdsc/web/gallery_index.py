@@ -0,0 +1,717 @@
+"""
+Индекс галереи скриншотов в SQLite (режим WAL).
+
+Заменяет metadata.json: записи добавляются и меняются точечно, без
+перезаписи всего файла, а список отдаётся по индексу (created_at, id)
+с keyset-пагинацией. Наличие файлов на диске отмечается флагом present,
+который обновляет DirectoryWatcher, а не stat при каждом запросе списка.
+
+Перцептивные хэши хранятся в таблице hashes, разбитыми на 4 полосы по 16 бит
+с отдельным индексом на каждую (multi-index hashing): если расстояние Хэмминга
+не больше d, хотя бы одна полоса отличается не больше чем на d // 4 бит,
+поэтому кандидаты находятся точными запросами по индексам полос.
+"""
+import base64
+import itertools
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+SCHEMA_VERSION = 2
+
+HASH_BANDS = 4
+BAND_BITS = 16
+# Радиус поиска в полосе - не больше 2 бит (137 вариантов на полосу)
+MAX_HASH_DISTANCE = HASH_BANDS * 3 - 1
+# Для группировки нужна точная полоса из >= 10 бит, иначе кандидатов слишком много
+MAX_DUPLICATE_DISTANCE = 5
+# Блоки до этого размера сравниваются полностью, большие - окном соседей
+GROUP_EXACT_BLOCK = 512
+GROUP_BLOCK_WINDOW = 32
+GROUP_PAIR_BATCH = 1 << 18
+
+# Поля, под которые есть колонки; остальные ключи записи хранятся в extra (JSON)
+COLUMNS = (
+    "id",
+    "filename",
+    "caption",
+    "created_at",
+    "size_bytes",
+    "device_serial",
+    "burst_id",
+    "frame_index",
+)
+
+# Место на диске под запись: сам файл плюс оригинал в originals/, если он сохранён
+_OCCUPIED_BYTES = (
+    "size_bytes + CASE WHEN json_extract(extra, '$.original_filename') IS NOT NULL "
+    "THEN IFNULL(json_extract(extra, '$.original_size_bytes'), 0) ELSE 0 END"
+)
+_PINNED = "IFNULL(json_extract(extra, '$.pinned'), 0)"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS screenshots (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    caption TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    device_serial TEXT,
+    burst_id TEXT,
+    frame_index INTEGER,
+    extra TEXT,
+    present INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS screenshots_listing ON screenshots (present, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS screenshots_burst ON screenshots (burst_id, frame_index) WHERE burst_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS screenshots_group ON screenshots (json_extract(extra, '$.group_id'))
+    WHERE json_extract(extra, '$.group_id') IS NOT NULL;
+CREATE TABLE IF NOT EXISTS hashes (
+    id TEXT PRIMARY KEY,
+    phash INTEGER NOT NULL,
+    ahash INTEGER NOT NULL,
+    b0 INTEGER NOT NULL,
+    b1 INTEGER NOT NULL,
+    b2 INTEGER NOT NULL,
+    b3 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_b0 ON hashes (b0);
+CREATE INDEX IF NOT EXISTS hashes_b1 ON hashes (b1);
+CREATE INDEX IF NOT EXISTS hashes_b2 ON hashes (b2);
+CREATE INDEX IF NOT EXISTS hashes_b3 ON hashes (b3);
+"""
+
+
+def encode_cursor(created_at: str, screenshot_id: str) -> str:
+    raw = json.dumps([created_at, screenshot_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        created_at, screenshot_id = json.loads(base64.urlsafe_b64decode(padded))
+    except Exception as exc:
+        raise ValueError("Invalid cursor") from exc
+    return str(created_at), str(screenshot_id)
+
+
+def _to_signed(value: int) -> int:
+    """SQLite INTEGER знаковый - 64-битный хэш храним в дополнительном коде."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def hash_bands(value: int) -> List[int]:
+    mask = (1 << BAND_BITS) - 1
+    return [(value >> (BAND_BITS * (HASH_BANDS - 1 - band))) & mask for band in range(HASH_BANDS)]
+
+
+def _band_layout(count: int) -> List[tuple[int, int]]:
+    """Разбиение 64 бит на count полос: [(сдвиг, ширина)]."""
+    widths = [64 // count + (1 if band < 64 % count else 0) for band in range(count)]
+    layout = []
+    shift = 64
+    for width in widths:
+        shift -= width
+        layout.append((shift, width))
+    return layout
+
+
+def band_probes(band_value: int, radius: int, width: int = BAND_BITS) -> List[int]:
+    """Все значения полосы на расстоянии Хэмминга <= radius."""
+    probes = [band_value]
+    for flips in range(1, radius + 1):
+        for bits in itertools.combinations(range(width), flips):
+            value = band_value
+            for bit in bits:
+                value ^= 1 << bit
+            probes.append(value)
+    return probes
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _popcount64(values):
+    import numpy as np
+
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return table[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _compress(parent):
+    """Сжатие путей: каждый узел указывает прямо на корень (parent[x] <= x)."""
+    while True:
+        grand = parent[parent]
+        if (grand == parent).all():
+            return parent
+        parent = grand
+
+
+def _union(parent, left, right):
+    """Объединяет пары (left[i], right[i]): корень с большим номером подвешивается к меньшему."""
+    import numpy as np
+
+    while len(left):
+        parent = _compress(parent)
+        root_left, root_right = parent[left], parent[right]
+        differ = root_left != root_right
+        if not differ.any():
+            break
+        left, right = left[differ], right[differ]
+        root_left, root_right = root_left[differ], root_right[differ]
+        np.minimum.at(parent, np.maximum(root_left, root_right), np.minimum(root_left, root_right))
+    return _compress(parent)
+
+
+def _band_candidates(order, starts, sizes, values):
+    """
+    Пары-кандидаты внутри блоков с одинаковой полосой, порциями около GROUP_PAIR_BATCH.
+    Небольшие блоки дают все пары (векторно, по блокам одного размера); большой
+    блок - только соседей в окне GROUP_BLOCK_WINDOW после сортировки по значению
+    хэша, чтобы память и время оставались линейными.
+    """
+    import numpy as np
+
+    small = (sizes > 1) & (sizes <= GROUP_EXACT_BLOCK)
+    for size in np.unique(sizes[small]):
+        block_starts = starts[sizes == size]
+        left, right = np.triu_indices(int(size), k=1)
+        per_batch = max(1, GROUP_PAIR_BATCH // len(left))
+        for index in range(0, len(block_starts), per_batch):
+            chunk = block_starts[index:index + per_batch, None]
+            yield order[(chunk + left).ravel()], order[(chunk + right).ravel()]
+
+    for start, size in zip(starts[sizes > GROUP_EXACT_BLOCK], sizes[sizes > GROUP_EXACT_BLOCK]):
+        members = order[start:start + size]
+        members = members[np.argsort(values[members], kind="stable")]
+        for offset in range(1, GROUP_BLOCK_WINDOW + 1):
+            for first in range(0, size - offset, GROUP_PAIR_BATCH):
+                last = min(first + GROUP_PAIR_BATCH, size - offset)
+                yield members[first:last], members[first + offset:last + offset]
+
+
+def group_hashes(values: List[int], max_distance: int) -> List[int]:
+    """
+    Связные компоненты по расстоянию Хэмминга <= max_distance: метка группы для каждого хэша.
+
+    64 бита делятся на max_distance + 1 полос - у близкой пары хотя бы одна полоса
+    совпадает точно. Кандидаты берутся внутри блоков с одинаковым значением полосы
+    порциями, проверяются popcount-ом и объединяются в union-find, так что все
+    пары никогда не держатся в памяти. В очень больших блоках (серии почти
+    одинаковых снимков) сравниваются только соседи по значению хэша: такие снимки
+    всё равно связываются в одну группу цепочкой. Одинаковые хэши сначала
+    схлопываются в один узел.
+    """
+    import numpy as np
+
+    if not values:
+        return []
+    max_distance = max(0, min(max_distance, MAX_DUPLICATE_DISTANCE))
+    unique, inverse = np.unique(np.array(values, dtype=np.uint64), return_inverse=True)
+    count = len(unique)
+
+    parent = np.arange(count)
+    pending_left, pending_right, pending = [], [], 0
+    for shift, width in _band_layout(max_distance + 1):
+        band = (unique >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        order = np.argsort(band, kind="stable")
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(band[order])) + 1))
+        sizes = np.diff(np.concatenate((starts, [count])))
+        for left, right in _band_candidates(order, starts, sizes, unique):
+            close = _popcount64(unique[left] ^ unique[right]) <= max_distance
+            pending_left.append(left[close])
+            pending_right.append(right[close])
+            pending += int(close.sum())
+            if pending >= GROUP_PAIR_BATCH:
+                parent = _union(parent, np.concatenate(pending_left), np.concatenate(pending_right))
+                pending_left, pending_right, pending = [], [], 0
+    if pending:
+        parent = _union(parent, np.concatenate(pending_left), np.concatenate(pending_right))
+    return parent[inverse].tolist()
+
+
+class GalleryIndex:
+    """Потокобезопасная обёртка над одним соединением SQLite."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+        )
+        # COUNT(*) по индексу всё равно линеен - держим счётчики в памяти и сбрасываем при записи
+        self._counts: dict = {}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> dict:
+        entry = {name: row[name] for name in COLUMNS}
+        if entry["burst_id"] is None:
+            entry.pop("burst_id")
+            entry.pop("frame_index")
+        if row["extra"]:
+            entry.update(json.loads(row["extra"]))
+        return entry
+
+    @staticmethod
+    def _entry_params(entry: dict) -> tuple:
+        extra = {key: value for key, value in entry.items() if key not in COLUMNS}
+        return (
+            entry["id"],
+            entry["filename"],
+            entry.get("caption") or "",
+            entry["created_at"],
+            int(entry.get("size_bytes") or 0),
+            entry.get("device_serial"),
+            entry.get("burst_id"),
+            entry.get("frame_index"),
+            json.dumps(extra, ensure_ascii=False) if extra else None,
+        )
+
+    def _write(self, sql: str, params: Iterable = (), many: bool = False) -> int:
+        with self._lock:
+            self._counts.clear()
+            cursor = self._conn.executemany(sql, params) if many else self._conn.execute(sql, params)
+            return cursor.rowcount
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def add(self, entries: List[dict]):
+        """Добавляет (или заменяет) записи одной транзакцией."""
+        if not entries:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._write(
+                    "INSERT OR REPLACE INTO screenshots "
+                    "(id, filename, caption, created_at, size_bytes, device_serial, burst_id, frame_index, extra) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [self._entry_params(entry) for entry in entries],
+                    many=True,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def update(self, entry: dict):
+        """Перезаписывает запись целиком (например, после смены файла или доп. полей)."""
+        self.add([entry])
+
+    def get(self, screenshot_id: str, include_missing: bool = False) -> Optional[dict]:
+        sql = "SELECT * FROM screenshots WHERE id = ?"
+        if not include_missing:
+            sql += " AND present = 1"
+        with self._lock:
+            row = self._conn.execute(sql, (screenshot_id,)).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def get_many(self, ids: List[str], present_only: bool = False) -> List[dict]:
+        ids = list(ids)
+        rows = []
+        # Старые сборки SQLite ограничивают число параметров запроса 999
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            with self._lock:
+                rows.extend(self._conn.execute(
+                    f"SELECT * FROM screenshots WHERE id IN ({placeholders})", chunk
+                ).fetchall())
+        # Фильтр present в SQL заставил бы планировщик идти по индексу списка вместо первичного ключа
+        return [self._row_to_entry(row) for row in rows if row["present"] or not present_only]
+
+    def set_caption(self, screenshot_id: str, caption: str) -> Optional[dict]:
+        changed = self._write(
+            "UPDATE screenshots SET caption = ? WHERE id = ? AND present = 1", (caption, screenshot_id)
+        )
+        return self.get(screenshot_id) if changed else None
+
+    def delete(self, ids: List[str]) -> int:
+        if not ids:
+            return 0
+        ids = list(ids)
+        deleted = 0
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                self._conn.execute(f"DELETE FROM hashes WHERE id IN ({placeholders})", chunk)
+                deleted += self._write(f"DELETE FROM screenshots WHERE id IN ({placeholders})", chunk)
+        return deleted
+
+    def count(self, burst_id: Optional[str] = None) -> int:
+        with self._lock:
+            if burst_id not in self._counts:
+                if burst_id is None:
+                    row = self._conn.execute("SELECT COUNT(*) FROM screenshots WHERE present = 1").fetchone()
+                else:
+                    row = self._conn.execute(
+                        "SELECT COUNT(*) FROM screenshots WHERE present = 1 AND burst_id = ?", (burst_id,)
+                    ).fetchone()
+                self._counts[burst_id] = row[0]
+            return self._counts[burst_id]
+
+    def list_page(
+        self,
+        limit: int,
+        cursor: Optional[str] = None,
+        offset: int = 0,
+        burst_id: Optional[str] = None,
+    ) -> tuple[List[dict], Optional[str]]:
+        """
+        Страница записей от новых к старым.
+
+        С cursor запрос продолжает выборку с позиции (created_at, id) по индексу -
+        стоимость O(limit) независимо от глубины. offset оставлен для старых клиентов.
+        """
+        where = ["present = 1"]
+        params: list = []
+        if burst_id is not None:
+            where.append("burst_id = ?")
+            params.append(burst_id)
+        if cursor:
+            created_at, screenshot_id = decode_cursor(cursor)
+            where.append("(created_at, id) < (?, ?)")
+            params.extend([created_at, screenshot_id])
+            offset = 0
+        sql = (
+            f"SELECT * FROM screenshots WHERE {' AND '.join(where)} "
+            "ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?"
+        )
+        params.extend([limit + 1, offset])
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        entries = [self._row_to_entry(row) for row in rows[:limit]]
+        next_cursor = None
+        if has_more and entries:
+            next_cursor = encode_cursor(entries[-1]["created_at"], entries[-1]["id"])
+        return entries, next_cursor
+
+    def burst_frames(self, burst_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM screenshots WHERE burst_id = ? AND present = 1 ORDER BY frame_index",
+                (burst_id,),
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def select(
+        self,
+        ids: Optional[List[str]] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        burst_id: Optional[str] = None,
+    ) -> List[dict]:
+        """Записи по фильтрам в порядке съёмки (для экспорта и фоновых задач)."""
+        where = ["present = 1"]
+        params: list = []
+        if date_from:
+            where.append("created_at >= ?")
+            params.append(date_from)
+        if date_to:
+            # Дата без времени включает весь день
+            where.append("created_at <= ?")
+            params.append(date_to if "T" in date_to else f"{date_to}T99")
+        if burst_id is not None:
+            where.append("burst_id = ?")
+            params.append(burst_id)
+        sql = f"SELECT * FROM screenshots WHERE {' AND '.join(where)}"
+        if not ids:
+            with self._lock:
+                rows = self._conn.execute(f"{sql} ORDER BY created_at, id", params).fetchall()
+            return [self._row_to_entry(row) for row in rows]
+
+        ids = list(dict.fromkeys(ids))
+        rows = []
+        # Старые сборки SQLite ограничивают число параметров запроса 999
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            with self._lock:
+                rows.extend(self._conn.execute(f"{sql} AND id IN ({placeholders})", params + chunk).fetchall())
+        rows.sort(key=lambda row: (row["created_at"], row["id"]))
+        return [self._row_to_entry(row) for row in rows]
+
+    def storage_candidates(self, storage_format: str, limit: int, exclude: Iterable[str] = ()) -> List[dict]:
+        """Записи, ещё не перекодированные в storage_format (от старых к новым)."""
+        exclude = list(exclude)
+        where = "present = 1 AND IFNULL(json_extract(extra, '$.storage_format'), 'original') != ?"
+        with self._lock:
+            if exclude:
+                # Список исключений не ограничен - через временную таблицу, а не NOT IN (?, ...)
+                self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS excluded_ids (id TEXT PRIMARY KEY)")
+                self._conn.execute("DELETE FROM excluded_ids")
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO excluded_ids (id) VALUES (?)", [(item,) for item in exclude]
+                )
+                where += " AND id NOT IN (SELECT id FROM excluded_ids)"
+            rows = self._conn.execute(
+                f"SELECT * FROM screenshots WHERE {where} ORDER BY created_at, id LIMIT ?",
+                (storage_format, limit),
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def storage_totals(self) -> dict:
+        """Объём галереи по форматам хранения и размер сохранённых оригиналов."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT IFNULL(json_extract(extra, '$.storage_format'), 'original') AS storage_format, "
+                "COUNT(*) AS files, SUM(size_bytes) AS stored_bytes, "
+                "SUM(IFNULL(json_extract(extra, '$.original_size_bytes'), size_bytes)) AS original_bytes, "
+                "SUM(CASE WHEN json_extract(extra, '$.original_filename') IS NOT NULL "
+                "THEN json_extract(extra, '$.original_size_bytes') ELSE 0 END) AS retained_bytes "
+                "FROM screenshots WHERE present = 1 GROUP BY 1"
+            ).fetchall()
+        formats = {row["storage_format"]: {key: row[key] or 0 for key in row.keys() if key != "storage_format"} for row in rows}
+        stored = sum(item["stored_bytes"] for item in formats.values())
+        original = sum(item["original_bytes"] for item in formats.values())
+        retained = sum(item["retained_bytes"] for item in formats.values())
+        return {
+            "formats": formats,
+            "stored_bytes": stored,
+            "original_bytes": original,
+            # Оригиналы в originals/ всё ещё занимают место - считаем чистую экономию
+            "saved_bytes": original - stored - retained,
+            "retained_originals_bytes": retained,
+        }
+
+    def set_pinned(self, screenshot_id: str, pinned: bool) -> Optional[dict]:
+        """Закрепляет скриншот: политика хранения (retention) его не удаляет."""
+        with self._lock:
+            entry = self.get(screenshot_id)
+            if entry is None:
+                return None
+            if pinned:
+                entry["pinned"] = True
+            else:
+                entry.pop("pinned", None)
+            self.update(entry)
+        return entry
+
+    def retention_totals(self) -> dict:
+        """Занятое место с учётом сохранённых оригиналов, в том числе закреплёнными снимками."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) AS files, SUM({_OCCUPIED_BYTES}) AS bytes, "
+                f"SUM({_PINNED}) AS pinned_files, "
+                f"SUM(CASE WHEN {_PINNED} THEN {_OCCUPIED_BYTES} ELSE 0 END) AS pinned_bytes "
+                "FROM screenshots WHERE present = 1"
+            ).fetchone()
+        return {key: row[key] or 0 for key in row.keys()}
+
+    def eviction_candidates(self, limit: int, after: Optional[tuple[str, str]] = None) -> List[dict]:
+        """Незакреплённые записи от старых к новым; after = (created_at, id) последней из прошлой пачки."""
+        where = f"present = 1 AND NOT {_PINNED}"
+        params: list = []
+        if after:
+            where += " AND (created_at, id) > (?, ?)"
+            params.extend(after)
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT *, {_OCCUPIED_BYTES} AS occupied_bytes FROM screenshots "
+                f"WHERE {where} ORDER BY created_at, id LIMIT ?",
+                params,
+            ).fetchall()
+        items = []
+        for row in rows:
+            entry = self._row_to_entry(row)
+            entry["occupied_bytes"] = row["occupied_bytes"] or 0
+            items.append(entry)
+        return items
+
+    def group_members(self, group_id: str) -> List[dict]:
+        """Снимки одной групповой съёмки (несколько устройств одновременно)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM screenshots WHERE json_extract(extra, '$.group_id') = ? AND present = 1",
+                (group_id,),
+            ).fetchall()
+        entries = [self._row_to_entry(row) for row in rows]
+        entries.sort(key=lambda entry: entry.get("group_index", 0))
+        return entries
+
+    def filenames(self) -> set:
+        with self._lock:
+            rows = self._conn.execute("SELECT filename FROM screenshots").fetchall()
+        return {row["filename"] for row in rows}
+
+    def set_present(self, filenames: Iterable[str], present: bool) -> int:
+        names = [(1 if present else 0, name) for name in filenames]
+        if not names:
+            return 0
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                changed = self._write(
+                    "UPDATE screenshots SET present = ? WHERE filename = ?", names, many=True
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return changed
+
+    def reconcile(self, existing: set) -> tuple[int, int]:
+        """Приводит флаги present к фактическому списку файлов; возвращает (пропавшие, вернувшиеся)."""
+        with self._lock:
+            rows = self._conn.execute("SELECT filename, present FROM screenshots").fetchall()
+        missing = [row["filename"] for row in rows if row["present"] and row["filename"] not in existing]
+        restored = [row["filename"] for row in rows if not row["present"] and row["filename"] in existing]
+        self.set_present(missing, False)
+        self.set_present(restored, True)
+        return len(missing), len(restored)
+
+    def import_metadata_json(self, metadata_file: Path) -> int:
+        """Однократный перенос записей из metadata.json; повторный вызов ничего не делает."""
+        if self.get_meta("metadata_json_imported"):
+            return 0
+        imported = 0
+        if metadata_file.exists():
+            try:
+                data = json.loads(metadata_file.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = []
+            entries = [
+                item for item in data
+                if isinstance(item, dict) and item.get("id") and item.get("filename") and item.get("created_at")
+            ]
+            self.add(entries)
+            imported = len(entries)
+        self.set_meta("metadata_json_imported", "1")
+        return imported
+
+    def set_hashes(self, items: List[tuple[str, int, int]]):
+        """Сохраняет (id, phash, ahash) одной транзакцией."""
+        rows = [
+            (item_id, _to_signed(phash), _to_signed(ahash), *hash_bands(phash))
+            for item_id, phash, ahash in items
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO hashes (id, phash, ahash, b0, b1, b2, b3) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_hash(self, screenshot_id: str) -> Optional[tuple[int, int]]:
+        with self._lock:
+            row = self._conn.execute("SELECT phash, ahash FROM hashes WHERE id = ?", (screenshot_id,)).fetchone()
+        return (_to_unsigned(row["phash"]), _to_unsigned(row["ahash"])) if row else None
+
+    def unhashed(self, limit: int) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.* FROM screenshots s LEFT JOIN hashes h ON h.id = s.id "
+                "WHERE h.id IS NULL AND s.present = 1 ORDER BY s.created_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [self._row_to_entry(row) for row in rows]
+
+    def hash_stats(self) -> dict:
+        with self._lock:
+            hashed = self._conn.execute(
+                "SELECT COUNT(*) FROM hashes h JOIN screenshots s ON s.id = h.id WHERE s.present = 1"
+            ).fetchone()[0]
+        return {"hashed": hashed, "total": self.count()}
+
+    def similar(self, phash: int, max_distance: int, limit: int, exclude_id: Optional[str] = None) -> List[tuple]:
+        """
+        Скриншоты с pHash на расстоянии <= max_distance: [(запись, pHash-дистанция, aHash)].
+
+        Кандидаты берутся точными запросами по индексам полос, затем проверяется
+        полное расстояние; стоимость зависит от числа кандидатов, а не от размера галереи.
+        """
+        max_distance = max(0, min(max_distance, MAX_HASH_DISTANCE))
+        radius = max_distance // HASH_BANDS
+        candidates = {}
+        with self._lock:
+            for band, band_value in enumerate(hash_bands(phash)):
+                probes = band_probes(band_value, radius)
+                placeholders = ",".join("?" for _ in probes)
+                for row in self._conn.execute(
+                    f"SELECT id, phash, ahash FROM hashes WHERE b{band} IN ({placeholders})", probes
+                ):
+                    candidates[row["id"]] = row
+        matches = []
+        for candidate_id, row in candidates.items():
+            if candidate_id == exclude_id:
+                continue
+            distance = hamming(phash, _to_unsigned(row["phash"]))
+            if distance <= max_distance:
+                matches.append((candidate_id, distance, _to_unsigned(row["ahash"])))
+        matches.sort(key=lambda item: item[1])
+
+        entries = {
+            entry["id"]: entry
+            for entry in self.get_many([item[0] for item in matches], present_only=True)
+        }
+        result = []
+        for candidate_id, distance, ahash in matches:
+            entry = entries.get(candidate_id)
+            if entry is None:
+                continue
+            result.append((entry, distance, ahash))
+            if len(result) >= limit:
+                break
+        return result
+
+    def duplicate_groups(self, max_distance: int) -> List[List[dict]]:
+        """Группы почти одинаковых скриншотов, отсортированные по времени съёмки."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.*, h.phash AS phash FROM hashes h JOIN screenshots s ON s.id = h.id "
+                "WHERE s.present = 1 ORDER BY s.created_at, s.id"
+            ).fetchall()
+        labels = group_hashes([_to_unsigned(row["phash"]) for row in rows], max_distance)
+
+        members = {}
+        for row, label in zip(rows, labels):
+            members.setdefault(label, []).append(row)
+        # Строки уже упорядочены по времени - группы и их члены тоже
+        return [
+            [self._row_to_entry(row) for row in group]
+            for group in members.values()
+            if len(group) > 1
+        ]
@@ -0,0 +1,374 @@
+"""
+Обработка изображений на стороне хоста.
+Функции модуля выполняются в пуле процессов (mkdsc.web.workers),
+поэтому принимают и возвращают только байты и простые типы.
+
+Pillow импортируется лениво: без него модуль загружается,
+но функции декодирования сообщают об ошибке. HEIC/HEIF декодируются,
+только если установлен pillow-heif.
+"""
+import io
+import struct
+from typing import Optional
+
+THUMBNAIL_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+_EXIF_HEADER = b"Exif\x00\x00"
+_TAG_THUMBNAIL_OFFSET = 0x0201
+_TAG_THUMBNAIL_LENGTH = 0x0202
+_TAG_ORIENTATION = 0x0112
+_TIFF_SHORT = 3
+# Маркеры SOF, после которых в JPEG идут размеры кадра
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_HEIF_REGISTERED = False
+# EXIF Orientation -> Image.Transpose, как в ImageOps.exif_transpose
+_ORIENTATION_TRANSPOSE = {
+    1: None,
+    2: "FLIP_LEFT_RIGHT",
+    3: "ROTATE_180",
+    4: "FLIP_TOP_BOTTOM",
+    5: "TRANSPOSE",
+    6: "ROTATE_270",
+    7: "TRANSVERSE",
+    8: "ROTATE_90",
+}
+
+
+def pillow_available() -> bool:
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def heif_available() -> bool:
+    try:
+        import pillow_heif  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _require_pillow():
+    try:
+        from PIL import Image
+    except ImportError as exc:
+        raise RuntimeError("Pillow is required for image processing") from exc
+    global _HEIF_REGISTERED
+    # Регистрация нужна в каждом процессе пула - делаем её при первом декодировании
+    if not _HEIF_REGISTERED and heif_available():
+        import pillow_heif
+
+        pillow_heif.register_heif_opener()
+        _HEIF_REGISTERED = True
+    return Image
+
+
+def media_type_for(fmt: str) -> str:
+    return THUMBNAIL_FORMATS.get(fmt, THUMBNAIL_FORMATS["webp"])[1]
+
+
+def _read_ifd_entries(tiff: bytes, offset: int, endian: str) -> tuple[dict, int]:
+    count = struct.unpack_from(f"{endian}H", tiff, offset)[0]
+    entries = {}
+    for index in range(count):
+        entry_offset = offset + 2 + index * 12
+        tag, kind, count_, value = struct.unpack_from(f"{endian}HHII", tiff, entry_offset)
+        if kind == _TIFF_SHORT and count_ == 1:
+            # SHORT лежит в первых двух байтах поля значения
+            value = struct.unpack_from(f"{endian}H", tiff, entry_offset + 8)[0]
+        entries[tag] = value
+    next_offset = struct.unpack_from(f"{endian}I", tiff, offset + 2 + count * 12)[0]
+    return entries, next_offset
+
+
+def extract_exif_thumbnail(data: bytes) -> Optional[tuple[bytes, int]]:
+    """
+    Достаёт встроенную JPEG-миниатюру из EXIF (IFD1) и Orientation из IFD0.
+
+    Достаточно первых 128 КБ файла (THUMBNAIL_EXIF_PROBE_BYTES в file_manager):
+    сегмент APP1 идёт в начале JPEG и не длиннее 64 КБ, перед ним может стоять APP0.
+    Сама миниатюра тега Orientation не несёт, поэтому поворот возвращается отдельно
+    (1 - без поворота). Возвращает None, если миниатюры нет или данные обрезаны.
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    position = 2
+    try:
+        while position + 4 <= len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            if marker in (0xD9, 0xDA):
+                return None
+            length = struct.unpack_from(">H", data, position + 2)[0]
+            segment = data[position + 4:position + 2 + length]
+            if marker == 0xE1 and segment.startswith(_EXIF_HEADER):
+                tiff = segment[len(_EXIF_HEADER):]
+                endian = "<" if tiff[:2] == b"II" else ">"
+                ifd0_offset = struct.unpack_from(f"{endian}I", tiff, 4)[0]
+                ifd0, ifd1_offset = _read_ifd_entries(tiff, ifd0_offset, endian)
+                if not ifd1_offset:
+                    return None
+                ifd1, _ = _read_ifd_entries(tiff, ifd1_offset, endian)
+                thumb_offset = ifd1.get(_TAG_THUMBNAIL_OFFSET)
+                thumb_length = ifd1.get(_TAG_THUMBNAIL_LENGTH)
+                if not thumb_offset or not thumb_length:
+                    return None
+                thumbnail = tiff[thumb_offset:thumb_offset + thumb_length]
+                if len(thumbnail) != thumb_length or not thumbnail.startswith(b"\xff\xd8"):
+                    return None
+                orientation = ifd0.get(_TAG_ORIENTATION, 1)
+                if orientation not in _ORIENTATION_TRANSPOSE:
+                    orientation = 1
+                return thumbnail, orientation
+            position += 2 + length
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+def jpeg_dimensions(data: bytes) -> Optional[tuple[int, int]]:
+    """Читает (width, height) из заголовка SOF без декодирования JPEG."""
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    position = 2
+    try:
+        while position + 4 <= len(data):
+            if data[position] != 0xFF:
+                return None
+            marker = data[position + 1]
+            if marker in (0xD9, 0xDA):
+                return None
+            length = struct.unpack_from(">H", data, position + 2)[0]
+            if marker in _JPEG_SOF_MARKERS:
+                height, width = struct.unpack_from(">HH", data, position + 5)
+                return width, height
+            position += 2 + length
+    except (struct.error, IndexError):
+        return None
+    return None
+
+
+def make_thumbnail(
+    data: bytes, max_px: int, fmt: str = "webp", quality: int = 80, orientation: int = 1
+) -> bytes:
+    """
+    Декодирует изображение и уменьшает его так, чтобы большая сторона была <= max_px.
+
+    orientation - EXIF Orientation оригинала для данных без собственного тега
+    (встроенная EXIF-миниатюра); иначе поворот берётся из EXIF самих данных.
+    """
+    Image = _require_pillow()
+    pil_format = THUMBNAIL_FORMATS.get(fmt, THUMBNAIL_FORMATS["webp"])[0]
+
+    with Image.open(io.BytesIO(data)) as image:
+        # Для JPEG draft() декодирует сразу в уменьшенном масштабе (DCT scaling)
+        image.draft("RGB", (max_px, max_px))
+        try:
+            from PIL import ImageOps
+            image = ImageOps.exif_transpose(image)
+        except Exception:
+            pass
+        method = _ORIENTATION_TRANSPOSE.get(orientation)
+        if method:
+            image = image.transpose(getattr(Image.Transpose, method))
+        image.thumbnail((max_px, max_px))
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+
+        output = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(output, format=pil_format, optimize=True)
+        else:
+            image.save(output, format=pil_format, quality=quality)
+        return output.getvalue()
+
+
+def make_thumbnail_file(path: str, max_px: int, fmt: str = "webp", quality: int = 80) -> bytes:
+    """То же, что make_thumbnail, но читает файл в воркере - не гоняем оригинал через pickle."""
+    with open(path, "rb") as source:
+        return make_thumbnail(source.read(), max_px, fmt, quality)
+
+
+# Форматы пикселей из ui/PixelFormat.h, которые отдаёт screencap без -p
+RAW_FORMAT_RGBA_8888 = 1
+RAW_FORMAT_RGBX_8888 = 2
+RAW_FORMAT_RGB_888 = 3
+RAW_FORMAT_RGB_565 = 4
+RAW_FORMAT_BGRA_8888 = 5
+_RAW_BYTES_PER_PIXEL = {
+    RAW_FORMAT_RGBA_8888: 4,
+    RAW_FORMAT_RGBX_8888: 4,
+    RAW_FORMAT_RGB_888: 3,
+    RAW_FORMAT_RGB_565: 2,
+    RAW_FORMAT_BGRA_8888: 4,
+}
+
+FRAME_FORMATS = {
+    "png": ("PNG", "png"),
+    "webp": ("WEBP", "webp"),
+}
+
+
+def numpy_available() -> bool:
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parse_raw_header(data: bytes) -> tuple[int, int, int, int]:
+    """
+    Разбирает заголовок raw-вывода screencap: (width, height, format, длина заголовка).
+
+    До Android 9 заголовок 12 байт (w, h, format), начиная с 9 - 16 байт (+ dataspace).
+    """
+    if len(data) < 12:
+        raise ValueError("screencap output is too short")
+    width, height, pixel_format = struct.unpack_from("<III", data, 0)
+    bpp = _RAW_BYTES_PER_PIXEL.get(pixel_format)
+    if not bpp or not width or not height:
+        raise ValueError(f"Unsupported screencap pixel format: {pixel_format}")
+    for header_size in (16, 12):
+        payload = len(data) - header_size
+        if payload >= width * height * bpp and payload % (height * bpp) == 0:
+            return width, height, pixel_format, header_size
+    raise ValueError("screencap output size does not match its header")
+
+
+def raw_to_array(data: bytes):
+    """Декодирует raw-кадр screencap в массив NumPy (h, w, 3|4) без копирования строк по одной."""
+    import numpy as np
+
+    width, height, pixel_format, header_size = parse_raw_header(data)
+    bpp = _RAW_BYTES_PER_PIXEL[pixel_format]
+    pixels = np.frombuffer(data, dtype=np.uint8, offset=header_size)
+    # Старые версии screencap пишут буфер целиком вместе с выравниванием строки (stride)
+    stride = pixels.size // (height * bpp)
+    pixels = pixels[:height * stride * bpp]
+
+    if pixel_format == RAW_FORMAT_RGB_565:
+        values = pixels.view("<u2").reshape(height, stride)[:, :width]
+        red = ((values >> 11) & 0x1F).astype(np.uint8)
+        green = ((values >> 5) & 0x3F).astype(np.uint8)
+        blue = (values & 0x1F).astype(np.uint8)
+        return np.dstack(((red << 3) | (red >> 2), (green << 2) | (green >> 4), (blue << 3) | (blue >> 2)))
+
+    frame = pixels.reshape(height, stride, bpp)[:, :width]
+    if pixel_format == RAW_FORMAT_BGRA_8888:
+        return frame[:, :, [2, 1, 0, 3]]
+    if pixel_format == RAW_FORMAT_RGBX_8888:
+        return frame[:, :, :3]
+    return frame
+
+
+def encode_raw_frame(data: bytes, fmt: str = "png", lossless: bool = True, quality: int = 90) -> bytes:
+    """Кодирует raw-кадр screencap в PNG/WebP (выполняется в пуле процессов)."""
+    Image = _require_pillow()
+    pil_format = FRAME_FORMATS.get(fmt, FRAME_FORMATS["png"])[0]
+    import numpy as np
+
+    image = Image.fromarray(np.ascontiguousarray(raw_to_array(data)))
+    # Альфа у скриншотов всегда непрозрачная - отбрасываем, файл получается меньше
+    if image.mode == "RGBA" and image.getextrema()[3][0] == 255:
+        image = image.convert("RGB")
+
+    output = io.BytesIO()
+    if pil_format == "PNG":
+        # compress_level=1: кодирование в разы быстрее, размер почти тот же, что у screencap -p
+        image.save(output, format="PNG", compress_level=1)
+    elif lossless:
+        image.save(output, format="WEBP", lossless=True, method=0)
+    else:
+        image.save(output, format="WEBP", quality=quality, method=2)
+    return output.getvalue()
+
+
+PHASH_BITS = 64
+_PHASH_SIDE = 32
+_PHASH_LOW = 8
+_DCT_MATRIX = None
+
+
+def _dct_matrix(size: int):
+    """Матрица DCT-II (ортонормированная): dct(x) = M @ x, двумерная - M @ X @ M.T."""
+    global _DCT_MATRIX
+    import numpy as np
+
+    if _DCT_MATRIX is None or _DCT_MATRIX.shape[0] != size:
+        k = np.arange(size)[:, None]
+        n = np.arange(size)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+        matrix[0, :] /= np.sqrt(2.0)
+        _DCT_MATRIX = matrix
+    return _DCT_MATRIX
+
+
+def _bits_to_int(bits) -> int:
+    import numpy as np
+
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), "big")
+
+
+def perceptual_hashes(path: str) -> tuple[int, int]:
+    """
+    Перцептивные хэши файла: (pHash, aHash), по 64 бита.
+
+    pHash - знаки низкочастотных коэффициентов DCT 32x32 относительно медианы,
+    aHash - пиксели 8x8 относительно среднего. Оба устойчивы к пережатию
+    и мелким отличиям (часы, индикаторы в статус-баре).
+    """
+    Image = _require_pillow()
+    import numpy as np
+
+    with Image.open(path) as image:
+        image.draft("L", (_PHASH_SIDE * 4, _PHASH_SIDE * 4))
+        gray = image.convert("L")
+        pixels = np.asarray(gray.resize((_PHASH_SIDE, _PHASH_SIDE), Image.BILINEAR), dtype=np.float64)
+        small = np.asarray(gray.resize((8, 8), Image.BILINEAR), dtype=np.float64)
+
+    matrix = _dct_matrix(_PHASH_SIDE)
+    low = (matrix @ pixels @ matrix.T)[:_PHASH_LOW, :_PHASH_LOW].ravel()
+    # DC-коэффициент - средняя яркость, в сравнение с медианой его не включаем
+    phash = _bits_to_int(low > np.median(low[1:]))
+    ahash = _bits_to_int(small.ravel() > small.mean())
+    return phash, ahash
+
+
+# Форматы хранения галереи: имя -> (формат Pillow, расширение, с потерями)
+STORAGE_FORMATS = {
+    "webp_lossless": ("WEBP", "webp", False),
+    "png_optimized": ("PNG", "png", False),
+    "webp_lossy": ("WEBP", "webp", True),
+}
+
+
+def encode_for_storage(path: str, storage_format: str, quality: int = 85) -> bytes:
+    """Перекодирует файл скриншота в формат хранения галереи (выполняется в пуле процессов)."""
+    Image = _require_pillow()
+    pil_format, _, lossy = STORAGE_FORMATS[storage_format]
+
+    with Image.open(path) as image:
+        image.load()
+        if image.mode == "RGBA" and image.getextrema()[3][0] == 255:
+            image = image.convert("RGB")
+        elif image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA")
+
+        output = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(output, format="PNG", optimize=True)
+        elif lossy:
+            image.save(output, format="WEBP", quality=quality, method=4)
+        else:
+            image.save(output, format="WEBP", lossless=True, quality=100, method=4)
+        return output.getvalue()
@@ -0,0 +1,441 @@
+"""
+Чтение метаданных MP4 и MKV без ffprobe.
+
+Разбираются только заголовки контейнера: у MP4 - бокс moov (mvhd, tkhd,
+mdhd, hdlr, stsd), у MKV - элементы Info и Tracks до первого Cluster.
+Сами медиаданные (mdat, кластеры) не читаются, поэтому разбор многогигабайтного
+файла стоит несколько seek и чтение пары килобайт-мегабайт.
+
+Файл, который ещё пишется, разбирается частично: у MP4 без moov известен
+только контейнер, у MKV без Duration - кодеки и разрешение.
+"""
+import os
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Iterator, Optional
+
+# moov записи scrcpy - сотни килобайт на час видео; больше - скорее битый размер
+MAX_MOOV_BYTES = 64 * 1024 * 1024
+# Info и Tracks у MKV лежат в начале файла
+MAX_MKV_HEADER_BYTES = 4 * 1024 * 1024
+
+_MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+_MKV_EPOCH = datetime(2001, 1, 1, tzinfo=timezone.utc)
+
+MP4_CODECS = {
+    "avc1": "h264",
+    "avc3": "h264",
+    "hvc1": "h265",
+    "hev1": "h265",
+    "av01": "av1",
+    "mp4a": "aac",
+    "Opus": "opus",
+    "fLaC": "flac",
+    "sowt": "pcm",
+    "twos": "pcm",
+    "ipcm": "pcm",
+}
+
+MKV_CODECS = {
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_MPEGH/ISO/HEVC": "h265",
+    "V_AV1": "av1",
+    "A_AAC": "aac",
+    "A_OPUS": "opus",
+    "A_FLAC": "flac",
+    "A_PCM/INT/LIT": "pcm",
+}
+
+# ID элементов Matroska (вместе с маркерными битами)
+EBML_HEADER = 0x1A45DFA3
+EBML_DOCTYPE = 0x4282
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMESTAMP_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_DATE_UTC = 0x4461
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_NUMBER = 0xD7
+MKV_TRACK_TYPE = 0x83
+MKV_CODEC_ID = 0x86
+MKV_VIDEO = 0xE0
+MKV_PIXEL_WIDTH = 0xB0
+MKV_PIXEL_HEIGHT = 0xBA
+MKV_CLUSTER = 0x1F43B675
+MKV_CLUSTER_TIMESTAMP = 0xE7
+MKV_SIMPLE_BLOCK = 0xA3
+MKV_BLOCK_GROUP = 0xA0
+MKV_BLOCK = 0xA1
+
+MKV_TRACK_VIDEO = 1
+MKV_TRACK_AUDIO = 2
+
+
+class MediaProbeError(ValueError):
+    """Файл не похож на MP4/MKV или заголовок повреждён."""
+
+
+def _empty_info(container: str) -> dict:
+    return {
+        "container": container,
+        "duration_s": None,
+        "video_codec": None,
+        "audio_codec": None,
+        "width": None,
+        "height": None,
+        "created_at": None,
+        "complete": False,
+    }
+
+
+# --- MP4 ---------------------------------------------------------------------
+
+
+def iter_boxes(fh: BinaryIO, start: int, end: int) -> Iterator[tuple[str, int, int]]:
+    """Боксы в диапазоне файла: (тип, смещение заголовка, смещение конца)."""
+    offset = start
+    while offset + 8 <= end:
+        fh.seek(offset)
+        header = fh.read(8)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            large = fh.read(8)
+            if len(large) < 8:
+                return
+            size = struct.unpack(">Q", large)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            raise MediaProbeError(f"Invalid box size at offset {offset}")
+        yield kind.decode("latin-1"), offset, min(offset + size, end)
+        offset += size
+
+
+def _children(data: bytes, start: int = 0, end: Optional[int] = None) -> dict:
+    """Дочерние боксы внутри буфера: тип -> список (начало payload, конец)."""
+    end = len(data) if end is None else end
+    result: dict = {}
+    offset = start
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            break
+        result.setdefault(kind.decode("latin-1"), []).append((offset + header_size, offset + size))
+        offset += size
+    return result
+
+
+def _first(boxes: dict, kind: str) -> Optional[tuple[int, int]]:
+    items = boxes.get(kind)
+    return items[0] if items else None
+
+
+def _mp4_time(seconds: int) -> Optional[str]:
+    # scrcpy (как и многие муксеры) пишет 0 - даты нет
+    if not seconds:
+        return None
+    return (_MP4_EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def _parse_trak(moov: bytes, start: int, end: int) -> dict:
+    track: dict = {}
+    trak = _children(moov, start, end)
+    tkhd = _first(trak, "tkhd")
+    if tkhd and tkhd[1] - tkhd[0] >= 84:
+        # Ширина и высота - последние 8 байт tkhd, фиксированная точка 16.16
+        width, height = struct.unpack_from(">II", moov, tkhd[1] - 8)
+        track["width"], track["height"] = width >> 16, height >> 16
+    mdia = _first(trak, "mdia")
+    if not mdia:
+        return track
+    mdia_boxes = _children(moov, *mdia)
+    hdlr = _first(mdia_boxes, "hdlr")
+    if hdlr:
+        track["handler"] = moov[hdlr[0] + 8:hdlr[0] + 12].decode("latin-1")
+    mdhd = _first(mdia_boxes, "mdhd")
+    if mdhd:
+        version = moov[mdhd[0]]
+        if version == 1:
+            timescale, duration = struct.unpack_from(">IQ", moov, mdhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", moov, mdhd[0] + 12)
+        if timescale:
+            track["duration_s"] = duration / timescale
+    minf = _first(mdia_boxes, "minf")
+    stbl = _first(_children(moov, *minf), "stbl") if minf else None
+    stsd = _first(_children(moov, *stbl), "stsd") if stbl else None
+    if stsd and stsd[1] - stsd[0] >= 16:
+        # version/flags, entry_count, затем первая запись: размер и fourcc
+        fourcc = moov[stsd[0] + 12:stsd[0] + 16].decode("latin-1")
+        track["codec"] = MP4_CODECS.get(fourcc, fourcc.strip().lower())
+        entry = stsd[0] + 8
+        if track.get("handler") == "vide" and stsd[1] - entry >= 36 and not track.get("width"):
+            track["width"], track["height"] = struct.unpack_from(">HH", moov, entry + 32)
+    return track
+
+
+def probe_mp4(fh: BinaryIO, file_size: int) -> dict:
+    info = _empty_info("mp4")
+    moov_range = next(
+        ((start, end) for kind, start, end in iter_boxes(fh, 0, file_size) if kind == "moov"), None
+    )
+    if moov_range is None:
+        # moov пишется в конце - файл ещё записывается или запись оборвалась
+        return info
+    length = moov_range[1] - moov_range[0]
+    if length > MAX_MOOV_BYTES:
+        raise MediaProbeError("moov box is too large")
+    fh.seek(moov_range[0])
+    moov = fh.read(length)
+    if len(moov) < length:
+        return info
+
+    boxes = _children(moov, 8)
+    mvhd = _first(boxes, "mvhd")
+    if mvhd:
+        version = moov[mvhd[0]]
+        if version == 1:
+            created, _modified, timescale, duration = struct.unpack_from(">QQIQ", moov, mvhd[0] + 4)
+        else:
+            created, _modified, timescale, duration = struct.unpack_from(">IIII", moov, mvhd[0] + 4)
+        if timescale:
+            info["duration_s"] = round(duration / timescale, 3)
+        info["created_at"] = _mp4_time(created)
+    for start, end in boxes.get("trak", []):
+        track = _parse_trak(moov, start, end)
+        handler = track.get("handler")
+        if handler == "vide" and not info["video_codec"]:
+            info["video_codec"] = track.get("codec")
+            info["width"], info["height"] = track.get("width") or None, track.get("height") or None
+        elif handler == "soun" and not info["audio_codec"]:
+            info["audio_codec"] = track.get("codec")
+        if info["duration_s"] is None and track.get("duration_s") is not None:
+            info["duration_s"] = round(track["duration_s"], 3)
+    info["complete"] = True
+    return info
+
+
+# --- MKV ---------------------------------------------------------------------
+
+
+def _read_vint(buffer: bytes, offset: int, keep_marker: bool) -> tuple[Optional[int], int]:
+    """EBML variable-length integer: (значение, длина). None - неизвестный размер."""
+    if offset >= len(buffer):
+        raise MediaProbeError("Truncated EBML element")
+    first = buffer[offset]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or offset + length > len(buffer):
+        raise MediaProbeError("Invalid EBML varint")
+    value = first if keep_marker else first & (mask - 1)
+    for byte in buffer[offset + 1:offset + length]:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _iter_elements(buffer: bytes, start: int, end: int) -> Iterator[tuple[int, int, int]]:
+    """Элементы EBML: (ID, начало данных, конец данных)."""
+    offset = start
+    while offset < end:
+        element_id, id_length = _read_vint(buffer, offset, keep_marker=True)
+        size, size_length = _read_vint(buffer, offset + id_length, keep_marker=False)
+        data_start = offset + id_length + size_length
+        data_end = end if size is None else min(data_start + size, end)
+        yield element_id, data_start, data_end
+        if size is None:
+            return
+        offset = data_start + size
+
+
+def _uint(buffer: bytes, start: int, end: int) -> int:
+    return int.from_bytes(buffer[start:end], "big") if end > start else 0
+
+
+def _float(buffer: bytes, start: int, end: int) -> Optional[float]:
+    if end - start == 8:
+        return struct.unpack(">d", buffer[start:end])[0]
+    if end - start == 4:
+        return struct.unpack(">f", buffer[start:end])[0]
+    return None
+
+
+def _parse_mkv_track(buffer: bytes, start: int, end: int) -> dict:
+    track: dict = {}
+    for element_id, data_start, data_end in _iter_elements(buffer, start, end):
+        if element_id == MKV_TRACK_TYPE:
+            track["type"] = _uint(buffer, data_start, data_end)
+        elif element_id == MKV_TRACK_NUMBER:
+            track["number"] = _uint(buffer, data_start, data_end)
+        elif element_id == MKV_CODEC_ID:
+            codec_id = buffer[data_start:data_end].rstrip(b"\x00").decode("ascii", "replace")
+            track["codec"] = MKV_CODECS.get(codec_id, codec_id.lower())
+        elif element_id == MKV_VIDEO:
+            for child_id, child_start, child_end in _iter_elements(buffer, data_start, data_end):
+                if child_id == MKV_PIXEL_WIDTH:
+                    track["width"] = _uint(buffer, child_start, child_end)
+                elif child_id == MKV_PIXEL_HEIGHT:
+                    track["height"] = _uint(buffer, child_start, child_end)
+    return track
+
+
+def _read_mkv_header(fh: BinaryIO, file_size: int) -> tuple[dict, dict]:
+    """
+    Метаданные и раскладка начала файла: header_end - смещение первого Cluster
+    (None, если кластеров ещё нет), timestamp_scale, номер видеодорожки.
+    """
+    info = _empty_info("mkv")
+    layout = {"header_end": None, "timestamp_scale": 1_000_000, "video_track": None}
+    fh.seek(0)
+    buffer = fh.read(min(file_size, MAX_MKV_HEADER_BYTES))
+    elements = _iter_elements(buffer, 0, len(buffer))
+    try:
+        element_id, data_start, data_end = next(elements)
+    except StopIteration:
+        raise MediaProbeError("Empty file")
+    if element_id != EBML_HEADER:
+        raise MediaProbeError("Not a Matroska file")
+    for child_id, child_start, child_end in _iter_elements(buffer, data_start, data_end):
+        if child_id == EBML_DOCTYPE:
+            info["container"] = "webm" if buffer[child_start:child_end] == b"webm" else "mkv"
+
+    segment = next((item for item in elements if item[0] == MKV_SEGMENT), None)
+    if segment is None:
+        return info, layout
+    timestamp_scale = 1_000_000
+    duration = None
+    # Элементы сегмента идут подряд: заголовок очередного начинается там, где кончился предыдущий
+    element_offset = segment[1]
+    try:
+        for element_id, data_start, data_end in _iter_elements(buffer, segment[1], segment[2]):
+            if element_id == MKV_CLUSTER:
+                layout["header_end"] = element_offset
+                break
+            element_offset = data_end
+            if element_id == MKV_INFO:
+                for child_id, child_start, child_end in _iter_elements(buffer, data_start, data_end):
+                    if child_id == MKV_TIMESTAMP_SCALE:
+                        timestamp_scale = _uint(buffer, child_start, child_end) or timestamp_scale
+                    elif child_id == MKV_DURATION:
+                        duration = _float(buffer, child_start, child_end)
+                    elif child_id == MKV_DATE_UTC and child_end - child_start == 8:
+                        nanoseconds = struct.unpack(">q", buffer[child_start:child_end])[0]
+                        info["created_at"] = (
+                            _MKV_EPOCH + timedelta(microseconds=nanoseconds // 1000)
+                        ).isoformat()
+            elif element_id == MKV_TRACKS:
+                for child_id, child_start, child_end in _iter_elements(buffer, data_start, data_end):
+                    if child_id != MKV_TRACK_ENTRY:
+                        continue
+                    track = _parse_mkv_track(buffer, child_start, child_end)
+                    if track.get("type") == MKV_TRACK_VIDEO and not info["video_codec"]:
+                        info["video_codec"] = track.get("codec")
+                        info["width"], info["height"] = track.get("width"), track.get("height")
+                        layout["video_track"] = track.get("number")
+                    elif track.get("type") == MKV_TRACK_AUDIO and not info["audio_codec"]:
+                        info["audio_codec"] = track.get("codec")
+    except MediaProbeError:
+        # Заголовок обрезан границей буфера - отдаём то, что успели разобрать
+        pass
+    layout["timestamp_scale"] = timestamp_scale
+    if duration:
+        info["duration_s"] = round(duration * timestamp_scale / 1e9, 3)
+        info["complete"] = True
+    return info, layout
+
+
+def probe_mkv(fh: BinaryIO, file_size: int) -> dict:
+    return _read_mkv_header(fh, file_size)[0]
+
+
+def _cluster_at(buffer: bytes, offset: int, video_track: Optional[int]) -> Optional[tuple[int, bool]]:
+    """
+    Проверяет, что в buffer[offset] действительно начинается Cluster (а не
+    случайное совпадение байт в видеоданных): (timestamp, начинается ли с ключевого кадра).
+    """
+    try:
+        element_id, data_start, data_end = next(_iter_elements(buffer, offset, len(buffer)))
+        if element_id != MKV_CLUSTER:
+            return None
+        children = _iter_elements(buffer, data_start, data_end)
+        child_id, child_start, child_end = next(children)
+        if child_id != MKV_CLUSTER_TIMESTAMP or child_end - child_start > 8:
+            return None
+        timestamp = _uint(buffer, child_start, child_end)
+        for child_id, child_start, child_end in children:
+            if child_id == MKV_BLOCK_GROUP:
+                # В BlockGroup ключевые кадры не помечены флагом - считаем кластер неключевым
+                return timestamp, False
+            if child_id != MKV_SIMPLE_BLOCK:
+                continue
+            track, track_length = _read_vint(buffer, child_start, keep_marker=False)
+            if video_track is not None and track != video_track:
+                continue
+            flags = buffer[child_start + track_length + 2]
+            return timestamp, bool(flags & 0x80)
+    except (MediaProbeError, StopIteration, IndexError):
+        return None
+    return timestamp, False
+
+
+def mkv_live_offsets(fh: BinaryIO, file_size: int, lead_seconds: float, window_bytes: int = 32 * 1024 * 1024) -> dict:
+    """
+    Точки входа для просмотра растущего MKV: header_end - конец заголовка
+    (EBML, Info, Tracks), cluster - начало кластера с ключевым кадром примерно
+    за lead_seconds до конца записанного. cluster None - кластер не найден
+    (файл короткий или без ключевых кадров в хвосте), отдавать с начала.
+    """
+    _info, layout = _read_mkv_header(fh, file_size)
+    header_end = layout["header_end"]
+    result = {"header_end": header_end, "cluster": None, "cluster_timestamp_s": None}
+    if header_end is None:
+        return result
+    start = max(header_end, file_size - window_bytes)
+    fh.seek(start)
+    buffer = fh.read(file_size - start)
+    marker = MKV_CLUSTER.to_bytes(4, "big")
+    clusters = []
+    position = buffer.find(marker)
+    while position != -1:
+        found = _cluster_at(buffer, position, layout["video_track"])
+        if found is not None:
+            clusters.append((start + position, found[0], found[1]))
+        position = buffer.find(marker, position + 4)
+    keyframes = [(offset, timestamp) for offset, timestamp, key in clusters if key]
+    if not keyframes:
+        return result
+    scale = layout["timestamp_scale"] / 1e9
+    newest = max(timestamp for _offset, timestamp, _key in clusters)
+    target = newest - lead_seconds / scale
+    candidates = [item for item in keyframes if item[1] <= target] or keyframes[:1]
+    offset, timestamp = candidates[-1]
+    result["cluster"] = offset
+    result["cluster_timestamp_s"] = round(timestamp * scale, 3)
+    return result
+
+
+def probe_file(path) -> dict:
+    """Метаданные записи; контейнер определяется по сигнатуре, а не по расширению."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        head = fh.read(12)
+        if head[:4] == b"\x1a\x45\xdf\xa3":
+            return probe_mkv(fh, file_size)
+        if head[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide"):
+            return probe_mp4(fh, file_size)
+    raise MediaProbeError("Unknown container")
@@ -0,0 +1,215 @@
+"""
+Перенос moov в начало MP4 (fast start) без перекодирования.
+
+scrcpy пишет moov в конец файла, и браузеру приходится запросить хвост
+файла, прежде чем начать воспроизведение. Здесь moov переставляется сразу
+за ftyp: дерево moov разбирается, смещения чанков в stco/co64 сдвигаются на
+размер moov (stco переводится в co64, если смещения перестают влезать
+в 32 бита), остальные боксы копируются как есть блоками фиксированного
+размера. Результат пишется во временный файл рядом с исходным, проверяется
+и атомарно подменяет исходный.
+"""
+import os
+import shutil
+import struct
+from typing import BinaryIO, Callable, List, Optional
+
+from mkdsc.web.media_probe import MAX_MOOV_BYTES, MediaProbeError, iter_boxes
+
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# Боксы-контейнеры, через которые лежит путь moov -> trak -> ... -> stbl -> stco/co64
+CONTAINER_BOXES = {"moov", "trak", "mdia", "minf", "stbl", "edts", "dinf", "mvex"}
+
+
+class FastStartError(MediaProbeError):
+    """Файл нельзя переупорядочить (фрагментированный MP4, битая структура, нет места)."""
+
+
+class Box:
+    """Бокс moov в памяти: лист хранит payload, контейнер - детей."""
+
+    def __init__(self, kind: str, payload: bytes = b"", children: Optional[List["Box"]] = None):
+        self.kind = kind
+        self.payload = payload
+        self.children = children
+
+    def size(self) -> int:
+        body = sum(child.size() for child in self.children) if self.children is not None else len(self.payload)
+        return 8 + body
+
+    def serialize(self) -> bytes:
+        body = (
+            b"".join(child.serialize() for child in self.children)
+            if self.children is not None else self.payload
+        )
+        return struct.pack(">I4s", 8 + len(body), self.kind.encode("latin-1")) + body
+
+    def walk(self):
+        yield self
+        for child in self.children or ():
+            yield from child.walk()
+
+
+def parse_box_tree(data: bytes, kind: str = "moov") -> Box:
+    """Разбирает тело бокса kind (без заголовка) в дерево Box."""
+    if kind not in CONTAINER_BOXES:
+        return Box(kind, data)
+    children = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, child_kind = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise FastStartError(f"Invalid box inside {kind} at offset {offset}")
+        name = child_kind.decode("latin-1")
+        children.append(parse_box_tree(data[offset + header_size:offset + size], name))
+        offset += size
+    return Box(kind, children=children)
+
+
+def _chunk_offsets(box: Box) -> List[int]:
+    count = struct.unpack_from(">I", box.payload, 4)[0]
+    fmt = ">%dI" % count if box.kind == "stco" else ">%dQ" % count
+    return list(struct.unpack_from(fmt, box.payload, 8))
+
+
+def _shift_offsets(moov: Box, delta: int, force_co64: bool):
+    """Сдвигает смещения всех stco/co64 на delta; при force_co64 переводит stco в co64."""
+    for box in moov.walk():
+        if box.kind not in ("stco", "co64"):
+            continue
+        offsets = [offset + delta for offset in _chunk_offsets(box)]
+        header = box.payload[:4] + struct.pack(">I", len(offsets))
+        if box.kind == "co64" or force_co64:
+            box.kind = "co64"
+            box.payload = header + struct.pack(">%dQ" % len(offsets), *offsets)
+        else:
+            box.payload = header + struct.pack(">%dI" % len(offsets), *offsets)
+
+
+def _max_chunk_offset(moov: Box) -> int:
+    return max(
+        (max(_chunk_offsets(box), default=0) for box in moov.walk() if box.kind in ("stco", "co64")),
+        default=0,
+    )
+
+
+def _layout(fh: BinaryIO, file_size: int) -> list:
+    boxes = list(iter_boxes(fh, 0, file_size))
+    kinds = [kind for kind, _start, _end in boxes]
+    if "moof" in kinds:
+        raise FastStartError("Fragmented MP4 is already streamable")
+    if kinds.count("moov") != 1 or "mdat" not in kinds:
+        raise FastStartError("Expected exactly one moov and at least one mdat")
+    return boxes
+
+
+def needs_faststart(path) -> bool:
+    """True, если moov лежит после mdat (обычный файл scrcpy)."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        try:
+            kinds = [kind for kind, _start, _end in iter_boxes(fh, 0, file_size)]
+        except MediaProbeError:
+            return False
+    if "moov" not in kinds or "mdat" not in kinds or "moof" in kinds:
+        return False
+    return kinds.index("moov") > kinds.index("mdat")
+
+
+def _copy_range(src: BinaryIO, dst: BinaryIO, start: int, end: int, throttle: Optional[Callable[[int], None]]):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        block = src.read(min(COPY_CHUNK_BYTES, remaining))
+        if not block:
+            raise FastStartError("Unexpected end of file")
+        if throttle:
+            throttle(len(block))
+        dst.write(block)
+        remaining -= len(block)
+
+
+def _verify(src: BinaryIO, dst: BinaryIO, old: List[int], new: List[int]):
+    """Первые байты нескольких чанков должны совпасть по старым и новым смещениям."""
+    step = max(1, len(old) // 8)
+    for old_offset, new_offset in list(zip(old, new))[::step]:
+        src.seek(old_offset)
+        dst.seek(new_offset)
+        if src.read(64) != dst.read(64):
+            raise FastStartError("Chunk data mismatch after rewrite")
+
+
+def faststart(path, throttle: Optional[Callable[[int], None]] = None) -> dict:
+    """
+    Переносит moov в начало файла path на месте. throttle(n) вызывается перед
+    записью каждого блока (ограничение скорости диска). Возвращает сводку.
+    """
+    path = os.fspath(path)
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as src:
+        boxes = _layout(src, file_size)
+        moov_index = next(index for index, item in enumerate(boxes) if item[0] == "moov")
+        mdat_index = next(index for index, item in enumerate(boxes) if item[0] == "mdat")
+        if moov_index < mdat_index:
+            return {"changed": False, "reason": "already_faststart", "size_bytes": file_size}
+
+        _kind, moov_start, moov_end = boxes[moov_index]
+        if moov_end - moov_start > MAX_MOOV_BYTES:
+            raise FastStartError("moov box is too large")
+        src.seek(moov_start)
+        raw = src.read(moov_end - moov_start)
+        header_size = 16 if struct.unpack_from(">I", raw)[0] == 1 else 8
+        moov = parse_box_tree(raw[header_size:])
+        old_offsets = [offset for box in moov.walk() if box.kind in ("stco", "co64") for offset in _chunk_offsets(box)]
+
+        # moov встаёт сразу после ftyp (и других боксов перед первым mdat)
+        insert_at = boxes[mdat_index][1]
+        # scrcpy пишет moov последним; иначе пришлось бы сдвигать и данные за ним
+        if any(start >= moov_end for _kind, start, _end in boxes):
+            raise FastStartError("Boxes after moov are not supported")
+        force_co64 = False
+        delta = moov.size()
+        if _max_chunk_offset(moov) + delta >= 1 << 32:
+            force_co64 = True
+        _shift_offsets(moov, 0, force_co64)
+        delta = moov.size()
+        _shift_offsets(moov, delta, False)
+        new_moov = moov.serialize()
+        new_offsets = [offset for box in moov.walk() if box.kind in ("stco", "co64") for offset in _chunk_offsets(box)]
+
+        directory = os.path.dirname(path) or "."
+        if shutil.disk_usage(directory).free < file_size + COPY_CHUNK_BYTES:
+            raise FastStartError("Not enough free space for the rewrite")
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.faststart.tmp")
+        try:
+            with open(tmp_path, "w+b") as dst:
+                _copy_range(src, dst, 0, insert_at, throttle)
+                dst.write(new_moov)
+                for _kind, start, end in boxes[mdat_index:moov_index]:
+                    _copy_range(src, dst, start, end, throttle)
+                dst.flush()
+                os.fsync(dst.fileno())
+                _verify(src, dst, old_offsets, new_offsets)
+            stat_result = os.stat(path)
+            # Возраст файла для политики хранения не должен сброситься
+            os.utime(tmp_path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    os.replace(tmp_path, path)
+    return {
+        "changed": True,
+        "moov_bytes": len(new_moov),
+        "co64": force_co64,
+        "size_bytes": os.path.getsize(path),
+    }
@@ -0,0 +1,116 @@
+"""
+Телеметрия дочерних процессов: fps из вывода scrcpy и CPU/RSS процесса.
+
+scrcpy с --print-fps раз в секунду пишет "INFO: 60 fps" (или
+"INFO: 58 fps (+2 frames skipped)"). Такие строки не попадают в буфер вывода,
+а разбираются в метрики. Раз в секунду супервизор добавляет в кольцевой буфер
+процесса отсчёт: последний fps, пропущенные кадры за интервал, загрузка CPU
+и RSS процесса из /proc (на системах без /proc эти поля - None).
+"""
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, List, Optional
+
+# 10 минут истории при отсчёте раз в секунду
+METRICS_HISTORY_POINTS = 600
+SAMPLE_INTERVAL_SECONDS = 1.0
+# scrcpy печатает fps раз в секунду; более старое значение считаем устаревшим
+FPS_STALE_SECONDS = 2.5
+SUMMARY_WINDOW_SECONDS = 10
+
+try:
+    CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    CLOCK_TICKS = 100
+    PAGE_SIZE = 4096
+
+FpsParser = Callable[[str], Optional[tuple]]
+
+
+def read_proc_usage(pid: int) -> Optional[tuple[float, int]]:
+    """(CPU-время процесса в секундах, RSS в байтах) из /proc/<pid>/stat или None."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    # Имя процесса в скобках может содержать пробелы - поля считаем после последней ')'
+    fields = data[data.rindex(b")") + 2:].split()
+    try:
+        utime, stime, rss_pages = int(fields[11]), int(fields[12]), int(fields[21])
+    except (IndexError, ValueError):
+        return None
+    return (utime + stime) / CLOCK_TICKS, rss_pages * PAGE_SIZE
+
+
+class ProcessMetrics:
+    """Кольцевой буфер отсчётов одного процесса."""
+
+    def __init__(self, fps_parser: Optional[FpsParser] = None, history: int = METRICS_HISTORY_POINTS):
+        self.fps_parser = fps_parser
+        self.samples = deque(maxlen=history)
+        self.fps: Optional[int] = None
+        self.fps_monotonic: Optional[float] = None
+        self.frames_skipped = 0
+        self._skipped_since_sample = 0
+        self._last_cpu: Optional[tuple[float, float]] = None
+
+    def feed(self, line: str) -> bool:
+        """Разбирает строку вывода; True - строка была отчётом fps."""
+        if self.fps_parser is None:
+            return False
+        parsed = self.fps_parser(line)
+        if parsed is None:
+            return False
+        self.fps, skipped = parsed
+        self.fps_monotonic = time.monotonic()
+        self.frames_skipped += skipped
+        self._skipped_since_sample += skipped
+        return True
+
+    def sample(self, pid: Optional[int]) -> dict:
+        now = time.monotonic()
+        fresh = self.fps_monotonic is not None and now - self.fps_monotonic <= FPS_STALE_SECONDS
+        point = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "fps": self.fps if fresh else None,
+            "skipped": self._skipped_since_sample,
+            "cpu_percent": None,
+            "rss_mb": None,
+        }
+        self._skipped_since_sample = 0
+        usage = read_proc_usage(pid) if pid else None
+        if usage is not None:
+            cpu_seconds, rss_bytes = usage
+            if self._last_cpu is not None and now > self._last_cpu[1]:
+                point["cpu_percent"] = round(
+                    max(0.0, cpu_seconds - self._last_cpu[0]) / (now - self._last_cpu[1]) * 100, 1
+                )
+            self._last_cpu = (cpu_seconds, now)
+            point["rss_mb"] = round(rss_bytes / (1024 * 1024), 1)
+        self.samples.append(point)
+        return point
+
+    def series(self, seconds: Optional[int] = None) -> List[dict]:
+        points = list(self.samples)
+        if seconds:
+            points = points[-max(1, int(seconds / SAMPLE_INTERVAL_SECONDS)):]
+        return points
+
+    def summary(self, window_seconds: int = SUMMARY_WINDOW_SECONDS) -> dict:
+        """Последний отсчёт и средний/минимальный fps за окно."""
+        window = self.series(window_seconds)
+        fps_values = [point["fps"] for point in window if point["fps"] is not None]
+        latest = window[-1] if window else {}
+        return {
+            "fps": latest.get("fps"),
+            "fps_avg": round(sum(fps_values) / len(fps_values), 1) if fps_values else None,
+            "fps_min": min(fps_values) if fps_values else None,
+            "frames_skipped": self.frames_skipped,
+            "cpu_percent": latest.get("cpu_percent"),
+            "rss_mb": latest.get("rss_mb"),
+            "samples": len(self.samples),
+        }
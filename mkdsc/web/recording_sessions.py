@@ -0,0 +1,445 @@
+"""
+Реестр одновременных записей scrcpy и бюджет ресурсов хоста.
+
+Каждая запись - отдельная сессия со своим session_id; на одном устройстве
+(serial) одновременно идёт не больше одной записи. Перед запуском сессия
+резервирует ресурсы хоста:
+- CPU-слоты (только если задан max_sessions): запись без окна только
+  муксирует поток (1 слот), с окном предпросмотра ещё и декодирует видео
+  (2 слота); одна запись на свободном хосте разрешена всегда. По умолчанию
+  (max_sessions = 0) CPU не ограничивается - дешёвые записи без окна
+  упираются в диск, а не в процессор;
+- скорость записи на диск: битрейт видео + аудио по всем сессиям
+  не больше max_write_mbps (0 - без ограничения);
+- свободное место в директории записи - не меньше min_free_mb.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+RECENT_SESSIONS_LIMIT = 50
+PREVIEW_CPU_SLOTS = 2
+# Битрейт аудио scrcpy по умолчанию (--audio-bit-rate)
+AUDIO_BITRATE_BPS = 128_000
+ACTIVE_STATES = ("starting", "recording", "stopping")
+
+DEFAULT_BUDGET_CONFIG = {
+    "max_sessions": 0,
+    "max_write_mbps": 0,
+    "min_free_mb": 1024,
+}
+
+_BITRATE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)\s*$")
+_BITRATE_UNITS = {"": 1, "k": 1_000, "m": 1_000_000, "g": 1_000_000_000}
+# <base>_seg0001.mkv -> индекс <base>.segments.json (см. RecordingSession.segment_path)
+_SEGMENT_NAME_RE = re.compile(r"^(?P<base>.+)_seg\d{4}\.[^.]+$")
+SEGMENT_INDEX_SUFFIX = ".segments.json"
+
+
+class SessionConflict(Exception):
+    """На устройстве уже идёт запись."""
+
+
+class BudgetExceeded(Exception):
+    """Новая сессия не укладывается в бюджет ресурсов хоста."""
+
+
+def parse_bitrate(value) -> int:
+    """'8M' -> 8000000 бит/с (формат --video-bit-rate scrcpy)."""
+    match = _BITRATE_RE.match(str(value or ""))
+    if not match:
+        return 0
+    return int(float(match.group(1)) * _BITRATE_UNITS[match.group(2).lower()])
+
+
+def _write_json_atomic(path: str, payload: dict):
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as target:
+            json.dump(payload, target, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def segment_index_path(path: str) -> Optional[str]:
+    """Путь к индексу сегментов, которому принадлежит файл, или None, если это не сегмент."""
+    directory, name = os.path.split(str(path))
+    match = _SEGMENT_NAME_RE.match(name)
+    if not match:
+        return None
+    return os.path.join(directory, f"{match.group('base')}{SEGMENT_INDEX_SUFFIX}")
+
+
+class RecordingSession:
+    """Одна запись: параметры запуска, процесс и итог."""
+
+    def __init__(self, plan: dict, group_id: Optional[str] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.group_id = group_id
+        self.serial = plan["settings"].get("serial")
+        self.cmd: List[str] = plan["cmd"]
+        self.output_path: str = plan["output_path"]
+        self.filename: str = plan["filename"]
+        self.settings: dict = plan["settings"]
+        self.stay_awake = bool(plan.get("stay_awake"))
+        self.show_touches = bool(plan.get("show_touches"))
+        self.cpu_slots = PREVIEW_CPU_SLOTS if self.settings.get("show_preview") else 1
+        self.write_bps = plan.get("write_bps", 0)
+        self.state = "starting"
+        # ManagedProcess супервизора (mkdsc.web.supervisor)
+        self.process = None
+        self.restore: dict = {}
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.exit_code: Optional[int] = None
+        self.last_error: Optional[dict] = None
+        # Итог ожидания готовности: состояние, тайминги вех запуска scrcpy
+        self.startup: Optional[dict] = None
+        # Сегментированная запись: параметры ротации, индекс сегментов и задача-контроллер
+        self.segmentation: Optional[dict] = plan.get("segmentation")
+        self.segments: List[dict] = []
+        self.index_path: Optional[str] = plan.get("index_path")
+        self.task = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in ACTIVE_STATES
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def launched_monotonic(self) -> Optional[float]:
+        return self.process.started_monotonic if self.process else None
+
+    def output_tail(self, lines: int = 10) -> List[str]:
+        return self.process.tail(lines) if self.process else []
+
+    def segment_path(self, number: int) -> str:
+        base, ext = os.path.splitext(self.filename)
+        return os.path.join(os.path.dirname(self.output_path), f"{base}_seg{number:04d}{ext}")
+
+    def open_segment(self, path: str) -> dict:
+        segment = {
+            "index": len(self.segments) + 1,
+            "filename": os.path.basename(path),
+            "started_at": datetime.now().isoformat(),
+            "ended_at": None,
+            "duration_s": None,
+            "size_bytes": None,
+            "exit_code": None,
+            "deleted": False,
+        }
+        self.segments.append(segment)
+        self.output_path = path
+        self.write_index()
+        return segment
+
+    def close_segment(self, segment: dict, exit_code: Optional[int], duration: Optional[float]):
+        segment["ended_at"] = datetime.now().isoformat()
+        segment["duration_s"] = duration
+        segment["exit_code"] = exit_code
+        try:
+            segment["size_bytes"] = os.stat(self.segment_file(segment)).st_size
+        except OSError:
+            segment["size_bytes"] = 0
+        self.write_index()
+
+    def segment_file(self, segment: dict) -> str:
+        return os.path.join(os.path.dirname(self.output_path), segment["filename"])
+
+    def prune_segments(self, window_seconds: float) -> List[str]:
+        """Скользящее окно: удаляет завершённые сегменты, закончившиеся раньше чем window_seconds назад."""
+        cutoff = datetime.now().timestamp() - window_seconds
+        removed = []
+        for segment in self.segments:
+            if segment["deleted"] or not segment["ended_at"]:
+                continue
+            if datetime.fromisoformat(segment["ended_at"]).timestamp() >= cutoff:
+                continue
+            try:
+                os.unlink(self.segment_file(segment))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            segment["deleted"] = True
+            removed.append(segment["filename"])
+        if removed:
+            self.write_index()
+        return removed
+
+    def segment_index(self) -> dict:
+        return {
+            "session_id": self.id,
+            "serial": self.serial,
+            "format": self.settings.get("format"),
+            "segmentation": self.segmentation,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "segments": self.segments,
+        }
+
+    def write_index(self):
+        """Индекс сегментов рядом с файлами (JSON, атомарная замена)."""
+        if not self.index_path:
+            return
+        _write_json_atomic(self.index_path, self.segment_index())
+
+    def live_segment_files(self) -> List[str]:
+        return [self.segment_file(segment) for segment in self.segments if not segment["deleted"]]
+
+    def _written_bytes(self) -> Optional[int]:
+        try:
+            return os.stat(self.output_path).st_size
+        except OSError:
+            return None
+
+    def snapshot(self) -> dict:
+        written = self._written_bytes()
+        uptime = self.process.uptime if self.process else None
+        payload = {
+            "session_id": self.id,
+            "group_id": self.group_id,
+            "state": self.state,
+            "active": self.active,
+            "pid": self.pid,
+            "process_id": self.process.id if self.process else None,
+            "serial": self.serial,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "uptime_s": uptime,
+            "output_path": self.output_path,
+            "filename": self.filename,
+            "settings": self.settings,
+            "written_bytes": written,
+            "write_mbps": round(written * 8 / uptime / 1_000_000, 2) if written and uptime else None,
+            "exit_code": self.exit_code,
+            "startup": self.startup,
+        }
+        if self.process is not None and self.process.metrics is not None:
+            payload["metrics"] = self.process.metrics.summary()
+        if self.segmentation:
+            live = [segment for segment in self.segments if not segment["deleted"]]
+            payload["segmentation"] = self.segmentation
+            payload["segments"] = {
+                "count": len(self.segments),
+                "kept": len(live),
+                "current": self.segments[-1]["filename"] if self.segments and self.active else None,
+                "index_path": self.index_path,
+            }
+        if self.last_error:
+            payload["last_error"] = self.last_error
+        return payload
+
+
+class RecordingManager:
+    """Потокобезопасный реестр сессий записи."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: dict = {}
+        self._recent = deque(maxlen=RECENT_SESSIONS_LIMIT)
+
+    def active(self) -> List[RecordingSession]:
+        with self._lock:
+            return [session for session in self._sessions.values() if session.active]
+
+    def recent(self) -> List[RecordingSession]:
+        with self._lock:
+            return list(self._recent)
+
+    def get(self, session_id: str) -> Optional[RecordingSession]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = next((item for item in self._recent if item.id == session_id), None)
+        return session
+
+    def for_process(self, process) -> Optional[RecordingSession]:
+        """Активная сессия, которой принадлежит процесс (текущий сегмент), или None."""
+        return next((session for session in self.active() if session.process is process), None)
+
+    def group(self, group_id: str) -> List[RecordingSession]:
+        with self._lock:
+            sessions = list(self._sessions.values()) + list(self._recent)
+        return [session for session in sessions if session.group_id == group_id]
+
+    def output_paths(self) -> List[str]:
+        return [session.output_path for session in self.active()]
+
+    def protected_paths(self) -> List[str]:
+        """Файлы активных записей: текущий файл и ещё не удалённые сегменты скользящего окна."""
+        paths = []
+        for session in self.active():
+            paths.append(session.output_path)
+            if session.segmentation:
+                paths.extend(session.live_segment_files())
+        return paths
+
+    def forget_segment_files(self, paths: Iterable[str]) -> List[str]:
+        """
+        Отмечает в индексах сегментов файлы, удалённые вне сессии (retention, библиотека записей).
+
+        Индекс, в котором не осталось ни одного сегмента на диске, удаляется.
+        Возвращает пути удалённых индексов.
+        """
+        by_index: dict = {}
+        for path in paths:
+            index_path = segment_index_path(path)
+            if index_path:
+                by_index.setdefault(index_path, set()).add(os.path.basename(str(path)))
+        if not by_index:
+            return []
+
+        removed = []
+        active = {session.index_path: session for session in self.active() if session.index_path}
+        for index_path, names in by_index.items():
+            session = active.get(index_path)
+            if session is not None:
+                # Индекс активной сессии пишет она сама - правим её состояние, а не файл
+                for segment in session.segments:
+                    if segment["filename"] in names:
+                        segment["deleted"] = True
+                session.write_index()
+                continue
+            try:
+                with open(index_path, encoding="utf-8") as source:
+                    payload = json.load(source)
+            except (OSError, ValueError):
+                continue
+            directory = os.path.dirname(index_path)
+            segments = payload.get("segments") or []
+            for segment in segments:
+                filename = segment.get("filename") or ""
+                if filename in names or not os.path.exists(os.path.join(directory, filename)):
+                    segment["deleted"] = True
+            try:
+                if all(segment["deleted"] for segment in segments):
+                    os.unlink(index_path)
+                    removed.append(index_path)
+                else:
+                    _write_json_atomic(index_path, payload)
+            except OSError:
+                continue
+        return removed
+
+    @staticmethod
+    def _limits(config: Optional[dict]) -> dict:
+        recording_cfg = (config or {}).get("recording", {})
+        limits = dict(DEFAULT_BUDGET_CONFIG)
+        limits.update({key: recording_cfg[key] for key in DEFAULT_BUDGET_CONFIG if key in recording_cfg})
+        return limits
+
+    @staticmethod
+    def _cpu_slots(limits: dict) -> Optional[int]:
+        """Лимит CPU-слотов; None - без ограничения (max_sessions = 0)."""
+        return int(limits["max_sessions"] or 0) or None
+
+    def budget(self, config: Optional[dict]) -> dict:
+        limits = self._limits(config)
+        sessions = self.active()
+        cpu_total = self._cpu_slots(limits)
+        write_limit = float(limits["max_write_mbps"] or 0)
+        measured = [session.snapshot()["write_mbps"] for session in sessions]
+        return {
+            "sessions": len(sessions),
+            "cpu_slots": cpu_total,
+            "cpu_slots_used": sum(session.cpu_slots for session in sessions),
+            "write_mbps_limit": write_limit or None,
+            "write_mbps_reserved": round(sum(session.write_bps for session in sessions) / 1_000_000, 2),
+            "write_mbps_measured": round(sum(value for value in measured if value), 2),
+            "min_free_mb": limits["min_free_mb"],
+        }
+
+    def reserve(self, plans: List[dict], config: Optional[dict], group_id: Optional[str] = None) -> List[RecordingSession]:
+        """
+        Регистрирует сессии в состоянии starting, если все они укладываются в бюджет.
+
+        Группа резервируется целиком или не резервируется совсем.
+        """
+        limits = self._limits(config)
+        candidates = [RecordingSession(plan, group_id) for plan in plans]
+
+        min_free = float(limits["min_free_mb"] or 0) * 1024 * 1024
+        if min_free:
+            for directory in {os.path.dirname(session.output_path) for session in candidates}:
+                free = shutil.disk_usage(directory).free
+                if free < min_free:
+                    raise BudgetExceeded(
+                        f"Not enough free space in {directory}: {free // (1024 * 1024)} MB left"
+                    )
+
+        with self._lock:
+            active = [session for session in self._sessions.values() if session.active]
+            busy = {session.serial for session in active}
+            requested = set()
+            for session in candidates:
+                # Без serial scrcpy сам выбирает устройство - такие записи не различить
+                key = session.serial
+                if key in busy or key in requested or (key is None and active):
+                    raise SessionConflict(f"Recording already active on {key or 'the default device'}")
+                requested.add(key)
+
+            cpu_total = self._cpu_slots(limits)
+            cpu_needed = sum(session.cpu_slots for session in active + candidates)
+            # Одна запись на свободном хосте разрешена всегда - как до появления бюджета
+            if cpu_total and cpu_needed > cpu_total and (active or len(candidates) > 1):
+                raise BudgetExceeded(f"CPU budget exceeded: {cpu_needed} of {cpu_total} slots")
+
+            write_limit = float(limits["max_write_mbps"] or 0) * 1_000_000
+            write_needed = sum(session.write_bps for session in active + candidates)
+            if write_limit and write_needed > write_limit:
+                raise BudgetExceeded(
+                    f"Disk write budget exceeded: {write_needed / 1_000_000:.1f} of "
+                    f"{write_limit / 1_000_000:.1f} Mbit/s"
+                )
+
+            for session in candidates:
+                self._sessions[session.id] = session
+        return candidates
+
+    @staticmethod
+    def mark_started(session: RecordingSession, process):
+        session.process = process
+        session.started_at = process.started_at
+        session.state = "recording"
+
+    def finish(self, session: RecordingSession, exit_code: Optional[int], error: Optional[str] = None):
+        """Переносит сессию в недавние; ненулевой код без запроса остановки - ошибка."""
+        session.exit_code = exit_code
+        session.finished_at = datetime.now().isoformat()
+        failed = error is not None or (exit_code not in (0, None) and session.state != "stopping")
+        session.state = "failed" if failed else "finished"
+        if failed:
+            session.last_error = {
+                "exit_code": exit_code,
+                "timestamp": session.finished_at,
+            }
+            output = error or "\n".join(session.output_tail())
+            if output:
+                session.last_error["output"] = output
+        with self._lock:
+            self._sessions.pop(session.id, None)
+            self._recent.append(session)
+
+    @staticmethod
+    def mark_stopping(session: RecordingSession) -> bool:
+        if session.process is None or not session.active:
+            return False
+        session.state = "stopping"
+        return True
+
+
+manager = RecordingManager()
@@ -0,0 +1,765 @@
+"""
+Библиотека записей экрана.
+
+Индекс (SQLite в DATA_DIR) хранит для каждого файла директории записей
+размер, длительность, кодеки, разрешение, serial устройства и время начала.
+Метаданные читаются из заголовков MP4/MKV (media_probe), без ffprobe.
+Индекс обновляется точечно: сервер сообщает о завершении каждой записи
+(и каждого сегмента), а DirectoryWatcher подхватывает новые и удалённые
+файлы - в том числе идущую запись, которая до завершения остаётся в индексе
+с начальным размером и complete=0. Serial и время начала для чужих файлов
+берутся из имени ({prefix}_{serial}_{YYYYmmdd_HHMMSS}.mp4) или из mtime.
+
+Воспроизведение - FileResponse с поддержкой Range: браузер перематывает
+многогигабайтный файл запросами диапазонов, сервер ничего не буферизует.
+Если ASGI-сервер поддерживает расширение http.response.pathsend, файл
+отдаётся им целиком (sendfile).
+
+Идущую запись в MKV можно смотреть, не подключая к устройству второй scrcpy:
+/live/{session_id} отдаёт растущий файл с начала или с недавнего кластера
+с ключевым кадром и держит ответ открытым, пока сессия пишет этот файл.
+
+scrcpy пишет moov в конец MP4, поэтому готовые записи в фоне переписываются
+с moov в начале (mp4_faststart) - плеер начинает воспроизведение по первому
+же диапазону, не запрашивая хвост файла.
+
+Эндпоинты:
+- GET /api/recordings - список записей от новых к старым (keyset-пагинация)
+- POST /api/recordings/rescan - сверить индекс с директорией
+- GET /api/recordings/live/{session_id} - идущая MKV-запись по мере записи
+- GET /api/recordings/postprocess - очередь переноса moov в начало файлов
+- POST /api/recordings/faststart - поставить в очередь все MP4 библиотеки
+- POST /api/recordings/{id}/faststart - поставить в очередь одну запись
+- GET /api/recordings/{id} - метаданные записи
+- GET /api/recordings/{id}/stream - файл записи (Range-запросы)
+- DELETE /api/recordings/{id} - удалить запись
+"""
+import asyncio
+import hashlib
+import os
+import queue
+import re
+import sqlite3
+import struct
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from mkdsc.config import load_config
+from mkdsc.paths import DATA_DIR, get_recordings_dir
+from mkdsc.web.dir_watcher import DirectoryWatcher
+from mkdsc.web.gallery_index import decode_cursor, encode_cursor
+from mkdsc.web.media_probe import MediaProbeError, mkv_live_offsets, probe_file
+from mkdsc.web.mp4_faststart import FastStartError, faststart, needs_faststart
+from mkdsc.web.recording_sessions import manager as recording_manager
+from mkdsc.web.transfer_qos import TokenBucket
+
+router = APIRouter(prefix="/api/recordings", tags=["recordings"])
+
+RECORDING_SUFFIXES = (".mp4", ".mkv")
+WATCH_INTERVAL_SECONDS = 3.0
+MEDIA_TYPES = {".mp4": "video/mp4", ".mkv": "video/x-matroska"}
+# Без pathsend FileResponse читает файл в пуле потоков - крупные блоки вместо 64 КБ
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+# Просмотр идущей MKV-записи: как часто проверять рост файла и каким блоком читать
+LIVE_POLL_SECONDS = 0.25
+LIVE_CHUNK_BYTES = 256 * 1024
+LIVE_FILE_WAIT_SECONDS = 10.0
+
+# Время начала из имени файла, которое даёт _build_recording_plan (и его сегментов)
+_FILENAME_TIME_RE = re.compile(r"_(\d{8}_\d{6})(?:_seg\d{4})?\.\w+$")
+
+COLUMNS = (
+    "id",
+    "filename",
+    "size_bytes",
+    "mtime",
+    "container",
+    "duration_s",
+    "video_codec",
+    "audio_codec",
+    "width",
+    "height",
+    "device_serial",
+    "started_at",
+    "session_id",
+    "complete",
+    "probe_error",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS recordings (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL UNIQUE,
+    size_bytes INTEGER NOT NULL DEFAULT 0,
+    mtime REAL NOT NULL DEFAULT 0,
+    container TEXT,
+    duration_s REAL,
+    video_codec TEXT,
+    audio_codec TEXT,
+    width INTEGER,
+    height INTEGER,
+    device_serial TEXT,
+    started_at TEXT NOT NULL,
+    session_id TEXT,
+    complete INTEGER NOT NULL DEFAULT 0,
+    probe_error TEXT
+);
+CREATE INDEX IF NOT EXISTS recordings_listing ON recordings (started_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS recordings_serial ON recordings (device_serial, started_at DESC);
+"""
+
+_INDEX: Optional["RecordingsIndex"] = None
+_WATCHER: Optional[DirectoryWatcher] = None
+_INDEX_LOCK = threading.Lock()
+
+
+def recording_id(filename: str) -> str:
+    """Стабильный ID записи: не зависит от базы и совпадает после пересоздания индекса."""
+    return hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+
+
+def recordings_root(config: Optional[dict] = None) -> Path:
+    config = config if config is not None else load_config()
+    output_dir = config.get("recording", {}).get("output_dir") or str(get_recordings_dir(config))
+    return Path(output_dir).expanduser()
+
+
+class RecordingsIndex:
+    """Потокобезопасная обёртка над одним соединением SQLite."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def use_root(self, root: Path):
+        """Индекс относится к одной директории: при смене пути в настройках он очищается."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'root'").fetchone()
+            if row and row["value"] == str(root):
+                return
+            self._conn.execute("DELETE FROM recordings")
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('root', ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (str(root),),
+            )
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> dict:
+        entry = {name: row[name] for name in COLUMNS}
+        entry["complete"] = bool(entry["complete"])
+        return entry
+
+    def upsert(self, entries: List[dict]):
+        """
+        Добавляет или обновляет записи. Сведения от сервера (serial, сессия,
+        время начала) не затираются повторным разбором того же файла.
+        """
+        if not entries:
+            return
+        params = [tuple(entry.get(name) for name in COLUMNS) for entry in entries]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    f"INSERT INTO recordings ({', '.join(COLUMNS)}) "
+                    f"VALUES ({', '.join('?' for _ in COLUMNS)}) "
+                    "ON CONFLICT(id) DO UPDATE SET "
+                    "size_bytes = excluded.size_bytes, mtime = excluded.mtime, "
+                    "container = excluded.container, duration_s = excluded.duration_s, "
+                    "video_codec = excluded.video_codec, audio_codec = excluded.audio_codec, "
+                    "width = excluded.width, height = excluded.height, "
+                    "complete = excluded.complete, probe_error = excluded.probe_error, "
+                    "device_serial = IFNULL(excluded.device_serial, recordings.device_serial), "
+                    "session_id = IFNULL(excluded.session_id, recordings.session_id), "
+                    "started_at = CASE WHEN excluded.session_id IS NOT NULL "
+                    "THEN excluded.started_at ELSE recordings.started_at END",
+                    params,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete_names(self, names: Iterable[str]) -> int:
+        ids = [recording_id(name) for name in names]
+        deleted = 0
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" for _ in chunk)
+                deleted += self._conn.execute(
+                    f"DELETE FROM recordings WHERE id IN ({placeholders})", chunk
+                ).rowcount
+        return deleted
+
+    def get(self, entry_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM recordings WHERE id = ?", (entry_id,)).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def file_stats(self) -> dict:
+        """filename -> (size_bytes, mtime) для сверки с директорией."""
+        with self._lock:
+            rows = self._conn.execute("SELECT filename, size_bytes, mtime FROM recordings").fetchall()
+        return {row["filename"]: (row["size_bytes"], row["mtime"]) for row in rows}
+
+    def count(self, serial: Optional[str] = None) -> int:
+        sql = "SELECT COUNT(*) FROM recordings"
+        params: tuple = ()
+        if serial is not None:
+            sql += " WHERE device_serial = ?"
+            params = (serial,)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()[0]
+
+    def totals(self) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS count, IFNULL(SUM(size_bytes), 0) AS size_bytes, "
+                "IFNULL(SUM(duration_s), 0) AS duration_s FROM recordings"
+            ).fetchone()
+        return {"count": row["count"], "size_bytes": row["size_bytes"], "duration_s": round(row["duration_s"], 3)}
+
+    def list_page(
+        self, limit: int, cursor: Optional[str] = None, serial: Optional[str] = None
+    ) -> tuple[List[dict], Optional[str]]:
+        """Страница записей от новых к старым по индексу (started_at, id)."""
+        where = []
+        params: list = []
+        if serial is not None:
+            where.append("device_serial = ?")
+            params.append(serial)
+        if cursor:
+            started_at, entry_id = decode_cursor(cursor)
+            where.append("(started_at, id) < (?, ?)")
+            params.extend([started_at, entry_id])
+        sql = "SELECT * FROM recordings"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        sql += " ORDER BY started_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        entries = [self._row_to_entry(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and entries:
+            next_cursor = encode_cursor(entries[-1]["started_at"], entries[-1]["id"])
+        return entries, next_cursor
+
+
+def _started_from_name(filename: str) -> Optional[str]:
+    match = _FILENAME_TIME_RE.search(filename)
+    if not match:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").isoformat()
+    except ValueError:
+        return None
+
+
+def _session_details(path: Path) -> tuple:
+    """(serial, время начала, session_id) активной записи в этот файл - для файлов, найденных watcher'ом."""
+    for session in recording_manager.active():
+        if Path(session.output_path) != path:
+            continue
+        started_at = session.segments[-1]["started_at"] if session.segments else session.started_at
+        return session.serial, started_at, session.id
+    return None, None, None
+
+
+def _probe_entry(
+    root: Path,
+    filename: str,
+    serial: Optional[str] = None,
+    started_at: Optional[str] = None,
+    session_id: Optional[str] = None,
+) -> Optional[dict]:
+    """Запись индекса для файла: stat + разбор заголовка. None - файла уже нет."""
+    path = root / filename
+    try:
+        stat_result = path.stat()
+    except OSError:
+        return None
+    if session_id is None:
+        serial, started_at, session_id = _session_details(path)
+    entry = {
+        "id": recording_id(filename),
+        "filename": filename,
+        "size_bytes": stat_result.st_size,
+        "mtime": stat_result.st_mtime,
+        "device_serial": serial,
+        "session_id": session_id,
+        "probe_error": None,
+    }
+    try:
+        info = probe_file(path)
+    except (MediaProbeError, OSError, struct.error) as exc:
+        info = {"container": path.suffix.lstrip(".").lower(), "complete": False}
+        entry["probe_error"] = str(exc)
+    entry.update({name: info.get(name) for name in COLUMNS if name in info})
+    entry["complete"] = 1 if info.get("complete") else 0
+    if not started_at:
+        duration = info.get("duration_s") or 0
+        started_at = (
+            _started_from_name(filename)
+            or datetime.fromtimestamp(stat_result.st_mtime - duration).isoformat()
+        )
+    entry["started_at"] = started_at
+    return entry
+
+
+def _reconcile(index: RecordingsIndex, root: Path, names: set):
+    """Досчитывает новые и изменившиеся файлы, удаляет записи об исчезнувших."""
+    known = index.file_stats()
+    index.delete_names(set(known) - names)
+    entries = []
+    for name in names:
+        try:
+            stat_result = (root / name).stat()
+        except OSError:
+            continue
+        if known.get(name) == (stat_result.st_size, stat_result.st_mtime):
+            continue
+        entry = _probe_entry(root, name)
+        if entry:
+            entries.append(entry)
+    index.upsert(entries)
+    return len(entries)
+
+
+def _on_files_changed(index: RecordingsIndex, root: Path, added: set, removed: set):
+    index.delete_names(removed)
+    index.upsert([entry for entry in (_probe_entry(root, name) for name in added) if entry])
+
+
+def get_library() -> tuple[RecordingsIndex, Path]:
+    """
+    Индекс и директория записей. При первом обращении сверяет индекс с диском
+    и запускает DirectoryWatcher; при смене директории в настройках - переоткрывает.
+    """
+    global _INDEX, _WATCHER
+    root = recordings_root()
+    with _INDEX_LOCK:
+        if _INDEX is not None and _WATCHER is not None and _WATCHER.root == root:
+            return _INDEX, root
+        if _WATCHER is not None:
+            _WATCHER.stop()
+        if _INDEX is None:
+            _INDEX = RecordingsIndex(DATA_DIR / "recordings.db")
+        index = _INDEX
+        index.use_root(root)
+        root.mkdir(parents=True, exist_ok=True)
+        watcher = DirectoryWatcher(
+            root,
+            lambda added, removed: _on_files_changed(index, root, added, removed),
+            interval=WATCH_INTERVAL_SECONDS,
+            suffixes=RECORDING_SUFFIXES,
+        )
+        _reconcile(index, root, watcher.snapshot())
+        watcher.start()
+        _WATCHER = watcher
+        return index, root
+
+
+def close_recordings_library():
+    """Останавливает наблюдение за директорией и закрывает базу (при остановке сервера)."""
+    global _INDEX, _WATCHER
+    faststart_worker.stop()
+    with _INDEX_LOCK:
+        if _WATCHER is not None:
+            _WATCHER.stop()
+        if _INDEX is not None:
+            _INDEX.close()
+        _INDEX, _WATCHER = None, None
+
+
+def index_recording(
+    path: str,
+    serial: Optional[str] = None,
+    started_at: Optional[str] = None,
+    session_id: Optional[str] = None,
+):
+    """
+    Обновляет запись о файле по событию сервера (запись или сегмент закончились).
+    Файлы вне директории библиотеки пропускаются.
+    """
+    index, root = get_library()
+    path = Path(path)
+    if path.parent.resolve() != root.resolve() or path.suffix.lower() not in RECORDING_SUFFIXES:
+        return
+    entry = _probe_entry(root, path.name, serial, started_at, session_id)
+    if entry:
+        index.upsert([entry])
+
+
+def postprocess_settings(config: Optional[dict] = None) -> dict:
+    config = config if config is not None else load_config()
+    recording_cfg = config.get("recording", {})
+    return {
+        "faststart": bool(recording_cfg.get("faststart", True)),
+        "rate_mbps": float(recording_cfg.get("postprocess_rate_mbps") or 0),
+    }
+
+
+class FastStartWorker:
+    """
+    Фоновый поток, который по очереди переносит moov в начало готовых записей.
+    Один поток и ограничение скорости (postprocess_rate_mbps) не дают
+    перезаписи многогигабайтных файлов отнять диск у идущих записей.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[str]]" = queue.Queue()
+        self._pending: set = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.logger = None
+        self.current: Optional[str] = None
+        self.stats = {"processed": 0, "skipped": 0, "failed": 0, "bytes": 0}
+        self.last_error: Optional[dict] = None
+
+    def submit(self, path: str) -> bool:
+        """Ставит файл в очередь; повторная постановка того же файла игнорируется."""
+        path = str(path)
+        with self._lock:
+            if path in self._pending or path == self.current:
+                return False
+            self._pending.add(path)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="recordings-faststart", daemon=True)
+                self._thread.start()
+        self._queue.put(path)
+        return True
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.current is not None,
+                "current": os.path.basename(self.current) if self.current else None,
+                "queued": len(self._pending),
+                **self.stats,
+                "last_error": self.last_error,
+            }
+
+    def stop(self):
+        """Прерывает текущую перезапись (временный файл удаляется) и останавливает поток."""
+        self._stop.set()
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._lock:
+            self._pending.clear()
+            self._queue = queue.Queue()
+
+    def _throttle(self, bucket: TokenBucket):
+        def _consume(amount: int):
+            if self._stop.is_set():
+                raise FastStartError("Cancelled")
+            bucket.consume(amount)
+
+        return _consume
+
+    def _process(self, path: str):
+        # У файла, который ещё пишется, moov нет - needs_faststart его пропустит
+        if not os.path.isfile(path) or not needs_faststart(path):
+            self.stats["skipped"] += 1
+            return
+        rate = postprocess_settings()["rate_mbps"]
+        bucket = TokenBucket(rate * 1_000_000 / 8 if rate > 0 else None)
+        started = time.monotonic()
+        result = faststart(path, self._throttle(bucket))
+        self.stats["processed"] += 1
+        self.stats["bytes"] += result["size_bytes"]
+        if self.logger:
+            self.logger.info(
+                "recordings.faststart file=%s size=%s elapsed=%.2fs",
+                os.path.basename(path), result["size_bytes"], time.monotonic() - started,
+            )
+        index_recording(path)
+
+    def _run(self):
+        while not self._stop.is_set():
+            path = self._queue.get()
+            if path is None:
+                return
+            with self._lock:
+                self._pending.discard(path)
+                self.current = path
+            try:
+                self._process(path)
+            except Exception as exc:
+                self.stats["failed"] += 1
+                self.last_error = {
+                    "file": os.path.basename(path),
+                    "error": str(exc),
+                    "timestamp": datetime.now().isoformat(),
+                }
+                if self.logger:
+                    self.logger.warning("recordings.faststart file=%s error=%s", path, exc)
+            finally:
+                with self._lock:
+                    self.current = None
+
+
+faststart_worker = FastStartWorker()
+
+
+def schedule_faststart(path: str) -> bool:
+    """Ставит готовую MP4-запись на перенос moov, если это включено в настройках."""
+    if not str(path).lower().endswith(".mp4") or not postprocess_settings()["faststart"]:
+        return False
+    return faststart_worker.submit(path)
+
+
+class RecordingFileResponse(FileResponse):
+    chunk_size = STREAM_CHUNK_BYTES
+
+
+def _with_state(entry: dict, root: Path, active: set) -> dict:
+    entry = dict(entry)
+    entry["recording"] = str(root / entry["filename"]) in active
+    entry["stream_url"] = f"/api/recordings/{entry['id']}/stream"
+    if entry["recording"] and entry["session_id"] and entry["filename"].lower().endswith(".mkv"):
+        entry["live_url"] = f"/api/recordings/live/{entry['session_id']}"
+    return entry
+
+
+def _active_paths() -> set:
+    return {str(Path(path)) for path in recording_manager.output_paths()}
+
+
+async def _get_entry(entry_id: str) -> tuple[dict, Path]:
+    index, root = await run_in_threadpool(get_library)
+    entry = await run_in_threadpool(index.get, entry_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Recording not found")
+    return entry, root
+
+
+@router.get("")
+async def list_recordings(
+    page_size: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    serial: Optional[str] = Query(None),
+):
+    """Записи от новых к старым (опционально - одного устройства)."""
+    index, root = await run_in_threadpool(get_library)
+    try:
+        entries, next_cursor = await run_in_threadpool(index.list_page, page_size, cursor, serial)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    total_count = await run_in_threadpool(index.count, serial)
+    active = _active_paths()
+    return {
+        "recordings": [_with_state(entry, root, active) for entry in entries],
+        "total_count": total_count,
+        "page_count": len(entries),
+        "next_cursor": next_cursor,
+        "totals": await run_in_threadpool(index.totals),
+    }
+
+
+@router.post("/rescan")
+async def rescan_recordings():
+    """Сверяет индекс с директорией: разбирает новые и изменившиеся файлы."""
+    index, root = await run_in_threadpool(get_library)
+
+    def _rescan():
+        with os.scandir(root) as entries:
+            names = {
+                entry.name for entry in entries
+                if entry.name.lower().endswith(RECORDING_SUFFIXES) and entry.is_file()
+            }
+        return _reconcile(index, root, names)
+
+    updated = await run_in_threadpool(_rescan)
+    return {"success": True, "updated": updated, "totals": await run_in_threadpool(index.totals)}
+
+
+def _writing(session, path: str) -> bool:
+    """Сессия жива и пишет именно этот файл (у сегментированной записи файл меняется)."""
+    return session.active and session.output_path == path
+
+
+def _read_at(fh, position: int, size: int) -> bytes:
+    fh.seek(position)
+    return fh.read(size)
+
+
+async def _follow_file(session, path: str, start_ranges: List[tuple], position: int):
+    """
+    Отдаёт диапазоны start_ranges, затем файл с position и дальше по мере роста.
+    Жива ли сессия, проверяется до чтения - последние байты после остановки
+    scrcpy тоже попадут в ответ.
+    """
+    with open(path, "rb") as fh:
+        for start, end in start_ranges:
+            while start < end:
+                chunk = await run_in_threadpool(_read_at, fh, start, min(LIVE_CHUNK_BYTES, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+        while True:
+            alive = _writing(session, path)
+            chunk = await run_in_threadpool(_read_at, fh, position, LIVE_CHUNK_BYTES)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+            elif not alive:
+                return
+            else:
+                await asyncio.sleep(LIVE_POLL_SECONDS)
+
+
+@router.get("/live/{session_id}")
+async def live_recording(
+    session_id: str,
+    position: str = Query("live", pattern="^(start|live)$"),
+    lead_seconds: float = Query(3.0, ge=0, le=600),
+):
+    """
+    Идущая запись в MKV. position=start - с начала файла, live - заголовок файла
+    и затем кластер с ключевым кадром примерно за lead_seconds до текущего момента.
+    """
+    session = recording_manager.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Recording session not found")
+    if not session.active:
+        raise HTTPException(status_code=409, detail="Recording is not in progress")
+    path = session.output_path
+    if not path.lower().endswith(".mkv"):
+        raise HTTPException(status_code=400, detail="Live view needs a recording in mkv format")
+
+    # scrcpy создаёт файл только после подключения к устройству
+    deadline = time.monotonic() + LIVE_FILE_WAIT_SECONDS
+    while not os.path.isfile(path):
+        if not _writing(session, path) or time.monotonic() > deadline:
+            raise HTTPException(status_code=409, detail="Recording file is not available yet")
+        await asyncio.sleep(LIVE_POLL_SECONDS)
+
+    start_ranges: List[tuple] = []
+    offset = 0
+    cluster_timestamp = None
+    if position == "live":
+        def _offsets():
+            with open(path, "rb") as fh:
+                return mkv_live_offsets(fh, os.path.getsize(path), lead_seconds)
+
+        try:
+            offsets = await run_in_threadpool(_offsets)
+        except (MediaProbeError, OSError, struct.error):
+            offsets = {"cluster": None}
+        if offsets["cluster"] is not None:
+            # Заголовок (EBML, Info, Tracks) нужен плееру, дальше - сразу свежий кластер
+            start_ranges = [(0, offsets["header_end"])]
+            offset = offsets["cluster"]
+            cluster_timestamp = offsets["cluster_timestamp_s"]
+
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no"}
+    if cluster_timestamp is not None:
+        headers["X-Recording-Position"] = str(cluster_timestamp)
+    return StreamingResponse(
+        _follow_file(session, path, start_ranges, offset),
+        media_type="video/x-matroska",
+        headers=headers,
+    )
+
+
+@router.get("/postprocess")
+async def postprocess_status():
+    """Настройки и состояние фонового переноса moov."""
+    return {"settings": postprocess_settings(), **faststart_worker.status()}
+
+
+@router.post("/faststart")
+async def faststart_library():
+    """Ставит в очередь все MP4 библиотеки; файлы, где moov уже в начале, воркер пропустит."""
+    index, root = await run_in_threadpool(get_library)
+    names = await run_in_threadpool(index.file_stats)
+    queued = sum(
+        faststart_worker.submit(str(root / name)) for name in sorted(names) if name.lower().endswith(".mp4")
+    )
+    return {"success": True, "queued": queued, **faststart_worker.status()}
+
+
+@router.post("/{entry_id}/faststart")
+async def faststart_recording(entry_id: str):
+    entry, root = await _get_entry(entry_id)
+    file_path = root / entry["filename"]
+    if file_path.suffix.lower() != ".mp4":
+        raise HTTPException(status_code=400, detail="Only MP4 recordings need fast start")
+    if str(file_path) in _active_paths():
+        raise HTTPException(status_code=409, detail="Recording is in progress")
+    queued = faststart_worker.submit(str(file_path))
+    return {"success": True, "queued": queued, **faststart_worker.status()}
+
+
+@router.get("/{entry_id}")
+async def get_recording(entry_id: str):
+    entry, root = await _get_entry(entry_id)
+    return _with_state(entry, root, _active_paths())
+
+
+@router.get("/{entry_id}/stream")
+async def stream_recording(entry_id: str):
+    """
+    Файл записи. Range, If-Range и ответы 206/416 обрабатывает FileResponse,
+    поэтому плеер браузера может перематывать без загрузки всего файла.
+    """
+    entry, root = await _get_entry(entry_id)
+    file_path = root / entry["filename"]
+    if not file_path.is_file():
+        raise HTTPException(status_code=404, detail="Recording file not found")
+    return RecordingFileResponse(
+        file_path,
+        media_type=MEDIA_TYPES.get(file_path.suffix.lower(), "application/octet-stream"),
+        headers={"Cache-Control": "private, no-cache"},
+        content_disposition_type="inline",
+        filename=entry["filename"],
+    )
+
+
+@router.delete("/{entry_id}")
+async def delete_recording(entry_id: str):
+    entry, root = await _get_entry(entry_id)
+    file_path = root / entry["filename"]
+    if str(file_path) in _active_paths():
+        raise HTTPException(status_code=409, detail="Recording is in progress")
+    if str(file_path) in {str(Path(path)) for path in recording_manager.protected_paths()}:
+        # Сегменты скользящего окна удаляет сама сессия
+        raise HTTPException(status_code=409, detail="Segment belongs to an active recording")
+    index, _ = await run_in_threadpool(get_library)
+    try:
+        await run_in_threadpool(file_path.unlink, True)
+    except OSError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    await run_in_threadpool(index.delete_names, [entry["filename"]])
+    await run_in_threadpool(recording_manager.forget_segment_files, [str(file_path)])
+    return {"success": True}
@@ -0,0 +1,644 @@
+"""
+Политика хранения: квоты по размеру и возрасту для скриншотов, записей и логов.
+
+Скриншоты берутся из индекса галереи (gallery_index), записи и логи - из
+отдельного файлового индекса (SQLite в DATA_DIR), который поддерживают
+DirectoryWatcher'ы. Полного обхода директорий при каждом прогоне нет:
+пересчитываются только файлы, которые ещё могли расти с прошлого прогона.
+
+Удаление идёт от старых к новым: сначала всё старше max_age_days, затем
+самые старые, пока категория не уложится в max_mb. Закреплённые элементы,
+активная запись (вместе с её сегментами), текущий лог и файлы, изменённые
+за последние минуты, не удаляются никогда. За один проход удаляется не больше batch_size
+элементов на категорию - фоновая задача догоняет квоту постепенно.
+
+Эндпоинты:
+- GET /api/retention - настройки, занятое место по категориям и последний прогон
+- GET /api/retention/report - dry-run: что будет удалено и сколько места освободится
+- POST /api/retention/run - применить политику сейчас
+- GET /api/retention/pins - закреплённые записи и логи
+- POST /api/retention/pins - закрепить или открепить элемент
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from mkdsc.config import load_config
+from mkdsc.paths import DATA_DIR, get_logs_dir, get_recordings_dir
+from mkdsc.web import gallery
+from mkdsc.web.dir_watcher import DirectoryWatcher
+from mkdsc.web.recording_sessions import manager as recording_manager
+
+router = APIRouter(prefix="/api/retention", tags=["retention"])
+
+CATEGORIES = ("screenshots", "recordings", "logs")
+FILE_SUFFIXES = {
+    "recordings": (".mp4", ".mkv"),
+    "logs": (".log", ".zip"),
+}
+DEFAULT_RETENTION_SETTINGS = {
+    "enabled": False,
+    "interval_minutes": 30,
+    "batch_size": 200,
+    "screenshots": {"max_mb": 0, "max_age_days": 0},
+    "recordings": {"max_mb": 0, "max_age_days": 0},
+    "logs": {"max_mb": 0, "max_age_days": 0},
+}
+# Файлы, которые менялись недавно, считаем занятыми (пишется запись или лог другого процесса)
+ACTIVE_GRACE_SECONDS = 120
+# Пока квота не достигнута, следующая пачка - через столько секунд, а не через interval_minutes
+CATCH_UP_DELAY_SECONDS = 5
+CANDIDATE_PAGE_SIZE = 500
+REPORT_ITEMS_LIMIT = 200
+WATCH_INTERVAL_SECONDS = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (category, name)
+);
+CREATE INDEX IF NOT EXISTS files_age ON files (category, mtime, name);
+CREATE TABLE IF NOT EXISTS pins (
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    pinned_at TEXT NOT NULL,
+    PRIMARY KEY (category, name)
+);
+"""
+_UNPINNED = "NOT EXISTS (SELECT 1 FROM pins p WHERE p.category = f.category AND p.name = f.name)"
+
+
+class FileIndex:
+    """Размеры и mtime файлов записей и логов плюс список закреплённых."""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    @staticmethod
+    def _stat_rows(category: str, root: Path, names: Iterable[str]) -> List[tuple]:
+        rows = []
+        for name in names:
+            try:
+                stat = (root / name).stat()
+            except OSError:
+                continue
+            rows.append((category, name, stat.st_size, stat.st_mtime))
+        return rows
+
+    def _upsert(self, rows: List[tuple]):
+        if rows:
+            self._conn.executemany(
+                "INSERT INTO files (category, name, size_bytes, mtime) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(category, name) DO UPDATE SET "
+                "size_bytes = excluded.size_bytes, mtime = excluded.mtime",
+                rows,
+            )
+
+    def _delete(self, category: str, names: Iterable[str]):
+        self._conn.executemany(
+            "DELETE FROM files WHERE category = ? AND name = ?", [(category, name) for name in names]
+        )
+
+    def apply(self, category: str, root: Path, added: Iterable[str], removed: Iterable[str]):
+        """Изменения от DirectoryWatcher: статим только добавленные файлы."""
+        rows = self._stat_rows(category, root, added)
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._delete(category, removed)
+                self._upsert(rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def sync(self, category: str, root: Path, names: set):
+        """Сверка с текущим содержимым директории (при старте или смене пути)."""
+        root_key = f"root:{category}"
+        with self._lock:
+            if self.get_meta(root_key) != str(root):
+                self._conn.execute("DELETE FROM files WHERE category = ?", (category,))
+                self.set_meta(root_key, str(root))
+            known = {
+                row["name"]
+                for row in self._conn.execute("SELECT name FROM files WHERE category = ?", (category,))
+            }
+        self.apply(category, root, names - known, known - names)
+
+    def refresh(self, category: str, root: Path) -> int:
+        """
+        Обновляет размер файлов, которые могли расти с прошлого прогона.
+
+        Смена размера не меняет mtime директории, поэтому watcher её не видит;
+        перечитываем только файлы с mtime новее прошлого обновления.
+        """
+        meta_key = f"refreshed:{category}"
+        now = time.time()
+        since = float(self.get_meta(meta_key) or 0) - ACTIVE_GRACE_SECONDS
+        with self._lock:
+            names = [
+                row["name"]
+                for row in self._conn.execute(
+                    "SELECT name FROM files WHERE category = ? AND mtime >= ?", (category, since)
+                )
+            ]
+        rows = self._stat_rows(category, root, names)
+        with self._lock:
+            self._upsert(rows)
+            self.set_meta(meta_key, str(now))
+        return len(rows)
+
+    def totals(self, category: str) -> dict:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS files, SUM(size_bytes) AS bytes, "
+                f"SUM(CASE WHEN {_UNPINNED} THEN 0 ELSE 1 END) AS pinned_files, "
+                f"SUM(CASE WHEN {_UNPINNED} THEN 0 ELSE size_bytes END) AS pinned_bytes "
+                "FROM files f WHERE category = ?",
+                (category,),
+            ).fetchone()
+        return {key: row[key] or 0 for key in row.keys()}
+
+    def candidates(self, category: str, limit: int, after: Optional[tuple[float, str]] = None) -> List[dict]:
+        """Незакреплённые файлы от старых к новым (keyset по (mtime, name))."""
+        where = f"category = ? AND {_UNPINNED}"
+        params: list = [category]
+        if after:
+            where += " AND (mtime, name) > (?, ?)"
+            params.extend(after)
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT name, size_bytes, mtime FROM files f WHERE {where} ORDER BY mtime, name LIMIT ?",
+                params,
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def remove(self, category: str, names: Iterable[str]):
+        with self._lock:
+            self._delete(category, names)
+
+    def contains(self, category: str, name: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM files WHERE category = ? AND name = ?", (category, name)
+            ).fetchone()
+        return row is not None
+
+    def set_pinned(self, category: str, name: str, pinned: bool):
+        with self._lock:
+            if pinned:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO pins (category, name, pinned_at) VALUES (?, ?, ?)",
+                    (category, name, datetime.now().isoformat()),
+                )
+            else:
+                self._conn.execute("DELETE FROM pins WHERE category = ? AND name = ?", (category, name))
+
+    def pins(self, category: Optional[str] = None) -> List[dict]:
+        sql = "SELECT category, name, pinned_at FROM pins"
+        params: tuple = ()
+        if category:
+            sql += " WHERE category = ?"
+            params = (category,)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY pinned_at", params).fetchall()
+        return [dict(row) for row in rows]
+
+
+class PinRequest(BaseModel):
+    """Закрепление: для скриншотов key - ID, для записей и логов - имя файла."""
+    category: str
+    key: str
+    pinned: bool = True
+
+
+class RunRequest(BaseModel):
+    """Ручной прогон политики."""
+    categories: Optional[List[str]] = None
+    dry_run: bool = False
+
+
+_INDEX: Optional[FileIndex] = None
+_WATCHERS: dict = {}
+_STATE_LOCK = threading.Lock()
+# Один прогон за раз: фоновый и ручной не должны удалять одно и то же параллельно
+_RUN_LOCK = threading.Lock()
+_LAST_RUN: dict = {}
+_TASK: Optional[asyncio.Task] = None
+_LOGGER = None
+_PROTECTED: Optional[Callable[[], Iterable[str]]] = None
+
+
+def retention_settings() -> dict:
+    """Секция retention из конфига (читается с диска, чтобы изменения применялись без перезапуска)."""
+    retention_cfg = load_config().get("retention")
+    settings = {
+        key: dict(value) if isinstance(value, dict) else value
+        for key, value in DEFAULT_RETENTION_SETTINGS.items()
+    }
+    if isinstance(retention_cfg, dict):
+        for key, default in DEFAULT_RETENTION_SETTINGS.items():
+            value = retention_cfg.get(key)
+            if isinstance(default, dict):
+                if isinstance(value, dict):
+                    settings[key].update({name: value[name] for name in default if name in value})
+            elif value is not None:
+                settings[key] = value
+    return settings
+
+
+def _category_roots(config: dict) -> dict:
+    recording_cfg = config.get("recording", {})
+    recordings_dir = recording_cfg.get("output_dir") or str(get_recordings_dir(config))
+    return {
+        "recordings": Path(recordings_dir).expanduser(),
+        "logs": get_logs_dir(config),
+    }
+
+
+def _get_file_index() -> FileIndex:
+    global _INDEX
+    with _STATE_LOCK:
+        if _INDEX is None:
+            _INDEX = FileIndex(DATA_DIR / "retention.db")
+        return _INDEX
+
+
+def _ensure_watchers() -> dict:
+    """Запускает watcher'ы для директорий записей и логов; при смене пути пересоздаёт."""
+    roots = _category_roots(load_config())
+    index = _get_file_index()
+    with _STATE_LOCK:
+        for category, root in roots.items():
+            watcher = _WATCHERS.get(category)
+            if watcher is not None and watcher.root == root:
+                continue
+            if watcher is not None:
+                watcher.stop()
+
+            def _on_change(added, removed, category=category, root=root):
+                index.apply(category, root, added, removed)
+
+            watcher = DirectoryWatcher(
+                root, _on_change, interval=WATCH_INTERVAL_SECONDS,
+                suffixes=FILE_SUFFIXES[category], logger=_LOGGER,
+            )
+            index.sync(category, root, watcher.snapshot())
+            watcher.start()
+            _WATCHERS[category] = watcher
+    return roots
+
+
+def _protected_paths() -> set:
+    paths = set()
+    if _PROTECTED is not None:
+        try:
+            paths = {os.path.realpath(path) for path in _PROTECTED() if path}
+        except Exception as exc:
+            if _LOGGER:
+                _LOGGER.warning("retention.protected error=%s", exc)
+    return paths
+
+
+def _iter_screenshots() -> Iterator[dict]:
+    index = gallery.get_index()
+    after = None
+    while True:
+        batch = index.eviction_candidates(CANDIDATE_PAGE_SIZE, after)
+        for entry in batch:
+            try:
+                created = datetime.fromisoformat(entry["created_at"]).timestamp()
+            except (TypeError, ValueError):
+                created = 0.0
+            yield {
+                "key": entry["id"],
+                "size_bytes": int(entry["occupied_bytes"]),
+                "mtime": created,
+                "path": None,
+                "entry": entry,
+            }
+        if len(batch) < CANDIDATE_PAGE_SIZE:
+            return
+        after = (batch[-1]["created_at"], batch[-1]["id"])
+
+
+def _iter_files(category: str, root: Path) -> Iterator[dict]:
+    index = _get_file_index()
+    after = None
+    while True:
+        batch = index.candidates(category, CANDIDATE_PAGE_SIZE, after)
+        for row in batch:
+            yield {
+                "key": row["name"],
+                "size_bytes": int(row["size_bytes"]),
+                "mtime": float(row["mtime"]),
+                "path": root / row["name"],
+            }
+        if len(batch) < CANDIDATE_PAGE_SIZE:
+            return
+        after = (batch[-1]["mtime"], batch[-1]["name"])
+
+
+def _plan_category(category: str, quota: dict, roots: dict, limit: Optional[int], protected: set) -> dict:
+    """
+    Список на удаление для одной категории.
+
+    Кандидаты идут от старых к новым, поэтому проход останавливается на первом
+    элементе, который и не старше max_age_days, и не нужен для квоты по размеру.
+    """
+    if category == "screenshots":
+        totals = gallery.get_index().retention_totals()
+        candidates = _iter_screenshots()
+    else:
+        index = _get_file_index()
+        index.refresh(category, roots[category])
+        totals = index.totals(category)
+        candidates = _iter_files(category, roots[category])
+
+    max_bytes = int(float(quota.get("max_mb") or 0) * 1024 * 1024)
+    max_age_days = float(quota.get("max_age_days") or 0)
+    now = time.time()
+    age_cutoff = now - max_age_days * 86400 if max_age_days > 0 else None
+    busy_cutoff = now - ACTIVE_GRACE_SECONDS
+
+    remaining = int(totals["bytes"])
+    planned: List[dict] = []
+    skipped_active = 0
+    pending = False
+    for item in candidates:
+        expired = age_cutoff is not None and item["mtime"] < age_cutoff
+        over_quota = max_bytes > 0 and remaining > max_bytes
+        if not (expired or over_quota):
+            break
+        if item["path"] is not None and (
+            item["mtime"] > busy_cutoff or os.path.realpath(item["path"]) in protected
+        ):
+            skipped_active += 1
+            continue
+        if limit is not None and len(planned) >= limit:
+            pending = True
+            break
+        planned.append(item)
+        remaining -= item["size_bytes"]
+
+    return {
+        "quota": {"max_mb": quota.get("max_mb") or 0, "max_age_days": quota.get("max_age_days") or 0},
+        "files": totals["files"],
+        "bytes": totals["bytes"],
+        "pinned_files": totals["pinned_files"],
+        "pinned_bytes": totals["pinned_bytes"],
+        "evict_files": len(planned),
+        "evict_bytes": sum(item["size_bytes"] for item in planned),
+        "bytes_after": remaining,
+        "over_quota_after": max_bytes > 0 and remaining > max_bytes,
+        "skipped_active": skipped_active,
+        "pending": pending,
+        "items": planned,
+    }
+
+
+def _evict(category: str, items: List[dict]) -> tuple[int, int]:
+    if category == "screenshots":
+        entries = [item["entry"] for item in items]
+        gallery.delete_entries(entries)
+        return len(entries), sum(item["size_bytes"] for item in items)
+
+    deleted = []
+    deleted_paths = []
+    freed = 0
+    for item in items:
+        try:
+            item["path"].unlink(missing_ok=True)
+        except OSError as exc:
+            if _LOGGER:
+                _LOGGER.warning("retention.unlink path=%s error=%s", item["path"], exc)
+            continue
+        deleted.append(item["key"])
+        deleted_paths.append(str(item["path"]))
+        freed += item["size_bytes"]
+    _get_file_index().remove(category, deleted)
+    if category == "recordings":
+        # Удалённые сегменты отмечаются в <base>.segments.json, пустой индекс удаляется
+        recording_manager.forget_segment_files(deleted_paths)
+    return len(deleted), freed
+
+
+def _report_item(category: str, item: dict) -> dict:
+    report = {
+        "key": item["key"],
+        "size_bytes": item["size_bytes"],
+        "modified_at": datetime.fromtimestamp(item["mtime"]).isoformat() if item["mtime"] else None,
+    }
+    if category == "screenshots":
+        report["filename"] = item["entry"]["filename"]
+    return report
+
+
+def run_policy(
+    dry_run: bool = True,
+    categories: Optional[Iterable[str]] = None,
+    limit: Optional[int] = None,
+) -> dict:
+    """Один прогон политики; limit - максимум удалений на категорию (None - без ограничения)."""
+    settings = retention_settings()
+    started = time.perf_counter()
+    with _RUN_LOCK:
+        roots = _ensure_watchers()
+        protected = _protected_paths()
+        result = {}
+        for category in categories or CATEGORIES:
+            plan = _plan_category(category, settings[category], roots, limit, protected)
+            items = plan.pop("items")
+            if not dry_run and items:
+                plan["evict_files"], plan["evict_bytes"] = _evict(category, items)
+                if _LOGGER:
+                    _LOGGER.info(
+                        "retention.evict category=%s files=%s bytes=%s",
+                        category, plan["evict_files"], plan["evict_bytes"],
+                    )
+            plan["items"] = [_report_item(category, item) for item in items[:REPORT_ITEMS_LIMIT]]
+            plan["items_truncated"] = len(items) > REPORT_ITEMS_LIMIT
+            result[category] = plan
+
+    summary = {
+        "dry_run": dry_run,
+        "finished_at": datetime.now().isoformat(),
+        "elapsed_s": round(time.perf_counter() - started, 3),
+        "categories": result,
+    }
+    if not dry_run:
+        _LAST_RUN.clear()
+        _LAST_RUN.update(summary)
+    return summary
+
+
+async def _retention_loop():
+    while True:
+        settings = retention_settings()
+        delay = max(1.0, float(settings["interval_minutes"] or 0) * 60)
+        if settings["enabled"]:
+            try:
+                summary = await run_in_threadpool(
+                    run_policy, False, None, max(1, int(settings["batch_size"] or 1))
+                )
+                if any(item["pending"] for item in summary["categories"].values()):
+                    delay = CATCH_UP_DELAY_SECONDS
+            except Exception as exc:
+                if _LOGGER:
+                    _LOGGER.warning("retention.run error=%s", exc)
+        await asyncio.sleep(delay)
+
+
+def start_retention(logger=None, protected: Optional[Callable[[], Iterable[str]]] = None):
+    """
+    Запускает фоновое применение политики.
+
+    protected() возвращает пути файлов, которые сейчас используются
+    (активная запись, текущий лог): их политика не трогает.
+    """
+    global _TASK, _LOGGER, _PROTECTED
+    _LOGGER = logger
+    _PROTECTED = protected
+    if _TASK is None or _TASK.done():
+        _TASK = asyncio.create_task(_retention_loop())
+
+
+def stop_retention():
+    global _TASK, _INDEX
+    if _TASK is not None:
+        _TASK.cancel()
+        _TASK = None
+    with _STATE_LOCK:
+        for watcher in _WATCHERS.values():
+            watcher.stop()
+        _WATCHERS.clear()
+        if _INDEX is not None:
+            _INDEX.close()
+            _INDEX = None
+
+
+def _validate_categories(categories: Optional[Iterable[str]]) -> Optional[List[str]]:
+    if not categories:
+        return None
+    categories = list(categories)
+    unknown = [name for name in categories if name not in CATEGORIES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown category: {', '.join(unknown)}")
+    return categories
+
+
+@router.get("")
+async def retention_status():
+    """Настройки политики, занятое место по категориям и итог последнего прогона."""
+    def _totals():
+        roots = _ensure_watchers()
+        index = _get_file_index()
+        totals = {"screenshots": gallery.get_index().retention_totals()}
+        for category in FILE_SUFFIXES:
+            index.refresh(category, roots[category])
+            totals[category] = index.totals(category)
+        return totals
+
+    return {
+        "settings": retention_settings(),
+        "running": _TASK is not None and not _TASK.done(),
+        "totals": await run_in_threadpool(_totals),
+        "last_run": dict(_LAST_RUN) or None,
+    }
+
+
+@router.get("/report")
+async def retention_report(categories: Optional[List[str]] = Query(None)):
+    """Dry-run: что удалит политика при текущих квотах (без ограничения batch_size)."""
+    return await run_in_threadpool(run_policy, True, _validate_categories(categories), None)
+
+
+@router.post("/run")
+async def retention_run(payload: RunRequest):
+    """Применяет политику сейчас; без dry_run удаляет не больше batch_size элементов на категорию."""
+    categories = _validate_categories(payload.categories)
+    limit = None if payload.dry_run else max(1, int(retention_settings()["batch_size"] or 1))
+    summary = await run_in_threadpool(run_policy, payload.dry_run, categories, limit)
+    return {"success": True, **summary}
+
+
+@router.get("/pins")
+async def list_pins(category: Optional[str] = Query(None)):
+    """Закреплённые записи и логи (закреплённые скриншоты помечены в самой галерее)."""
+    if category is not None and category not in FILE_SUFFIXES:
+        raise HTTPException(status_code=400, detail=f"Unknown category: {category}")
+    return {"pins": await run_in_threadpool(_get_file_index().pins, category)}
+
+
+@router.post("/pins")
+async def update_pin(payload: PinRequest):
+    """Закрепляет элемент (или снимает закрепление): политика его не удаляет."""
+    if payload.category not in CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"Unknown category: {payload.category}")
+
+    if payload.category == "screenshots":
+        index = await run_in_threadpool(gallery.get_index)
+        entry = await run_in_threadpool(index.set_pinned, payload.key, payload.pinned)
+        if not entry:
+            raise HTTPException(status_code=404, detail="Screenshot not found")
+        return {"success": True, "category": payload.category, "key": payload.key, "pinned": payload.pinned}
+
+    if Path(payload.key).name != payload.key:
+        raise HTTPException(status_code=400, detail="key must be a file name")
+
+    def _pin():
+        roots = _ensure_watchers()
+        index = _get_file_index()
+        # Открепить можно и уже удалённый файл, закрепить - только существующий
+        if payload.pinned and not (
+            index.contains(payload.category, payload.key)
+            or (roots[payload.category] / payload.key).is_file()
+        ):
+            return False
+        index.set_pinned(payload.category, payload.key, payload.pinned)
+        return True
+
+    if not await run_in_threadpool(_pin):
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"success": True, "category": payload.category, "key": payload.key, "pinned": payload.pinned}
@@ -0,0 +1,63 @@
+"""
+Разбор вывода scrcpy.
+
+scrcpy пишет в stdout строки вида "INFO: ...", "WARN: ...", "ERROR: ...".
+По ним супервизор определяет, что сессия действительно заработала
+(устройство подключено, запись пошла) или упала с известной ошибкой -
+не дожидаясь выхода процесса. Отчёты --print-fps разбираются в метрики.
+"""
+import re
+
+# Вехи запуска: имя -> шаблон строки
+MILESTONES = {
+    "device_connected": re.compile(r"INFO: Device: "),
+    "recording_started": re.compile(r"INFO: Recording started to \w+ file"),
+    "rendering": re.compile(r"INFO: (?:Renderer|Texture): "),
+}
+
+# Сессия записи готова, когда scrcpy сообщил о начале записи
+RECORDING_READY = ("recording_started",)
+# Трансляция готова, когда открылось окно (или хотя бы подключилось устройство)
+MIRROR_READY = ("rendering",)
+
+# Ошибки, после которых scrcpy уже не заработает (процесс выйдет сам, но позже)
+FATAL_PATTERNS = tuple(
+    re.compile(pattern)
+    for pattern in (
+        r"ERROR: Could not find any ADB device",
+        r"ERROR: Could not find ADB device",
+        r"ERROR: Multiple \(\d+\) ADB devices",
+        r"ERROR: Server connection failed",
+        r"ERROR: Could not open video stream",
+        r"ERROR: Could not (?:open|create|write) (?:output )?file",
+        r"ERROR: Failed to open output file",
+        r"ERROR: Demuxer error",
+        r"ERROR: Encoding error",
+        r"ERROR: Unknown option",
+        r"adb: device '.*' not found",
+    )
+)
+
+
+def match_milestone(line: str):
+    """Имя вехи запуска, которой соответствует строка, или None."""
+    for name, pattern in MILESTONES.items():
+        if pattern.search(line):
+            return name
+    return None
+
+
+def is_fatal(line: str) -> bool:
+    return any(pattern.search(line) for pattern in FATAL_PATTERNS)
+
+
+# Отчёт --print-fps: "INFO: 60 fps" или "INFO: 58 fps (+2 frames skipped)"
+FPS_PATTERN = re.compile(r"INFO: (\d+) fps(?: \(\+(\d+) frames? skipped\))?\s*$")
+
+
+def parse_fps(line: str):
+    """(fps, пропущено кадров) из строки --print-fps или None."""
+    match = FPS_PATTERN.search(line)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2) or 0)
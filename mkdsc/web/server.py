@@ -1,25 +1,27 @@
 import asyncio
+import os
 import platform
 import threading
 import subprocess
-import signal
 import zipfile
 from datetime import datetime
 from pathlib import Path
 import re
-from typing import List
+import uuid
+from typing import List, Optional
 import time
 
 import requests
 import uvicorn
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import Body, FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 
 from mkdsc.constants import VERSION
-from mkdsc.config import load_config, save_config, update_config as apply_config_patch
+from mkdsc.config import DEFAULT_CONFIG, load_config, save_config, update_config as apply_config_patch
 from mkdsc.devices import list_devices, remove_device, save_device
 from mkdsc.i18n import available_languages
 from mkdsc.i18n.lexicon_web import LEXICON_WEB
@@ -45,17 +47,57 @@ from mkdsc.tools import (
 )
 from mkdsc.updater import apply_update, check_for_updates
 from mkdsc.web.service_commands import router as service_router
+from mkdsc.web.adaptive_quality import is_adaptive, resolve_adaptive, router as adaptive_router
 from mkdsc.web.connection_optimizer import router as connection_router
-from mkdsc.web.gallery import router as gallery_router
+from mkdsc.web.device_profiles import (
+    normalize_video_codec,
+    resolve_video_codec,
+    router as device_profiles_router,
+)
+from mkdsc.web.gallery import close_gallery_index, router as gallery_router
+from mkdsc.web.recording_sessions import (
+    AUDIO_BITRATE_BPS,
+    SEGMENT_INDEX_SUFFIX,
+    BudgetExceeded,
+    SessionConflict,
+    manager as recording_manager,
+    parse_bitrate,
+)
 from mkdsc.web.file_manager import router as file_manager_router
+from mkdsc.web.recordings import (
+    close_recordings_library,
+    faststart_worker,
+    index_recording,
+    router as recordings_router,
+    schedule_faststart,
+)
+from mkdsc.web.retention import router as retention_router, start_retention, stop_retention
+from mkdsc.web import scrcpy_output
+from mkdsc.web.process_metrics import ProcessMetrics
+from mkdsc.web.supervisor import ReadinessProbe, router as processes_router, supervisor
+from mkdsc.web.transfer_qos import governor as transfer_governor
+from mkdsc.web.workers import shutdown_process_pool
 
 app = FastAPI(title="MK DroidScreenCast Web Panel")
 
+RECORDING_GROUP_MAX_DEVICES = 32
+RECORDING_READY_TIMEOUT = 10.0
+RECORDING_MIN_SEGMENT_SECONDS = 10
+# Сколько сегментов подряд может упасть, прежде чем запись считается неудачной
+RECORDING_SEGMENT_RETRIES = 3
+RECORDING_SEGMENT_RETRY_DELAY = 2.0
+RECORDING_SEGMENT_POLL_SECONDS = 1.0
+
 # Подключаем роутеры новых модулей
 app.include_router(service_router)
 app.include_router(connection_router)
 app.include_router(gallery_router)
 app.include_router(file_manager_router)
+app.include_router(retention_router)
+app.include_router(recordings_router)
+app.include_router(processes_router)
+app.include_router(device_profiles_router)
+app.include_router(adaptive_router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -127,23 +169,52 @@ class ConnectionManager:
 
 
 manager = ConnectionManager()
+# Цикл событий держит задачи только слабыми ссылками - рассылки храним до завершения
+_broadcast_tasks: set = set()
 
 
 @app.on_event("startup")
 async def startup_event():
     app.state.config = _get_config()
-    app.state.logger, _ = init_logging("web", app.state.config)
+    app.state.logger, app.state.log_path = init_logging("web", app.state.config)
     app.state.logger.info("version: %s", VERSION)
     app.state.logger.info("start: %s", datetime.now().isoformat())
 
+    transfer_governor.load_config(app.state.config)
+
     app.state.adb_path, app.state.scrcpy_path = ensure_tools()
     start_adb_server(app.state.adb_path)
-    app.state.recording = None
-    app.state.recording_last_error = None
+    supervisor.logger = app.state.logger
+    faststart_worker.logger = app.state.logger
+    supervisor.subscribe(_broadcast_process_event)
+    start_retention(app.state.logger, _retention_protected_paths)
+
+
+def _broadcast_process_event(event: dict):
+    """События жизненного цикла процессов и отсчёты метрик уходят клиентам по /ws."""
+    message_type = "process_metrics" if event["event"] == "metrics" else "process_event"
+    task = asyncio.get_running_loop().create_task(manager.broadcast({"type": message_type, **event}))
+    _broadcast_tasks.add(task)
+    task.add_done_callback(_broadcast_tasks.discard)
+
+
+def _retention_protected_paths():
+    """Файлы, которые сейчас пишутся: текущий лог, активные записи и их сегменты."""
+    paths = [str(app.state.log_path)]
+    paths.extend(recording_manager.protected_paths())
+    return paths
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    # Сначала процессы: их хуки возвращают настройки устройств через adb.
+    # Записи останавливаются отдельно, чтобы сегментированные не начали новый сегмент
+    await _stop_recordings(recording_manager.active())
+    await supervisor.shutdown()
+    stop_retention()
+    shutdown_process_pool()
+    close_gallery_index()
+    close_recordings_library()
     adb_path = getattr(app.state, "adb_path", None)
     if adb_path:
         stop_adb_server(adb_path)
@@ -368,36 +439,39 @@ async def delete_preset(name: str):
     return {"success": True, "presets": presets}
 
 
-def _apply_device_settings(adb_path, stay_awake, show_touches):
+def _apply_device_settings(adb_path, stay_awake, show_touches, serial=None):
     restore = {}
 
     if stay_awake:
-        previous = get_setting(adb_path, "global", "stay_on_while_plugged_in")
+        previous = get_setting(adb_path, "global", "stay_on_while_plugged_in", serial)
         restore["global:stay_on_while_plugged_in"] = previous
-        put_setting(adb_path, "global", "stay_on_while_plugged_in", 3)
+        put_setting(adb_path, "global", "stay_on_while_plugged_in", 3, serial)
 
     if show_touches:
-        previous = get_setting(adb_path, "system", "show_touches")
+        previous = get_setting(adb_path, "system", "show_touches", serial)
         restore["system:show_touches"] = previous
-        put_setting(adb_path, "system", "show_touches", 1)
+        put_setting(adb_path, "system", "show_touches", 1, serial)
 
     return restore
 
 
-def _restore_device_settings(adb_path, restore):
+def _restore_device_settings(adb_path, restore, serial=None):
     for key, value in restore.items():
         namespace, setting = key.split(":", 1)
         if value is None:
-            delete_setting(adb_path, namespace, setting)
+            delete_setting(adb_path, namespace, setting, serial)
         else:
-            put_setting(adb_path, namespace, setting, value)
+            put_setting(adb_path, namespace, setting, value, serial)
 
 
-def _restore_after(proc, adb_path, restore, logger):
-    proc.wait()
-    if restore:
-        _restore_device_settings(adb_path, restore)
-    logger.info("scrcpy exited with code %s", proc.returncode)
+def _restore_after(adb_path, restore, serial=None):
+    """on_exit-хук супервизора: освобождает лимит передач и возвращает настройки устройства."""
+    def _hook(managed):
+        transfer_governor.session_ended(f"scrcpy-{managed.pid}")
+        if restore:
+            _restore_device_settings(adb_path, restore, serial)
+
+    return _hook
 
 
 def _normalize_keyboard_mode(keyboard: str):
@@ -423,39 +497,29 @@ def _sanitize_prefix(prefix: str) -> str:
     return text or "recording"
 
 
-def _get_recording_session():
-    session = getattr(app.state, "recording", None)
-    if not session:
-        return None
-    proc = session.get("process")
-    if not proc:
-        app.state.recording = None
-        return None
-    if proc.poll() is None:
-        return session
-    app.state.recording = None
-    return None
-
-
-def _recording_status_payload(session=None):
-    session = session or _get_recording_session()
-    if not session:
-        payload = {"active": False}
-        last_error = getattr(app.state, "recording_last_error", None)
-        if last_error:
-            payload["last_error"] = last_error
+def _recording_status_payload():
+    """Состояние в формате одиночной записи (для старого клиента) плюс все активные сессии."""
+    sessions = recording_manager.active()
+    if not sessions:
+        payload = {"active": False, "sessions": []}
+        recent = recording_manager.recent()
+        if recent and recent[-1].last_error:
+            payload["last_error"] = recent[-1].last_error
         return payload
-    settings = session.get("settings", {})
+    latest = max(sessions, key=lambda session: session.created_at)
+    settings = latest.settings
     return {
         "active": True,
-        "pid": session.get("pid"),
-        "started_at": session.get("started_at"),
-        "output_path": session.get("output_path"),
+        "session_id": latest.id,
+        "pid": latest.pid,
+        "started_at": latest.started_at,
+        "output_path": latest.output_path,
         "format": settings.get("format"),
         "audio_source": settings.get("audio_source"),
         "show_preview": settings.get("show_preview"),
         "serial": settings.get("serial"),
         "connection": settings.get("connection"),
+        "sessions": [session.snapshot() for session in sessions],
     }
 
 
@@ -463,11 +527,18 @@ def _recording_status_payload(session=None):
 async def launch_scrcpy_api(data: dict):
     cmd = [str(app.state.scrcpy_path)]
 
-    if data.get("bitrate"):
-        cmd.extend(["--video-bit-rate", data["bitrate"]])
-    if data.get("maxsize"):
-        cmd.extend(["--max-size", data["maxsize"]])
-
+    stream = {"bitrate": data.get("bitrate"), "maxsize": data.get("maxsize"), "max_fps": None}
+    adaptive_info = None
+    if is_adaptive(data):
+        stream, adaptive_info = await _adaptive_stream_settings(data.get("serial"))
+    if stream["bitrate"]:
+        cmd.extend(["--video-bit-rate", str(stream["bitrate"])])
+    if stream["maxsize"]:
+        cmd.extend(["--max-size", str(stream["maxsize"])])
+    if stream["max_fps"]:
+        cmd.append(f"--max-fps={stream['max_fps']}")
+
+    video_codec = _requested_video_codec(data, _get_config())
     keyboard = data.get("keyboard", "uhid")
     keyboard, warning_key = _normalize_keyboard_mode(keyboard)
     cmd.append(f"--keyboard={keyboard}")
@@ -487,26 +558,36 @@ async def launch_scrcpy_api(data: dict):
         cmd.append("--fullscreen")
     if data.get("no_audio"):
         cmd.append("--no-audio")
+    # Отчёт fps раз в секунду - для телеметрии сессии
+    cmd.append("--print-fps")
+
+    codec_args, codec_info = await resolve_video_codec(
+        app.state.adb_path, app.state.scrcpy_path, video_codec, serial
+    )
+    cmd.extend(codec_args)
 
     stay_awake = data.get("stay_awake", False)
     show_touches = data.get("show_touches", False)
 
-    restore = _apply_device_settings(app.state.adb_path, stay_awake, show_touches)
+    restore = _apply_device_settings(app.state.adb_path, stay_awake, show_touches, serial)
 
     logger = app.state.logger
 
     try:
-        proc = subprocess.Popen(cmd)
+        managed = await supervisor.spawn(
+            "mirror",
+            cmd,
+            serial=serial,
+            on_exit=[_restore_after(app.state.adb_path, restore, serial)],
+            readiness=_scrcpy_probe(scrcpy_output.MIRROR_READY),
+            metrics=ProcessMetrics(scrcpy_output.parse_fps),
+        )
     except Exception as exc:
         if restore:
-            _restore_device_settings(app.state.adb_path, restore)
+            _restore_device_settings(app.state.adb_path, restore, serial)
         return {"success": False, "output": str(exc)}
 
-    threading.Thread(
-        target=_restore_after,
-        args=(proc, app.state.adb_path, restore, logger),
-        daemon=True,
-    ).start()
+    transfer_governor.session_started(serial, f"scrcpy-{managed.pid}", "mirror")
 
     logger.info("scrcpy settings: %s", data)
     logger.info("device info: %s", get_device_info(app.state.adb_path))
@@ -514,52 +595,73 @@ async def launch_scrcpy_api(data: dict):
 
     return {
         "success": True,
-        "pid": proc.pid,
+        "pid": managed.pid,
+        "process_id": managed.id,
         "command": " ".join(cmd),
         "warning_key": warning_key,
+        "video_codec": codec_info,
+        "adaptive": adaptive_info,
     }
 
 
+async def _adaptive_stream_settings(serial: Optional[str]) -> tuple[dict, dict]:
+    """
+    bitrate/maxsize/max_fps пресета adaptive. Если канал измерить не удалось и
+    сохранённого результата нет - обычные значения по умолчанию.
+    """
+    result = await resolve_adaptive(app.state.adb_path, serial)
+    stream = result.get("settings")
+    if not stream:
+        defaults = DEFAULT_CONFIG["scrcpy"]
+        stream = {"bitrate": defaults["bitrate"], "maxsize": defaults["maxsize"], "max_fps": None}
+    return stream, result
+
+
+def _requested_video_codec(data: dict, config: dict) -> str:
+    """video_codec из запроса или настроек scrcpy: '', h264, h265, av1 или auto."""
+    value = data.get("video_codec")
+    if value is None:
+        value = config.get("scrcpy", {}).get("video_codec", "")
+    try:
+        return normalize_video_codec(value)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
 @app.get("/api/recording/status")
 async def recording_status():
     return _recording_status_payload()
 
 
-def _recording_watch(proc, adb_path, restore, logger):
-    output_lines = []
-    if proc.stdout:
-        for line in proc.stdout:
-            message = line.strip()
-            if message:
-                logger.info("recording: %s", message)
-                output_lines.append(message)
-                if len(output_lines) > 40:
-                    output_lines.pop(0)
-    proc.wait()
-    if restore:
-        _restore_device_settings(adb_path, restore)
-    logger.info("recording exited with code %s", proc.returncode)
-    session = getattr(app.state, "recording", None)
-    if session and session.get("process") == proc:
-        stopping = bool(session.get("stopping"))
-        app.state.recording = None
-        if proc.returncode != 0 and not stopping:
-            last_error = {
-                "exit_code": proc.returncode,
-                "timestamp": datetime.now().isoformat(),
-            }
-            if output_lines:
-                last_error["output"] = "\n".join(output_lines[-10:])
-            app.state.recording_last_error = last_error
+def _recording_segmentation(data: dict, recording_cfg: dict):
+    """Параметры ротации файлов записи; None - обычная запись одним файлом."""
+    values = {}
+    for key in ("segment_seconds", "segment_size_mb", "rolling_window_minutes"):
+        value = data.get(key, recording_cfg.get(key, 0))
+        try:
+            values[key] = float(value or 0)
+        except (TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail=f"{key} must be a number") from exc
+        if values[key] < 0:
+            raise HTTPException(status_code=400, detail=f"{key} must not be negative")
+    if not values["segment_seconds"] and not values["segment_size_mb"]:
+        if values["rolling_window_minutes"]:
+            raise HTTPException(
+                status_code=400, detail="rolling_window_minutes requires segment_seconds or segment_size_mb"
+            )
+        return None
+    if values["segment_seconds"] and values["segment_seconds"] < RECORDING_MIN_SEGMENT_SECONDS:
+        raise HTTPException(
+            status_code=400, detail=f"segment_seconds must be at least {RECORDING_MIN_SEGMENT_SECONDS}"
+        )
+    return {
+        "segment_seconds": int(values["segment_seconds"]),
+        "segment_size_mb": values["segment_size_mb"],
+        "rolling_window_minutes": values["rolling_window_minutes"],
+    }
 
 
-@app.post("/api/recording/start")
-async def start_recording(data: dict):
-    if _get_recording_session():
-        raise HTTPException(status_code=409, detail="Recording already active")
-
-    app.state.recording_last_error = None
-    config = _get_config()
+def _build_recording_plan(data: dict, config: dict) -> dict:
     recording_cfg = config.get("recording", {})
 
     output_dir = data.get("output_dir") or recording_cfg.get("output_dir") or str(
@@ -578,18 +680,31 @@ async def start_recording(data: dict):
     if fmt not in {"mp4", "mkv"}:
         raise HTTPException(status_code=400, detail="Unsupported format")
 
+    serial = data.get("serial")
     prefix = _sanitize_prefix(data.get("file_prefix") or recording_cfg.get("file_prefix"))
+    if serial:
+        # Несколько устройств пишутся одновременно - без serial имена совпали бы
+        prefix = f"{prefix}_{_sanitize_prefix(serial)}"
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{prefix}_{timestamp}.{fmt}"
     output_path = output_dir_path / filename
 
     bitrate = data.get("bitrate") or config.get("scrcpy", {}).get("bitrate", "8M")
     maxsize = data.get("maxsize") or config.get("scrcpy", {}).get("maxsize", "1080")
+    adaptive = is_adaptive(data, bitrate)
+    if adaptive:
+        # Битрейт, размер и fps подставляются после измерения канала (_apply_adaptive)
+        bitrate = maxsize = None
     keyboard = data.get("keyboard") or config.get("scrcpy", {}).get("keyboard", "uhid")
     keyboard, warning_key = _normalize_keyboard_mode(keyboard or "uhid")
+    video_codec = _requested_video_codec(data, config)
+
+    segmentation = _recording_segmentation(data, recording_cfg)
 
     cmd = [str(app.state.scrcpy_path)]
-    cmd.extend(["--record", str(output_path)])
+    if not segmentation:
+        # Для сегментированной записи --record подставляется на каждый сегмент отдельно
+        cmd.extend(["--record", str(output_path)])
     if bitrate:
         cmd.extend(["--video-bit-rate", str(bitrate)])
     if maxsize:
@@ -597,7 +712,6 @@ async def start_recording(data: dict):
     if keyboard:
         cmd.append(f"--keyboard={keyboard}")
 
-    serial = data.get("serial")
     if serial:
         cmd.extend(["--serial", serial])
     else:
@@ -617,7 +731,10 @@ async def start_recording(data: dict):
     show_preview = data.get("show_preview")
     if show_preview is None:
         show_preview = recording_cfg.get("show_preview", True)
-    if not show_preview:
+    if show_preview:
+        # Счётчик fps есть только у окна; без него остаются CPU/RSS процесса
+        cmd.append("--print-fps")
+    else:
         cmd.append("--no-window")
         cmd.append("--no-audio-playback")
 
@@ -636,114 +753,480 @@ async def start_recording(data: dict):
         show_touches = bool(data.get("show_touches"))
     else:
         show_touches = bool(recording_cfg.get("show_touches", False))
-    restore = _apply_device_settings(app.state.adb_path, stay_awake, show_touches)
 
-    logger = app.state.logger
+    # Для adaptive битрейт видео добавляется после измерения канала
+    write_bps = 0 if adaptive else parse_bitrate(bitrate or "8M")
+    if audio_source not in {"none", "off"}:
+        write_bps += AUDIO_BITRATE_BPS
+
+    return {
+        "cmd": cmd,
+        "output_path": str(output_path),
+        "filename": filename,
+        "segmentation": segmentation,
+        "index_path": str(output_path.with_suffix(SEGMENT_INDEX_SUFFIX)) if segmentation else None,
+        "stay_awake": stay_awake,
+        "show_touches": show_touches,
+        "write_bps": write_bps,
+        "warning_key": warning_key,
+        "video_codec": video_codec,
+        "adaptive": adaptive,
+        "settings": {
+            "format": fmt,
+            "audio_source": audio_source,
+            "show_preview": show_preview,
+            "serial": serial,
+            "connection": data.get("connection"),
+        },
+    }
+
+
+def _recording_finished(session, adb_path):
+    """on_exit-хук супервизора для записи."""
+    def _hook(managed):
+        transfer_governor.session_ended(f"recording-{managed.pid}")
+        if session.restore:
+            _restore_device_settings(adb_path, session.restore, session.serial)
+        recording_manager.finish(session, managed.exit_code)
+        _index_finished_file(session, session.output_path, session.started_at)
+
+    return _hook
 
+
+def _index_finished_file(session, path: str, started_at: Optional[str]):
+    """
+    Обновляет библиотеку записей по закрытому файлу и ставит MP4 на перенос moov
+    в начало; ошибка индекса не ломает запись.
+    """
     try:
-        creationflags = 0
-        if platform.system().lower().startswith("win"):
-            creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            creationflags=creationflags,
-        )
+        index_recording(path, session.serial, started_at, session.id)
+        schedule_faststart(path)
     except Exception as exc:
-        if restore:
-            _restore_device_settings(app.state.adb_path, restore)
-        raise HTTPException(status_code=500, detail=str(exc)) from exc
+        app.state.logger.warning("recording %s: library update failed for %s: %s", session.id, path, exc)
+
+
+def _segment_command(session, path: str) -> list:
+    cmd = [session.cmd[0], "--record", path, *session.cmd[1:]]
+    seconds = session.segmentation["segment_seconds"]
+    if seconds:
+        # scrcpy сам завершает запись по таймеру и корректно закрывает файл
+        cmd.append(f"--time-limit={seconds}")
+    return cmd
+
+
+async def _spawn_segment(session):
+    path = session.segment_path(len(session.segments) + 1)
+    managed = await supervisor.spawn(
+        "recording",
+        _segment_command(session, path),
+        serial=session.serial,
+        process_id=f"{session.id}-{len(session.segments) + 1}",
+        readiness=_scrcpy_probe(scrcpy_output.RECORDING_READY),
+        metrics=ProcessMetrics(scrcpy_output.parse_fps),
+    )
+    segment = session.open_segment(path)
+    session.process = managed
+    transfer_governor.session_started(session.serial, f"recording-{managed.pid}", "recording")
+    return managed, segment
+
+
+async def _rotate_by_size(session, managed, limit_bytes: int):
+    """Останавливает сегмент (SIGINT - scrcpy дописывает файл), когда он дорос до лимита."""
+    while managed.running:
+        await asyncio.sleep(RECORDING_SEGMENT_POLL_SECONDS)
+        try:
+            size = os.stat(session.output_path).st_size
+        except OSError:
+            continue
+        if size >= limit_bytes and managed.state == "running" and session.state == "recording":
+            await supervisor.stop(managed)
+            return
+
+
+async def _run_segments(session, managed, segment, adb_path, logger):
+    """
+    Контроллер сегментированной записи: по завершении сегмента (таймер --time-limit
+    или лимит размера) сразу запускает следующий и применяет скользящее окно.
+    """
+    segmentation = session.segmentation
+    limit_bytes = int(segmentation["segment_size_mb"] * 1024 * 1024)
+    window_seconds = segmentation["rolling_window_minutes"] * 60
+    failures = 0
+    error = None
+    exit_code = None
+    try:
+        while True:
+            rotation = asyncio.create_task(_rotate_by_size(session, managed, limit_bytes)) if limit_bytes else None
+            exit_code = await managed.wait()
+            if rotation:
+                rotation.cancel()
+            transfer_governor.session_ended(f"recording-{managed.pid}")
+            session.close_segment(segment, exit_code, managed.uptime)
+            await run_in_threadpool(
+                _index_finished_file, session, session.segment_file(segment), segment["started_at"]
+            )
+            if window_seconds:
+                removed = session.prune_segments(window_seconds)
+                if removed:
+                    logger.info("recording %s: rolling window removed %s", session.id, ", ".join(removed))
+            if session.state == "stopping":
+                break
+
+            if exit_code != 0:
+                failures += 1
+                # Первый сегмент не стартовал - это ошибка запуска, а не обрыв длинной записи
+                if len(session.segments) == 1 or failures >= RECORDING_SEGMENT_RETRIES:
+                    error = "\n".join(managed.tail(10)) or f"Segment exited with code {exit_code}"
+                    break
+                logger.info(
+                    "recording %s: segment %s exited with code %s, restarting",
+                    session.id, segment["index"], exit_code,
+                )
+                await asyncio.sleep(RECORDING_SEGMENT_RETRY_DELAY)
+                if session.state == "stopping":
+                    break
+            else:
+                failures = 0
 
-    await asyncio.sleep(0.4)
-    if proc.poll() is not None:
-        output = ""
-        if proc.stdout:
             try:
-                output, _ = proc.communicate(timeout=1)
-            except Exception:
-                output = ""
-        if restore:
-            _restore_device_settings(app.state.adb_path, restore)
-        logger.info("recording failed to start: exit code %s", proc.returncode)
-        if output:
-            logger.info("recording output: %s", output.strip())
-        detail = output.strip() if output else f"Recording failed to start (exit code {proc.returncode})."
-        app.state.recording_last_error = {
-            "exit_code": proc.returncode,
-            "timestamp": datetime.now().isoformat(),
-            "output": detail,
-        }
-        raise HTTPException(status_code=500, detail=detail)
+                managed, segment = await _spawn_segment(session)
+            except Exception as exc:
+                error = str(exc)
+                break
+    finally:
+        if session.restore:
+            await run_in_threadpool(_restore_device_settings, adb_path, session.restore, session.serial)
+        recording_manager.finish(session, exit_code, error=error)
+        session.write_index()
+        logger.info("recording %s finished after %s segments", session.id, len(session.segments))
 
-    settings = {
-        "format": fmt,
-        "audio_source": audio_source,
-        "show_preview": show_preview,
-        "serial": serial,
-        "connection": data.get("connection"),
-    }
 
-    app.state.recording = {
-        "process": proc,
-        "pid": proc.pid,
-        "started_at": datetime.now().isoformat(),
-        "output_path": str(output_path),
-        "settings": settings,
-        "restore": restore,
-        "stopping": False,
+async def _start_segmented(session, adb_path, logger):
+    try:
+        managed, segment = await _spawn_segment(session)
+    except Exception as exc:
+        if session.restore:
+            await run_in_threadpool(_restore_device_settings, adb_path, session.restore, session.serial)
+        recording_manager.finish(session, None, error=str(exc))
+        return
+    recording_manager.mark_started(session, managed)
+    session.task = asyncio.create_task(_run_segments(session, managed, segment, adb_path, logger))
+    logger.info(
+        "recording %s segmented %s: %s", session.id, session.segmentation, " ".join(managed.cmd)
+    )
+
+
+async def _launch_recordings(sessions, adb_path, logger):
+    """
+    Применяет настройки устройств параллельно, затем запускает все scrcpy подряд
+    в цикле событий - для группы это и есть синхронный старт.
+    """
+    async def _prepare(session):
+        session.restore = await run_in_threadpool(
+            _apply_device_settings, adb_path, session.stay_awake, session.show_touches, session.serial
+        )
+
+    await asyncio.gather(*(_prepare(session) for session in sessions))
+
+    async def _spawn(session):
+        if session.segmentation:
+            await _start_segmented(session, adb_path, logger)
+            return
+        try:
+            managed = await supervisor.spawn(
+                "recording",
+                session.cmd,
+                serial=session.serial,
+                process_id=session.id,
+                on_exit=[_recording_finished(session, adb_path)],
+                readiness=_scrcpy_probe(scrcpy_output.RECORDING_READY),
+                metrics=ProcessMetrics(scrcpy_output.parse_fps),
+            )
+        except Exception as exc:
+            if session.restore:
+                await run_in_threadpool(_restore_device_settings, adb_path, session.restore, session.serial)
+            recording_manager.finish(session, None, error=str(exc))
+            return
+        recording_manager.mark_started(session, managed)
+        transfer_governor.session_started(session.serial, f"recording-{managed.pid}", "recording")
+        logger.info("recording %s command: %s", session.id, " ".join(session.cmd))
+
+    await asyncio.gather(*(_spawn(session) for session in sessions))
+
+
+async def _apply_video_codec(plan: dict):
+    """Дописывает в команду записи кодек; auto разрешается по профилю устройства."""
+    codec_args, codec_info = await resolve_video_codec(
+        app.state.adb_path, app.state.scrcpy_path, plan.get("video_codec"), plan["settings"].get("serial")
+    )
+    plan["cmd"].extend(codec_args)
+    plan["settings"]["video_codec"] = codec_info
+
+
+async def _apply_adaptive(plan: dict):
+    """Дописывает в команду записи битрейт, размер и fps пресета adaptive."""
+    stream, result = await _adaptive_stream_settings(plan["settings"].get("serial"))
+    plan["cmd"].extend(["--video-bit-rate", str(stream["bitrate"]), "--max-size", str(stream["maxsize"])])
+    if stream["max_fps"]:
+        plan["cmd"].append(f"--max-fps={stream['max_fps']}")
+    plan["write_bps"] += parse_bitrate(stream["bitrate"])
+    plan["settings"]["adaptive"] = result
+
+
+async def _prepare_plan(plan: dict):
+    if plan.get("adaptive"):
+        await _apply_adaptive(plan)
+    await _apply_video_codec(plan)
+
+
+async def _start_recordings(plans, group_id=None):
+    # Профили и каналы устройств проверяются параллельно; повторно - только когда устарели
+    await asyncio.gather(*(_prepare_plan(plan) for plan in plans))
+    try:
+        sessions = recording_manager.reserve(plans, _get_config(), group_id)
+    except SessionConflict as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
+    except BudgetExceeded as exc:
+        raise HTTPException(status_code=503, detail=str(exc)) from exc
+
+    await _launch_recordings(sessions, app.state.adb_path, app.state.logger)
+    timeout = _recording_ready_timeout()
+    await asyncio.gather(*(_await_recording_ready(session, timeout) for session in sessions))
+    return sessions
+
+
+def _recording_ready_timeout() -> float:
+    value = _get_config().get("recording", {}).get("ready_timeout_s")
+    try:
+        return max(1.0, float(value or RECORDING_READY_TIMEOUT))
+    except (TypeError, ValueError):
+        return RECORDING_READY_TIMEOUT
+
+
+def _scrcpy_probe(ready):
+    return ReadinessProbe(ready, scrcpy_output.match_milestone, scrcpy_output.is_fatal)
+
+
+async def _await_recording_ready(session, timeout: float):
+    """
+    Ждёт строки scrcpy о начале записи (или известной ошибки, или выхода процесса)
+    вместо фиксированной паузы. Если до дедлайна строки нет, но файл записи
+    уже растёт, запись считается начавшейся (другие версии scrcpy пишут иначе).
+    """
+    managed = session.process
+    if managed is None:
+        return
+    summary = await supervisor.wait_ready(managed, timeout)
+    if summary["state"] == "timeout":
+        try:
+            written = os.stat(session.output_path).st_size
+        except OSError:
+            written = 0
+        if written > 0 and managed.running:
+            summary["state"] = "ready"
+            summary["via"] = "file"
+    session.startup = summary
+
+    if summary["state"] == "ready":
+        return
+    if summary["state"] == "exited":
+        # Супервизор дочитает вывод и выполнит хуки - после этого last_error заполнен
+        await (session.task if session.task else managed.wait())
+        return
+
+    if summary["state"] == "failed":
+        detail = summary["line"]
+    else:
+        detail = f"Recording did not start within {timeout:.0f} s"
+    if recording_manager.mark_stopping(session):
+        await supervisor.stop(managed)
+        if session.task:
+            await session.task
+    # Остановили сами - но для клиента это неудачный старт, а не штатное завершение
+    session.state = "failed"
+    session.last_error = {
+        "exit_code": managed.exit_code,
+        "timestamp": datetime.now().isoformat(),
+        "output": "\n".join([detail, *managed.tail(10)]),
     }
 
-    threading.Thread(
-        target=_recording_watch,
-        args=(proc, app.state.adb_path, restore, logger),
-        daemon=True,
-    ).start()
+
+def _start_failure_detail(session) -> str:
+    error = session.last_error or {}
+    if error.get("output"):
+        return error["output"]
+    if session.output_tail():
+        return "\n".join(session.output_tail(0))
+    return f"Recording failed to start (exit code {session.exit_code})."
+
+
+async def _start_single_recording(data: dict):
+    plan = _build_recording_plan(data, _get_config())
+    session = (await _start_recordings([plan]))[0]
+    logger = app.state.logger
+    if session.state != "recording":
+        detail = _start_failure_detail(session)
+        logger.info("recording failed to start: exit code %s", session.exit_code)
+        if session.state != "failed":
+            # Выход с кодом 0 сразу после запуска - тоже неудачный старт
+            session.state = "failed"
+            session.last_error = {
+                "exit_code": session.exit_code,
+                "timestamp": session.finished_at,
+                "output": detail,
+            }
+        raise HTTPException(status_code=500, detail=detail)
 
     logger.info("recording settings: %s", data)
-    logger.info("recording command: %s", " ".join(cmd))
+    return session, plan
+
+
+async def _stop_recordings(sessions) -> int:
+    sessions = [session for session in sessions if recording_manager.mark_stopping(session)]
+    await asyncio.gather(*(supervisor.stop(session.process) for session in sessions))
+    # Сегментированная запись завершается, когда контроллер закроет последний сегмент
+    await asyncio.gather(*(session.task for session in sessions if session.task))
+    return len(sessions)
 
+
+@app.post("/api/recording/start")
+async def start_recording(data: dict):
+    session, plan = await _start_single_recording(data)
     return {
         "success": True,
-        "pid": proc.pid,
-        "started_at": app.state.recording.get("started_at"),
-        "output_path": str(output_path),
-        "filename": filename,
-        "settings": settings,
-        "warning_key": warning_key,
+        "session_id": session.id,
+        "pid": session.pid,
+        "started_at": session.started_at,
+        "output_path": session.output_path,
+        "filename": session.filename,
+        "settings": session.settings,
+        "startup": session.startup,
+        "warning_key": plan["warning_key"],
     }
 
 
 @app.post("/api/recording/stop")
-async def stop_recording():
-    session = _get_recording_session()
-    if not session:
+async def stop_recording(data: Optional[dict] = Body(None)):
+    """Останавливает сессию по session_id или serial; без параметров - все записи."""
+    data = data or {}
+    sessions = recording_manager.active()
+    if data.get("session_id"):
+        sessions = [session for session in sessions if session.id == data["session_id"]]
+    elif data.get("serial"):
+        sessions = [session for session in sessions if session.serial == data["serial"]]
+    if not sessions:
         return {"success": False, "message": "No active recording"}
 
-    proc = session.get("process")
-    if not proc:
-        app.state.recording = None
-        return {"success": False, "message": "Recording process missing"}
+    stopped = await _stop_recordings(sessions)
+    return {"success": True, "stopped": stopped}
 
-    try:
-        session["stopping"] = True
-        if platform.system().lower().startswith("win"):
-            proc.send_signal(signal.CTRL_BREAK_EVENT)
-        else:
-            proc.send_signal(signal.SIGINT)
-        proc.wait(timeout=8)
-    except Exception:
-        try:
-            proc.terminate()
-            proc.wait(timeout=3)
-        except Exception:
-            try:
-                proc.kill()
-            except Exception:
-                pass
 
-    return {"success": True}
+@app.get("/api/recording/sessions")
+async def list_recording_sessions():
+    return {
+        "sessions": [session.snapshot() for session in recording_manager.active()],
+        "recent": [session.snapshot() for session in reversed(recording_manager.recent())],
+        "budget": recording_manager.budget(_get_config()),
+    }
+
+
+@app.post("/api/recording/sessions")
+async def create_recording_session(data: dict):
+    session, plan = await _start_single_recording(data)
+    return {"success": True, "session": session.snapshot(), "warning_key": plan["warning_key"]}
+
+
+@app.get("/api/recording/sessions/{session_id}")
+async def get_recording_session(session_id: str):
+    session = recording_manager.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Recording session not found")
+    return session.snapshot()
+
+
+@app.get("/api/recording/sessions/{session_id}/segments")
+async def get_recording_segments(session_id: str):
+    session = recording_manager.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Recording session not found")
+    if not session.segmentation:
+        raise HTTPException(status_code=400, detail="Recording is not segmented")
+    return session.segment_index()
+
+
+@app.post("/api/recording/sessions/{session_id}/stop")
+async def stop_recording_session(session_id: str):
+    session = recording_manager.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Recording session not found")
+    if not session.active:
+        return {"success": False, "message": "Recording is not active", "session": session.snapshot()}
+    await _stop_recordings([session])
+    return {"success": True, "session": session.snapshot()}
+
+
+@app.post("/api/recording/groups")
+async def start_recording_group(data: dict):
+    """
+    Синхронный старт записи на нескольких устройствах.
+
+    Настройки устройств применяются параллельно, затем все scrcpy запускаются
+    одновременно. Общие параметры - как у /api/recording/start,
+    индивидуальные можно передать в overrides: {serial: {...}}.
+    """
+    serials = list(dict.fromkeys(data.get("serials") or []))
+    if not serials:
+        raise HTTPException(status_code=400, detail="serials required")
+    if len(serials) > RECORDING_GROUP_MAX_DEVICES:
+        raise HTTPException(
+            status_code=400, detail=f"At most {RECORDING_GROUP_MAX_DEVICES} devices per group"
+        )
+
+    config = _get_config()
+    overrides = data.get("overrides") or {}
+    common = {key: value for key, value in data.items() if key not in ("serials", "overrides")}
+    plans = [
+        _build_recording_plan({**common, **overrides.get(serial, {}), "serial": serial}, config)
+        for serial in serials
+    ]
+    group_id = uuid.uuid4().hex[:12]
+    sessions = await _start_recordings(plans, group_id)
+
+    launched = [session.launched_monotonic for session in sessions if session.launched_monotonic]
+    skew_ms = round((max(launched) - min(launched)) * 1000, 1) if len(launched) > 1 else 0.0
+    started = [session for session in sessions if session.state == "recording"]
+    # Момент, когда scrcpy реально начал писать, - по строке вывода
+    ready = [
+        session.process.readiness.ready_monotonic
+        for session in started
+        if session.process.readiness and session.process.readiness.ready_monotonic
+    ]
+    ready_skew_ms = round((max(ready) - min(ready)) * 1000, 1) if len(ready) > 1 else None
+    app.state.logger.info(
+        "recording group %s: started=%s of %s skew=%.1fms", group_id, len(started), len(sessions), skew_ms
+    )
+    return {
+        "success": len(started) == len(sessions),
+        "group_id": group_id,
+        "started": len(started),
+        "launch_skew_ms": skew_ms,
+        "ready_skew_ms": ready_skew_ms,
+        "sessions": [session.snapshot() for session in sessions],
+    }
+
+
+@app.post("/api/recording/groups/{group_id}/stop")
+async def stop_recording_group(group_id: str):
+    sessions = recording_manager.group(group_id)
+    if not sessions:
+        raise HTTPException(status_code=404, detail="Recording group not found")
+    stopped = await _stop_recordings([session for session in sessions if session.active])
+    return {"success": True, "stopped": stopped, "sessions": [session.snapshot() for session in sessions]}
+
+
+@app.get("/api/recording/budget")
+async def recording_budget():
+    return recording_manager.budget(_get_config())
 
 
 @app.get("/api/logs/download")
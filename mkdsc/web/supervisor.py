@@ -0,0 +1,491 @@
+"""
+Единый asyncio-супервизор дочерних процессов (scrcpy: трансляция и запись).
+
+Вместо отдельного потока на каждый процесс (proc.wait() + чтение stdout)
+все процессы обслуживает цикл событий сервера:
+- stdout/stderr читаются построчно в кольцевой буфер ограниченного размера;
+- после выхода процесса выполняются on_exit-хуки (например, восстановление
+  настроек устройства) - в пуле потоков, не блокируя цикл;
+- подписчики получают события жизненного цикла (started, ready, failed,
+  stopping, exited); ready/failed определяются по строкам вывода (ReadinessProbe);
+- реестр хранит запущенные и недавно завершённые процессы с PID,
+  временем работы и кодом выхода;
+- у процессов с телеметрией (ProcessMetrics) раз в секунду снимается отсчёт
+  fps/CPU/RSS, подписчики получают их одним событием metrics;
+- shutdown() корректно останавливает все процессы разом.
+
+Эндпоинты:
+- GET /api/processes - запущенные и недавно завершённые процессы
+- GET /api/processes/metrics - последние метрики запущенных процессов (fps, CPU, RSS)
+- GET /api/processes/{process_id}/metrics - ряд метрик процесса
+- GET /api/processes/{process_id} - процесс и хвост его вывода
+- POST /api/processes/{process_id}/stop - остановить процесс
+"""
+import asyncio
+import platform
+import signal
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from starlette.concurrency import run_in_threadpool
+
+from mkdsc.web.process_metrics import METRICS_HISTORY_POINTS, SAMPLE_INTERVAL_SECONDS, ProcessMetrics
+from mkdsc.web.recording_sessions import manager as recording_manager
+
+router = APIRouter(prefix="/api/processes", tags=["processes"])
+
+OUTPUT_BUFFER_LINES = 200
+RECENT_PROCESSES_LIMIT = 50
+STOP_TIMEOUT_SECONDS = 8
+TERMINATE_TIMEOUT_SECONDS = 3
+READ_CHUNK_SIZE = 64 * 1024
+
+ExitHook = Callable[["ManagedProcess"], None]
+EventListener = Callable[[dict], None]
+
+
+class ReadinessProbe:
+    """
+    Готовность процесса по его выводу.
+
+    milestone(line) возвращает имя вехи (или None), fatal(line) - признак
+    ошибки, после которой процесс уже не заработает. Процесс готов,
+    когда достигнута любая из вех ready.
+    """
+
+    def __init__(
+        self,
+        ready: Iterable[str],
+        milestone: Callable[[str], Optional[str]],
+        fatal: Callable[[str], bool],
+    ):
+        self.ready = tuple(ready)
+        self.milestone = milestone
+        self.fatal = fatal
+        self.state = "pending"
+        self.line: Optional[str] = None
+        self.milestones: dict = {}
+        self.ready_monotonic: Optional[float] = None
+        self._started = time.monotonic()
+        self._event = asyncio.Event()
+
+    def _elapsed_ms(self) -> float:
+        return round((time.monotonic() - self._started) * 1000, 1)
+
+    def feed(self, line: str) -> Optional[str]:
+        """Обрабатывает строку вывода; возвращает новое состояние, если оно изменилось."""
+        if self.state != "pending":
+            return None
+        if self.fatal(line):
+            self.state = "failed"
+            self.line = line
+            self._event.set()
+            return self.state
+        name = self.milestone(line)
+        if name and name not in self.milestones:
+            self.milestones[name] = self._elapsed_ms()
+            if name in self.ready:
+                self.state = "ready"
+                self.line = line
+                self.ready_monotonic = time.monotonic()
+                self._event.set()
+                return self.state
+        return None
+
+    def exited(self):
+        if self.state == "pending":
+            self.state = "exited"
+            self._event.set()
+
+    async def wait(self, timeout: float) -> dict:
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {**self.summary(), "state": "timeout"}
+        return self.summary()
+
+    def summary(self) -> dict:
+        return {
+            "state": self.state,
+            "elapsed_ms": self._elapsed_ms(),
+            "milestones": dict(self.milestones),
+            "line": self.line,
+        }
+
+
+class ManagedProcess:
+    """Дочерний процесс под управлением супервизора."""
+
+    def __init__(
+        self,
+        kind: str,
+        cmd: List[str],
+        serial: Optional[str] = None,
+        process_id: Optional[str] = None,
+        on_exit: Optional[List[ExitHook]] = None,
+        readiness: Optional[ReadinessProbe] = None,
+        metrics: Optional[ProcessMetrics] = None,
+    ):
+        self.id = process_id or uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.cmd = list(cmd)
+        self.serial = serial
+        self.on_exit: List[ExitHook] = list(on_exit or [])
+        self.state = "starting"
+        self.pid: Optional[int] = None
+        self.exit_code: Optional[int] = None
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.started_monotonic: Optional[float] = None
+        self.finished_monotonic: Optional[float] = None
+        # (время, поток, строка); старые строки вытесняются
+        self.output = deque(maxlen=OUTPUT_BUFFER_LINES)
+        self.output_lines = 0
+        self.line_listeners: List[Callable[["ManagedProcess", str, str], None]] = []
+        self.stop_requested = False
+        self.readiness = readiness
+        self.metrics = metrics
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._done = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("starting", "running", "stopping")
+
+    @property
+    def uptime(self) -> Optional[float]:
+        if self.started_monotonic is None:
+            return None
+        end = self.finished_monotonic or time.monotonic()
+        return round(end - self.started_monotonic, 1)
+
+    def tail(self, lines: int = 10, stream: Optional[str] = None) -> List[str]:
+        items = [text for _, name, text in self.output if stream is None or name == stream]
+        return items[-lines:] if lines else items
+
+    async def wait(self) -> Optional[int]:
+        """Ждёт выхода процесса и выполнения on_exit-хуков."""
+        await self._done.wait()
+        return self.exit_code
+
+    def snapshot(self, output_lines: int = 0) -> dict:
+        payload = {
+            "process_id": self.id,
+            "kind": self.kind,
+            "serial": self.serial,
+            "state": self.state,
+            "pid": self.pid,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "uptime_s": self.uptime,
+            "exit_code": self.exit_code,
+            "command": " ".join(self.cmd),
+            "output_lines": self.output_lines,
+        }
+        if self.readiness is not None:
+            payload["readiness"] = self.readiness.summary()
+        if self.metrics is not None:
+            payload["metrics"] = self.metrics.summary()
+        if output_lines:
+            payload["output"] = [
+                {"time": stamp, "stream": name, "line": text}
+                for stamp, name, text in list(self.output)[-output_lines:]
+            ]
+        return payload
+
+
+class ProcessSupervisor:
+    """Реестр и цикл обслуживания всех дочерних процессов сервера."""
+
+    def __init__(self):
+        self._running: dict = {}
+        self._recent = deque(maxlen=RECENT_PROCESSES_LIMIT)
+        self._listeners: List[EventListener] = []
+        self._tasks: set = set()
+        self._sampler: Optional[asyncio.Task] = None
+        self.logger = None
+
+    def subscribe(self, listener: EventListener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener: EventListener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _emit(self, event: str, managed: ManagedProcess, **extra):
+        self._notify({
+            "event": event,
+            "timestamp": datetime.now().isoformat(),
+            **managed.snapshot(),
+            **extra,
+        })
+
+    def _notify(self, payload: dict):
+        for listener in list(self._listeners):
+            try:
+                listener(payload)
+            except Exception as exc:
+                if self.logger:
+                    self.logger.warning("supervisor.listener event=%s error=%s", payload["event"], exc)
+
+    def get(self, process_id: str) -> Optional[ManagedProcess]:
+        managed = self._running.get(process_id)
+        if managed is None:
+            managed = next((item for item in self._recent if item.id == process_id), None)
+        return managed
+
+    def running(self, kind: Optional[str] = None) -> List[ManagedProcess]:
+        return [item for item in self._running.values() if kind is None or item.kind == kind]
+
+    def recent(self) -> List[ManagedProcess]:
+        return list(self._recent)
+
+    async def spawn(
+        self,
+        kind: str,
+        cmd: List[str],
+        serial: Optional[str] = None,
+        process_id: Optional[str] = None,
+        on_exit: Optional[List[ExitHook]] = None,
+        readiness: Optional[ReadinessProbe] = None,
+        metrics: Optional[ProcessMetrics] = None,
+    ) -> ManagedProcess:
+        """Запускает процесс и берёт его на обслуживание; ошибки запуска пробрасываются."""
+        managed = ManagedProcess(kind, cmd, serial, process_id, on_exit, readiness, metrics)
+        kwargs = {}
+        if platform.system().lower().startswith("win"):
+            # Отдельная группа, чтобы CTRL_BREAK_EVENT дошёл только до этого процесса
+            kwargs["creationflags"] = 0x00000200  # CREATE_NEW_PROCESS_GROUP
+        process = await asyncio.create_subprocess_exec(
+            *managed.cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            **kwargs,
+        )
+        managed._process = process
+        managed.pid = process.pid
+        managed.state = "running"
+        managed.started_at = datetime.now().isoformat()
+        managed.started_monotonic = time.monotonic()
+        self._running[managed.id] = managed
+
+        task = asyncio.create_task(self._watch(managed))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if metrics is not None and (self._sampler is None or self._sampler.done()):
+            self._sampler = asyncio.create_task(self._sample_metrics())
+        self._emit("started", managed)
+        return managed
+
+    async def _sample_metrics(self):
+        """Раз в секунду снимает отсчёт со всех процессов с телеметрией; выходит, когда их не осталось."""
+        while True:
+            await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
+            measured = [item for item in self._running.values() if item.metrics is not None and item.running]
+            if not measured:
+                self._sampler = None
+                return
+            points = []
+            for managed in measured:
+                point = managed.metrics.sample(managed.pid)
+                points.append({
+                    "process_id": managed.id,
+                    "kind": managed.kind,
+                    "serial": managed.serial,
+                    **point,
+                })
+            self._notify({"event": "metrics", "timestamp": datetime.now().isoformat(), "processes": points})
+
+    async def _read_stream(self, managed: ManagedProcess, reader: asyncio.StreamReader, name: str):
+        while True:
+            try:
+                raw = await reader.readline()
+            except ValueError:
+                # Строка длиннее буфера StreamReader - дочитываем кусок как есть
+                raw = await reader.read(READ_CHUNK_SIZE)
+            if not raw:
+                return
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            if not line:
+                continue
+            # Отчёты fps идут каждую секунду - в буфер вывода и лог они не пишутся
+            if managed.metrics is not None and managed.metrics.feed(line):
+                continue
+            managed.output.append((datetime.now().isoformat(), name, line))
+            managed.output_lines += 1
+            if self.logger:
+                self.logger.info("%s[%s] %s: %s", managed.kind, managed.id, name, line)
+            if managed.readiness is not None:
+                state = managed.readiness.feed(line)
+                if state:
+                    self._emit(state, managed, line=line)
+            for listener in list(managed.line_listeners):
+                try:
+                    listener(managed, name, line)
+                except Exception as exc:
+                    if self.logger:
+                        self.logger.warning("supervisor.line_listener id=%s error=%s", managed.id, exc)
+
+    async def _watch(self, managed: ManagedProcess):
+        process = managed._process
+        try:
+            await asyncio.gather(
+                self._read_stream(managed, process.stdout, "stdout"),
+                self._read_stream(managed, process.stderr, "stderr"),
+            )
+            managed.exit_code = await process.wait()
+        finally:
+            if managed.readiness is not None:
+                managed.readiness.exited()
+            managed.finished_monotonic = time.monotonic()
+            managed.finished_at = datetime.now().isoformat()
+            managed.state = "exited"
+            for hook in managed.on_exit:
+                try:
+                    await run_in_threadpool(hook, managed)
+                except Exception as exc:
+                    if self.logger:
+                        self.logger.warning("supervisor.on_exit id=%s error=%s", managed.id, exc)
+            self._running.pop(managed.id, None)
+            self._recent.append(managed)
+            managed._done.set()
+            if self.logger:
+                self.logger.info(
+                    "%s[%s] exited with code %s after %ss", managed.kind, managed.id, managed.exit_code, managed.uptime
+                )
+            self._emit("exited", managed)
+
+    async def wait_ready(self, managed: ManagedProcess, timeout: float) -> dict:
+        """
+        Ждёт, пока процесс станет готов, упадёт с известной ошибкой или выйдет,
+        но не дольше timeout; возвращает итог с таймингами вех запуска.
+        """
+        if managed.readiness is None:
+            raise ValueError("Process has no readiness probe")
+        return await managed.readiness.wait(timeout)
+
+    async def stop(self, managed: ManagedProcess, timeout: float = STOP_TIMEOUT_SECONDS) -> bool:
+        """
+        SIGINT (CTRL_BREAK на Windows), чтобы scrcpy корректно дописал файл записи;
+        если процесс не вышел за timeout - terminate, затем kill.
+        """
+        process = managed._process
+        if process is None or not managed.running:
+            return False
+        if managed.state != "stopping":
+            managed.state = "stopping"
+            managed.stop_requested = True
+            self._emit("stopping", managed)
+        try:
+            if platform.system().lower().startswith("win"):
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                process.send_signal(signal.SIGINT)
+            await asyncio.wait_for(process.wait(), timeout)
+        except ProcessLookupError:
+            pass
+        except asyncio.TimeoutError:
+            try:
+                process.terminate()
+                await asyncio.wait_for(process.wait(), TERMINATE_TIMEOUT_SECONDS)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+        await managed.wait()
+        return True
+
+    async def shutdown(self, timeout: float = STOP_TIMEOUT_SECONDS):
+        """Останавливает все процессы одновременно и дожидается их хуков."""
+        processes = list(self._running.values())
+        if processes:
+            await asyncio.gather(
+                *(self.stop(managed, timeout) for managed in processes), return_exceptions=True
+            )
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+
+
+supervisor = ProcessSupervisor()
+
+
+@router.get("")
+async def list_processes(kind: Optional[str] = Query(None)):
+    """Запущенные и недавно завершённые процессы."""
+    return {
+        "running": [item.snapshot() for item in supervisor.running(kind)],
+        "recent": [
+            item.snapshot() for item in reversed(supervisor.recent()) if kind is None or item.kind == kind
+        ],
+    }
+
+
+@router.get("/metrics")
+async def processes_metrics(kind: Optional[str] = Query(None)):
+    """Сводка метрик запущенных процессов: кто из устройств реально выдаёт 60 fps."""
+    return {
+        "interval_s": SAMPLE_INTERVAL_SECONDS,
+        "processes": [
+            {
+                "process_id": item.id,
+                "kind": item.kind,
+                "serial": item.serial,
+                "uptime_s": item.uptime,
+                **item.metrics.summary(),
+            }
+            for item in supervisor.running(kind)
+            if item.metrics is not None
+        ],
+    }
+
+
+@router.get("/{process_id}/metrics")
+async def get_process_metrics(
+    process_id: str,
+    seconds: Optional[int] = Query(None, ge=1, le=int(METRICS_HISTORY_POINTS * SAMPLE_INTERVAL_SECONDS)),
+):
+    """Ряд отсчётов процесса (по умолчанию вся история в буфере)."""
+    managed = supervisor.get(process_id)
+    if not managed:
+        raise HTTPException(status_code=404, detail="Process not found")
+    if managed.metrics is None:
+        raise HTTPException(status_code=404, detail="Process has no metrics")
+    return {
+        "process_id": managed.id,
+        "state": managed.state,
+        "interval_s": SAMPLE_INTERVAL_SECONDS,
+        "summary": managed.metrics.summary(),
+        "samples": managed.metrics.series(seconds),
+    }
+
+
+@router.get("/{process_id}")
+async def get_process(process_id: str, lines: int = Query(50, ge=0, le=OUTPUT_BUFFER_LINES)):
+    """Процесс и последние строки его вывода."""
+    managed = supervisor.get(process_id)
+    if not managed:
+        raise HTTPException(status_code=404, detail="Process not found")
+    return managed.snapshot(output_lines=lines)
+
+
+@router.post("/{process_id}/stop")
+async def stop_process(process_id: str):
+    """Останавливает процесс (запись при этом корректно завершается)."""
+    managed = supervisor.get(process_id)
+    if not managed:
+        raise HTTPException(status_code=404, detail="Process not found")
+    session = recording_manager.for_process(managed) if managed.kind == "recording" else None
+    if session is not None:
+        # Останавливается вся запись: иначе контроллер сегментов принял бы выход за ротацию
+        recording_manager.mark_stopping(session)
+    stopped = await supervisor.stop(managed)
+    return {"success": stopped, "process": managed.snapshot()}
@@ -0,0 +1,286 @@
+"""
+Ограничение пропускной способности файловых передач по устройствам.
+
+Все передачи (pull/push/параллельный pull) одного устройства проходят через общий
+token bucket. Пока на том же serial идёт трансляция или запись scrcpy, его лимит
+автоматически снижается до session_rate_mbps, чтобы передачи не забивали Wi-Fi
+канал живой сессии. Фоновые передачи дополнительно проходят через вложенный bucket
+background_rate_mbps, так что суммарный поток устройства не превышает session_rate_mbps.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+ANY_DEVICE = "*"
+DEFAULT_KEY = "-"
+RATE_SAMPLE_SECONDS = 1.0
+
+DEFAULT_TRANSFER_CONFIG = {
+    "max_rate_mbps": 0,
+    "session_rate_mbps": 8,
+    "background_rate_mbps": 4,
+}
+
+
+def _mbps_to_bytes(value) -> Optional[float]:
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None
+    if rate <= 0:
+        return None
+    return rate * 1_000_000 / 8
+
+
+class TokenBucket:
+    """Классический token bucket: rate байт/с, ёмкость burst байт. rate=None - без ограничения."""
+
+    def __init__(self, rate: Optional[float] = None, burst_seconds: float = 0.25):
+        self._lock = threading.Lock()
+        self._burst_seconds = burst_seconds
+        self.rate = rate
+        self._tokens = self._capacity()
+        self._updated = time.monotonic()
+
+    def _capacity(self) -> float:
+        if not self.rate:
+            return 0.0
+        return max(self.rate * self._burst_seconds, 64 * 1024)
+
+    def set_rate(self, rate: Optional[float]):
+        with self._lock:
+            if rate == self.rate:
+                return
+            self.rate = rate
+            self._tokens = min(self._tokens, self._capacity())
+
+    def consume(self, amount: int):
+        """Блокирует вызывающий поток, пока не накопится amount токенов."""
+        while True:
+            with self._lock:
+                if not self.rate:
+                    return
+                now = time.monotonic()
+                capacity = self._capacity()
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Крупные блоки берём частями, иначе они никогда не поместятся в bucket
+                needed = min(amount, capacity)
+                if self._tokens >= needed:
+                    self._tokens -= needed
+                    amount -= needed
+                    if amount <= 0:
+                        return
+                    continue
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(min(wait, 0.5))
+
+
+class Transfer:
+    """Активная передача: считает байты и достигнутую скорость."""
+
+    def __init__(self, governor: "TransferGovernor", key: str, kind: str, path: str, background: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.governor = governor
+        self.key = key
+        self.kind = kind
+        self.path = path
+        self.background = background
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self._window_start = self.started
+        self._window_bytes = 0
+        self.current_rate = 0.0
+
+    def consume(self, amount: int):
+        """Учитывает amount байт и при необходимости притормаживает поток."""
+        for bucket in self.governor.buckets_for(self.key, self.background):
+            bucket.consume(amount)
+        self.record(amount)
+
+    def record(self, amount: int):
+        """Учитывает байты без ограничения (нативный adb pull/push)."""
+        with self._lock:
+            self.bytes += amount
+            self._window_bytes += amount
+            now = time.monotonic()
+            if now - self._window_start >= RATE_SAMPLE_SECONDS:
+                self.current_rate = self._window_bytes / (now - self._window_start)
+                self._window_start = now
+                self._window_bytes = 0
+
+    def snapshot(self) -> dict:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "path": self.path,
+            "background": self.background,
+            "bytes": self.bytes,
+            "elapsed_s": round(elapsed, 2),
+            "average_mbps": round(self.bytes * 8 / elapsed / 1_000_000, 2),
+            "current_mbps": round(self.current_rate * 8 / 1_000_000, 2),
+        }
+
+
+class TransferGovernor:
+    """Хранит лимиты, активные сессии scrcpy и передачи по каждому устройству."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.defaults = dict(DEFAULT_TRANSFER_CONFIG)
+        self._overrides = {}
+        self._sessions = {}
+        self._transfers = {}
+        self._buckets = {}
+        self._background_buckets = {}
+        self._totals = {}
+
+    @staticmethod
+    def _key(serial: Optional[str]) -> str:
+        return serial or DEFAULT_KEY
+
+    def load_config(self, config: Optional[dict]):
+        transfers_cfg = (config or {}).get("transfers", {}) if isinstance(config, dict) else {}
+        with self._lock:
+            for name, value in DEFAULT_TRANSFER_CONFIG.items():
+                self.defaults[name] = transfers_cfg.get(name, value)
+        self._refresh_buckets()
+
+    def set_limits(self, serial: Optional[str], limits: dict):
+        """Переопределяет лимиты (Мбит/с) для устройства; serial=None меняет значения по умолчанию."""
+        with self._lock:
+            if serial is None:
+                target = self.defaults
+            else:
+                target = self._overrides.setdefault(serial, {})
+            for name in DEFAULT_TRANSFER_CONFIG:
+                if name in limits:
+                    target[name] = limits[name]
+        self._refresh_buckets()
+
+    def session_started(self, serial: Optional[str], session_id: str, kind: str):
+        """Регистрирует живую сессию scrcpy; serial=None - устройство выбрано автоматически."""
+        with self._lock:
+            self._sessions[session_id] = {
+                "serial": serial or ANY_DEVICE,
+                "kind": kind,
+                "started_at": time.time(),
+            }
+        self._refresh_buckets()
+
+    def session_ended(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self._refresh_buckets()
+
+    def _session_active(self, key: str) -> bool:
+        return any(
+            session["serial"] in (key, ANY_DEVICE) or key == DEFAULT_KEY
+            for session in self._sessions.values()
+        )
+
+    def _limit(self, key: str, name: str):
+        override = self._overrides.get(key, {})
+        return override.get(name, self.defaults.get(name))
+
+    def _device_rate(self, key: str) -> Optional[float]:
+        """Общий лимит устройства - для всех передач вместе."""
+        rates = [_mbps_to_bytes(self._limit(key, "max_rate_mbps"))]
+        if self._session_active(key):
+            rates.append(_mbps_to_bytes(self._limit(key, "session_rate_mbps")))
+        rates = [rate for rate in rates if rate]
+        return min(rates) if rates else None
+
+    def _background_rate(self, key: str) -> Optional[float]:
+        """Дополнительный лимит фоновых передач внутри общего bucket устройства."""
+        if not self._session_active(key):
+            return None
+        return _mbps_to_bytes(self._limit(key, "background_rate_mbps"))
+
+    def _effective_rate(self, key: str, background: bool) -> Optional[float]:
+        rates = [self._device_rate(key)]
+        if background:
+            rates.append(self._background_rate(key))
+        rates = [rate for rate in rates if rate]
+        return min(rates) if rates else None
+
+    def _refresh_buckets(self):
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                bucket.set_rate(self._device_rate(key))
+            for key, bucket in self._background_buckets.items():
+                bucket.set_rate(self._background_rate(key))
+
+    def bucket_for(self, key: str) -> TokenBucket:
+        """Общий bucket устройства."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self._device_rate(key))
+                self._buckets[key] = bucket
+            return bucket
+
+    def buckets_for(self, key: str, background: bool) -> list[TokenBucket]:
+        """Цепочка bucket, через которую проходит передача: сначала лимит класса, затем устройства."""
+        buckets = [self.bucket_for(key)]
+        if background:
+            with self._lock:
+                bucket = self._background_buckets.get(key)
+                if bucket is None:
+                    bucket = TokenBucket(self._background_rate(key))
+                    self._background_buckets[key] = bucket
+            buckets.insert(0, bucket)
+        return buckets
+
+    def is_limited(self, serial: Optional[str], background: bool = False) -> bool:
+        """Нужно ли вести передачу через управляемый поток вместо нативного adb pull/push."""
+        with self._lock:
+            return self._effective_rate(self._key(serial), background) is not None
+
+    @contextmanager
+    def transfer(self, serial: Optional[str], kind: str, path: str, background: bool = False):
+        key = self._key(serial)
+        item = Transfer(self, key, kind, path, background)
+        with self._lock:
+            self._transfers[item.id] = item
+        try:
+            yield item
+        finally:
+            with self._lock:
+                self._transfers.pop(item.id, None)
+                totals = self._totals.setdefault(key, {"bytes": 0, "transfers": 0})
+                totals["bytes"] += item.bytes
+                totals["transfers"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            keys = set(self._overrides) | set(self._totals)
+            keys |= {item.key for item in self._transfers.values()}
+            keys |= {session["serial"] for session in self._sessions.values() if session["serial"] != ANY_DEVICE}
+            devices = []
+            for key in sorted(keys):
+                foreground = self._effective_rate(key, False)
+                background = self._effective_rate(key, True)
+                devices.append({
+                    "serial": None if key == DEFAULT_KEY else key,
+                    "throttled": self._session_active(key),
+                    "limits": {name: self._limit(key, name) for name in DEFAULT_TRANSFER_CONFIG},
+                    "effective_mbps": round(foreground * 8 / 1_000_000, 2) if foreground else None,
+                    "effective_background_mbps": round(background * 8 / 1_000_000, 2) if background else None,
+                    "transfers": [item.snapshot() for item in self._transfers.values() if item.key == key],
+                    "totals": dict(self._totals.get(key, {"bytes": 0, "transfers": 0})),
+                })
+            return {
+                "defaults": dict(self.defaults),
+                "sessions": [
+                    {"id": session_id, **session} for session_id, session in self._sessions.items()
+                ],
+                "devices": devices,
+            }
+
+
+governor = TransferGovernor()
@@ -0,0 +1,54 @@
+"""
+Общий пул процессов для CPU-тяжёлых задач (декодирование, кодирование изображений).
+Пул создаётся лениво при первой задаче и закрывается при остановке сервера.
+"""
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def pool_size() -> int:
+    """Оставляем одно ядро под сервер, adb и scrcpy."""
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=pool_size())
+        return _POOL
+
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is broken:
+            _POOL = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_process(func, *args):
+    """Выполняет func(*args) в пуле процессов, не блокируя event loop."""
+    pool = get_process_pool()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # Упавший воркер ломает весь пул - пересоздадим его при следующей задаче
+        _reset_pool(pool)
+        raise
+
+
+def shutdown_process_pool():
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,84 @@
+"""
+Потоковая сборка zip-архива без временного файла.
+
+zipfile умеет писать в поток без seek (локальные заголовки + data descriptor),
+поэтому архив отдаётся клиенту по мере чтения файлов. Уже сжатые данные
+(PNG, WebP, MP4) кладутся как ZIP_STORED - без повторного сжатия.
+"""
+import time
+import zipfile
+from typing import Callable, Iterable, Iterator, Optional, Tuple
+
+CHUNK_SIZE = 1024 * 1024
+
+# (имя в архиве, mtime, размер или None, источник байтов)
+ZipMember = Tuple[str, float, Optional[int], Iterable[bytes]]
+
+
+class _ChunkSink:
+    """Минимальный файловый объект для zipfile: копит записанное до следующего yield."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_file(path, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open(path, "rb") as source:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _zip_info(name: str, mtime: float, size: Optional[int], compress: bool) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=time.localtime(max(mtime, 315532800))[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    info.external_attr = 0o644 << 16
+    if size is not None:
+        # По заявленному размеру zipfile решает, нужен ли ZIP64 для записи
+        info.file_size = size
+    return info
+
+
+def iter_zip(
+    members: Iterable[ZipMember],
+    trailer: Optional[Callable[[], Optional[Tuple[str, bytes]]]] = None,
+) -> Iterator[bytes]:
+    """
+    Генерирует байты zip-архива.
+
+    trailer() вызывается после всех членов и может вернуть (имя, bytes) -
+    например, манифест с фактически попавшими в архив файлами.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", allowZip64=True) as archive:
+        for name, mtime, size, chunks in members:
+            info = _zip_info(name, mtime, size, compress=False)
+            with archive.open(info, "w", force_zip64=bool(size and size > zipfile.ZIP64_LIMIT)) as dest:
+                for chunk in chunks:
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            data = sink.drain()
+            if data:
+                yield data
+        if trailer is not None:
+            extra = trailer()
+            if extra:
+                name, payload = extra
+                archive.writestr(_zip_info(name, time.time(), None, compress=True), payload)
+    yield sink.drain()
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 
 from mkdsc.web.server import run_server
@@ -12,4 +13,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # Пул процессов (mkdsc.web.workers) в собранном PyInstaller-бинаре
+    multiprocessing.freeze_support()
     main()